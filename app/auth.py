@@ -1,16 +1,30 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt
 from passlib.context import CryptContext
 from .config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = 12
+# min = max = default: a hash with any other cost "needs update" and is rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 ALGO = "HS256"
 
-def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
+# bcrypt is CPU-bound; keep it off the event loop on a bounded pool
+_hash_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pwhash")
 
-def hash_password(password):
-    return pwd_context.hash(password)
+async def verify_password(plain, hashed):
+    """Returns (ok, new_hash); new_hash is set when the stored hash should be replaced."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, pwd_context.verify_and_update, plain, hashed)
+
+async def hash_password(password):
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_minutes: int = None):
     to_encode = data.copy()
@@ -2,6 +2,7 @@ import uvicorn
 from fastapi import FastAPI
 from .config import settings
 from .db import database, connect_db, disconnect_db
+from .telegram_client import telegram as telegram_client
 from .routers import auth, tickets, tools, auto_replies, users, telegram
 
 app = FastAPI(title="Cafenet Admin API")
@@ -9,9 +10,11 @@ app = FastAPI(title="Cafenet Admin API")
 @app.on_event("startup")
 async def startup():
     await connect_db()
+    await telegram_client.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await telegram_client.close()
     await disconnect_db()
 
 # include routers
@@ -10,7 +10,12 @@ router = APIRouter()
 async def login(payload: AdminIn):
     q = "SELECT id, username, password_hash, full_name FROM admins WHERE username=$1"
     row = await database.fetch_one(q, values=[payload.username])
-    if not row or not verify_password(payload.password, row["password_hash"]):
+    if not row:
         raise HTTPException(401, "Invalid credentials")
+    ok, new_hash = await verify_password(payload.password, row["password_hash"])
+    if not ok:
+        raise HTTPException(401, "Invalid credentials")
+    if new_hash:
+        await database.execute("UPDATE admins SET password_hash=$1 WHERE id=$2", values=[new_hash, row["id"]])
     access = create_access_token({"sub": row["username"], "admin_id": row["id"]})
     return {"access_token": access}
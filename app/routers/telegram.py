@@ -1,6 +1,5 @@
 from fastapi import APIRouter, HTTPException
-from ..config import settings
-import httpx
+from ..telegram_client import telegram
 
 router = APIRouter()
 
@@ -11,6 +10,5 @@ async def send_message(payload: dict):
     text = payload.get("text")
     if not chat_id or not text:
         raise HTTPException(400, "chat_id and text required")
-    async with httpx.AsyncClient() as client:
-        r = await client.post(f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage", json={"chat_id": chat_id, "text": text})
-        return {"status": r.status_code, "body": r.json()}
+    r = await telegram.send_message(chat_id, text)
+    return {"status": r.status_code, "body": r.json()}
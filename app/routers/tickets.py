@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from ..db import database
 from ..auth import create_access_token
-from ..config import settings
+from ..telegram_client import telegram
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -34,11 +34,7 @@ async def reply_ticket(ticket_id: int, payload: dict):
     admin_id = payload.get("admin_id")
     await database.execute("UPDATE tickets SET admin_reply=$1, status='answered', updated_at=NOW() WHERE id=$2", values=[reply_text, ticket_id])
     # send message to user via Telegram API
-    # use httpx to call Telegram
-    import httpx
-    from ..config import settings
     user_id = await database.fetch_val("SELECT user_id FROM tickets WHERE id=$1", values=[ticket_id])
     text = f"💬 پاسخ پشتیبانی به تیکت #{ticket_id}:\n\n{reply_text}"
-    async with httpx.AsyncClient() as client:
-        await client.post(f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage", json={"chat_id": user_id, "text": text})
+    await telegram.send_message(user_id, text)
     return {"ok": True}
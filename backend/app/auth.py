@@ -1,30 +1,55 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from .config import settings
+from .token_cache import Denylist, TokenCache
 
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min = max = default: a hash with any other cost "needs update" and is rehashed on login
+pwd_ctx = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 ALGO = "HS256"
 security = HTTPBearer()
+token_cache = TokenCache(max_size=settings.TOKEN_CACHE_SIZE)
+denylist = Denylist()
 
-def hash_password(password: str) -> str:
-    return pwd_ctx.hash(password)
+# bcrypt takes 100+ ms of CPU and releases the GIL; run it off the event loop,
+# on a bounded pool so a login burst can't starve the other requests
+_hash_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_ctx.verify(plain, hashed)
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, pwd_ctx.hash, password)
+
+async def verify_password(plain: str, hashed: str):
+    """Returns (ok, new_hash); new_hash is set when the stored hash should be replaced."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, pwd_ctx.verify_and_update, plain, hashed)
 
 def create_access_token(data: dict, expires_minutes: int = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=(expires_minutes or settings.JWT_EXPIRES_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=(expires_minutes or settings.JWT_EXPIRES_MINUTES))
+    to_encode.update({"exp": expire, "iat": now, "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, settings.JWT_SECRET, algorithm=ALGO)
 
-def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # async: a sync dependency would cost a threadpool hop on every request
     token = credentials.credentials
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[ALGO])
-        return payload
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[ALGO])
+        except JWTError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        token_cache.put(token, payload)
+    if denylist.is_revoked(payload):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
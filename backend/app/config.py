@@ -1,3 +1,5 @@
+import os
+
 from pydantic import BaseSettings
 
 class Settings(BaseSettings):
@@ -11,6 +13,30 @@ class Settings(BaseSettings):
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
 
+    # bcrypt cost; stored hashes with another cost are rehashed on login
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+
+    # verified-token cache and revocation denylist (token_cache.py)
+    TOKEN_CACHE_SIZE: int = 1024
+    TOKEN_DENYLIST_REFRESH_SECONDS: int = 30
+
+    # keyset-paginated list endpoints (pagination.py)
+    PAGE_SIZE_DEFAULT: int = 50
+    PAGE_SIZE_MAX: int = 200
+
+    # shared Bot API client (telegram_client.py)
+    TELEGRAM_API_URL: str = "https://api.telegram.org"
+    TELEGRAM_RATE: float = 25
+    TELEGRAM_TIMEOUT: float = 10
+    TELEGRAM_MAX_RETRIES: int = 3
+
+    # SQL migrations shared with the bot (bot/migrations); the runner,
+    # bot/migrate.py, is loaded from the directory above it
+    MIGRATIONS_DIR: str = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "..", "bot", "migrations"
+    )
+
     class Config:
         env_file = ".env"
 
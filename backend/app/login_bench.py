@@ -0,0 +1,103 @@
+"""
+Event-loop latency during a burst of admin logins: bcrypt inline in the
+route against auth.verify_password (bounded thread pool).
+
+    cd backend && python -m app.login_bench --logins 40
+
+Serves a small FastAPI app on uvicorn with the login route body (without
+the database lookup) in both variants plus /ping. For each variant it fires
+``--logins`` concurrent logins while polling /ping every 5 ms, and reports
+login throughput and /ping latency. Uses BCRYPT_ROUNDS and
+PASSWORD_HASH_WORKERS from the settings.
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException
+
+from .auth import pwd_ctx, verify_password
+from .config import settings
+
+PASSWORD = "bench-password"
+
+
+def bench_app(stored_hash: str) -> FastAPI:
+    api = FastAPI()
+
+    @api.post("/login/inline")
+    async def login_inline():
+        ok, _ = pwd_ctx.verify_and_update(PASSWORD, stored_hash)
+        if not ok:
+            raise HTTPException(status_code=401)
+        return {"ok": True}
+
+    @api.post("/login/pool")
+    async def login_pool():
+        ok, _ = await verify_password(PASSWORD, stored_hash)
+        if not ok:
+            raise HTTPException(status_code=401)
+        return {"ok": True}
+
+    @api.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return api
+
+
+async def burst(client: httpx.AsyncClient, variant: str, logins: int):
+    pings = []
+    done = asyncio.Event()
+
+    async def poll():
+        while not done.is_set():
+            started = time.perf_counter()
+            await client.get("/ping")
+            pings.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(0.005)
+
+    poller = asyncio.create_task(poll())
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(client.post(f"/login/{variant}") for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await poller
+    assert all(r.status_code == 200 for r in responses)
+    return elapsed, pings
+
+
+async def main(args):
+    stored_hash = pwd_ctx.hash(PASSWORD)
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(bench_app(stored_hash), log_level="warning"))
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    url = "http://127.0.0.1:%d" % sock.getsockname()[1]
+    limits = httpx.Limits(max_connections=args.logins + 1)
+    print(f"{args.logins} concurrent logins, bcrypt cost {settings.BCRYPT_ROUNDS}, "
+          f"{settings.PASSWORD_HASH_WORKERS} hash workers")
+    try:
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+            for variant in ("inline", "pool"):
+                elapsed, pings = await burst(client, variant, args.logins)
+                pings.sort()
+                p99 = pings[min(len(pings) - 1, int(len(pings) * 0.99))]
+                print(f"{variant:6} {args.logins / elapsed:5.1f} logins/s  /ping p50 "
+                      f"{statistics.median(pings):8.1f} ms  p99 {p99:8.1f} ms  ({len(pings)} pings)")
+    finally:
+        server.should_exit = True
+        await serving
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40)
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,13 @@
+import asyncio
+
 from fastapi import FastAPI
 from .config import settings
 from .db import database
 from .crud import create_initial_admin_if_missing
-from .routers import auth, users, tickets, tools, auto_replies, telegram
+from .migrate import run_migrations
+from .telegram_client import telegram as telegram_client
+from .auth import denylist
+from .routers import auth, users, tickets, tools, auto_replies, telegram, export
 
 app = FastAPI(title="Cafenet Admin API")
 
@@ -12,13 +17,22 @@ app.include_router(tickets.router, prefix="/tickets")
 app.include_router(tools.router, prefix="/tools")
 app.include_router(auto_replies.router, prefix="/auto_replies")
 app.include_router(telegram.router, prefix="/telegram")
+app.include_router(export.router, prefix="/export")
 
 @app.on_event("startup")
 async def startup():
     await database.connect()
+    await run_migrations()
     # create admin if none
     await create_initial_admin_if_missing()
+    await telegram_client.start()
+    await denylist.refresh(database)
+    app.state.denylist_refresher = asyncio.create_task(
+        denylist.run(database, settings.TOKEN_DENYLIST_REFRESH_SECONDS)
+    )
 
 @app.on_event("shutdown")
 async def shutdown():
+    app.state.denylist_refresher.cancel()
+    await telegram_client.close()
     await database.disconnect()
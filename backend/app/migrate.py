@@ -0,0 +1,32 @@
+# migrate.py
+"""
+Admin API side of the shared schema migrations.
+
+The runner is bot/migrate.py itself, loaded from next to the migrations
+directory (``settings.MIGRATIONS_DIR``, i.e. bot/migrations, or the
+/schema mount in docker-compose), so the bot and the API apply the same
+files the same way and agree on ``schema_migrations``.
+"""
+import importlib.util
+import os
+from typing import List
+
+from .config import settings
+from .db import database
+
+
+def _load_runner():
+    path = os.path.join(os.path.dirname(os.path.abspath(settings.MIGRATIONS_DIR)), "migrate.py")
+    spec = importlib.util.spec_from_file_location("schema_migrate", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+runner = _load_runner()
+
+
+async def run_migrations() -> List[str]:
+    """Apply pending migrations over the app's ``databases`` connection."""
+    async with database.connection() as connection:
+        return await runner.migrate(connection.raw_connection, settings.MIGRATIONS_DIR)
@@ -0,0 +1,65 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from .config import settings
+from .db import database
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_size(limit: Optional[int]) -> int:
+    if limit is None:
+        return settings.PAGE_SIZE_DEFAULT
+    return max(1, min(limit, settings.PAGE_SIZE_MAX))
+
+
+def keyset_query(table: str, columns: Sequence[str], where: List[str] = (), values: list = (),
+                 cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[str, list, int]:
+    """
+    The statement behind ``keyset_page``: returns (sql, values, limit).
+    Instead of OFFSET, the next page starts strictly after the last row
+    returned, so every page is an index range scan of ``limit`` rows no
+    matter how deep it is. ``columns`` must include created_at and id;
+    ``where`` conditions use $1..$n for ``values``.
+    """
+    limit = page_size(limit)
+    where, values = list(where), list(values)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        where.append(f"(created_at, id) < (${len(values) + 1}, ${len(values) + 2})")
+        values += [created_at, row_id]
+    q = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    # one extra row tells whether there is a next page
+    q += f" ORDER BY created_at DESC, id DESC LIMIT ${len(values) + 1}"
+    return q, values + [limit + 1], limit
+
+
+async def keyset_page(table: str, columns: Sequence[str], where: List[str] = (), values: list = (),
+                      cursor: Optional[str] = None, limit: Optional[int] = None) -> dict:
+    """One page of ``table``, newest first, ordered by (created_at, id); see ``keyset_query``."""
+    q, values, limit = keyset_query(table, columns, where, values, cursor, limit)
+    rows = await database.fetch_all(q, values=values)
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    return {"items": items, "next_cursor": next_cursor}
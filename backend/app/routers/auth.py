@@ -1,7 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from ..db import database
 from ..schemas import AdminIn, TokenOut
-from ..auth import verify_password, create_access_token
+from ..auth import verify_password, create_access_token, get_current_admin, denylist
 from ..crud import create_initial_admin_if_missing
 
 router = APIRouter()
@@ -15,7 +15,24 @@ async def _init_admin():
 @router.post("/login", response_model=TokenOut)
 async def login(payload: AdminIn):
     row = await database.fetch_one("SELECT id, username, password_hash FROM admins WHERE username=$1", values=[payload.username])
-    if not row or not verify_password(payload.password, row["password_hash"]):
+    if not row:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    ok, new_hash = await verify_password(payload.password, row["password_hash"])
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this password was stored
+        await database.execute("UPDATE admins SET password_hash=$1 WHERE id=$2", values=[new_hash, row["id"]])
     token = create_access_token({"sub": row["username"], "admin_id": row["id"]})
     return {"access_token": token}
+
+@router.post("/logout")
+async def logout(admin=Depends(get_current_admin)):
+    await denylist.revoke(database, admin)
+    return {"ok": True}
+
+@router.post("/revoke/{admin_id}")
+async def revoke_admin_tokens(admin_id: int, _=Depends(get_current_admin)):
+    # log an admin out everywhere (e.g. a leaked token)
+    await denylist.revoke_admin(database, admin_id)
+    return {"ok": True}
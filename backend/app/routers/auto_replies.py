@@ -2,12 +2,14 @@ from fastapi import APIRouter, Depends
 from ..db import database
 from ..schemas import AutoReplyIn
 from ..auth import get_current_admin
+from ..pagination import keyset_page
 
 router = APIRouter()
 
 @router.get("/", dependencies=[Depends(get_current_admin)])
-async def list_auto():
-    return await database.fetch_all("SELECT * FROM auto_replies ORDER BY id DESC")
+async def list_auto(limit: int = None, cursor: str = None):
+    return await keyset_page("auto_replies", ("id", "trigger", "reply", "is_active", "created_at"),
+                             cursor=cursor, limit=limit)
 
 @router.post("/", dependencies=[Depends(get_current_admin)])
 async def create_auto(a: AutoReplyIn):
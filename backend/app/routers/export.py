@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from ..db import database
+from ..auth import get_current_admin
+
+router = APIRouter()
+
+# entity -> (table, columns, SQL expression the ?status= filter compares with)
+EXPORTS = {
+    "users": ("users", ("user_id", "first_name", "username", "is_blocked", "last_seen", "created_at"),
+              "CASE WHEN is_blocked THEN 'blocked' ELSE 'active' END"),
+    "orders": ("orders", ("id", "user_id", "service_id", "order_code", "status", "created_at"), "status"),
+    "tickets": ("tickets", ("id", "user_id", "subject", "message", "status", "admin_reply", "created_at", "updated_at"),
+                "status"),
+}
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CHUNK_ROWS = 500
+
+
+def _build_query(entity: str, since: datetime, until: datetime, status: str):
+    table, columns, status_expr = EXPORTS[entity]
+    where, values = [], []
+    if since:
+        values.append(since)
+        where.append(f"created_at >= ${len(values)}")
+    if until:
+        values.append(until)
+        where.append(f"created_at < ${len(values)}")
+    if status:
+        values.append(status)
+        where.append(f"{status_expr} = ${len(values)}")
+    q = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    return q + " ORDER BY id", values, columns
+
+
+async def _stream(q: str, values: list, columns, fmt: str):
+    # database.iterate reads through a server-side cursor, so only one
+    # chunk of rows is ever held in memory
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    n = 0
+    async for row in database.iterate(q, values=values):
+        if writer:
+            writer.writerow([row[c] for c in columns])
+        else:
+            buf.write(json.dumps({c: row[c] for c in columns}, ensure_ascii=False, default=str))
+            buf.write("\n")
+        n += 1
+        if n % CHUNK_ROWS == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+@router.get("/{entity}", dependencies=[Depends(get_current_admin)])
+async def export(entity: str, format: str = "ndjson", since: datetime = None, until: datetime = None,
+                 status: str = None):
+    if entity not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown entity")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    q, values, columns = _build_query(entity, since, until, status)
+    filename = f"{entity}-{datetime.utcnow():%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        _stream(q, values, columns, format),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
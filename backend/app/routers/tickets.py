@@ -2,16 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException
 from ..db import database
 from ..schemas import TicketCreate, TicketReply
 from ..auth import get_current_admin
-from ..config import settings
-import httpx
+from ..telegram_client import telegram
+from ..pagination import keyset_page
 
 router = APIRouter()
 
+TICKET_COLUMNS = ("id", "user_id", "subject", "message", "status", "admin_reply", "created_at", "updated_at")
+
 @router.get("/", dependencies=[Depends(get_current_admin)])
-async def list_tickets(status: str = None):
+async def list_tickets(status: str = None, limit: int = None, cursor: str = None):
     if status:
-        return await database.fetch_all("SELECT * FROM tickets WHERE status=$1 ORDER BY created_at DESC", values=[status])
-    return await database.fetch_all("SELECT * FROM tickets ORDER BY created_at DESC")
+        return await keyset_page("tickets", TICKET_COLUMNS, ["status=$1"], [status], cursor=cursor, limit=limit)
+    return await keyset_page("tickets", TICKET_COLUMNS, cursor=cursor, limit=limit)
 
 @router.post("/", status_code=201)
 async def create_ticket(payload: TicketCreate):
@@ -26,7 +28,5 @@ async def reply_ticket(ticket_id: int, payload: TicketReply):
                            values=[payload.reply, ticket_id])
     user_id = await database.fetch_val("SELECT user_id FROM tickets WHERE id=$1", values=[ticket_id])
     text = f"💬 پاسخ پشتیبانی به تیکت #{ticket_id}:\n\n{payload.reply}"
-    async with httpx.AsyncClient() as c:
-        await c.post(f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage",
-                     json={"chat_id": user_id, "text": text})
+    await telegram.send_message(user_id, text)
     return {"ok": True}
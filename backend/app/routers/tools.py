@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends
 from ..db import database
 from ..auth import get_current_admin
+from ..pagination import keyset_page
 
 router = APIRouter()
 
 @router.get("/", dependencies=[Depends(get_current_admin)])
-async def list_tools():
-    return await database.fetch_all("SELECT * FROM tools ORDER BY id DESC")
+async def list_tools(limit: int = None, cursor: str = None):
+    return await keyset_page("tools", ("id", "name", "message", "created_at"), cursor=cursor, limit=limit)
 
 @router.post("/", dependencies=[Depends(get_current_admin)])
 async def create_tool(payload: dict):
@@ -1,16 +1,23 @@
 from fastapi import APIRouter, Depends
 from ..db import database
 from ..auth import get_current_admin
+from ..pagination import keyset_page
 
 router = APIRouter()
 
+USER_COLUMNS = ("id", "user_id", "first_name", "username", "is_blocked", "last_seen", "created_at")
+USER_BY_ID = f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE user_id=$1"
+
 @router.get("/")
-async def list_users(q: str = None, limit: int = 100, offset: int = 0, _=Depends(get_current_admin)):
+async def list_users(q: str = None, limit: int = None, cursor: str = None, _=Depends(get_current_admin)):
     if q:
-        return await database.fetch_all("SELECT * FROM users WHERE username ILIKE $1 OR first_name ILIKE $1 ORDER BY created_at DESC LIMIT $2 OFFSET $3", values=[f"%{q}%", limit, offset])
-    return await database.fetch_all("SELECT * FROM users ORDER BY created_at DESC LIMIT $1 OFFSET $2", values=[limit, offset])
+        # ranked search results: one page, best matches first (same SQL
+        # function as the bot's user search, migration 0011)
+        rows = await database.fetch_all("SELECT * FROM search_users($1, $2)", values=[q, limit])
+        return {"items": [dict(r) for r in rows], "next_cursor": None}
+    return await keyset_page("users", USER_COLUMNS, cursor=cursor, limit=limit)
 
 @router.get("/{user_id}")
 async def get_user(user_id: int, _=Depends(get_current_admin)):
-    row = await database.fetch_one("SELECT * FROM users WHERE user_id=$1", values=[user_id])
+    row = await database.fetch_one(USER_BY_ID, values=[user_id])
     return row
@@ -0,0 +1,115 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+import httpx
+
+from .config import settings
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token bucket shared by every request to the Bot API (Telegram allows ~30 msg/s)."""
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every sender back for ``seconds`` (Telegram's retry_after)."""
+        self._tokens = 0
+        self._updated = max(self._updated, time.monotonic() + seconds)
+
+
+class TelegramClient:
+    """
+    One httpx.AsyncClient for the app's lifetime, so calls reuse keep-alive
+    connections to api.telegram.org instead of a TLS handshake per request.
+    Requests are rate limited and retried with exponential backoff on 429
+    (honouring retry_after), 5xx and transport errors.
+    """
+
+    def __init__(self, token: str, base_url: str = "https://api.telegram.org",
+                 rate: float = 25, timeout: float = 10, max_retries: int = 3,
+                 max_connections: int = 20):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.limiter = RateLimiter(rate)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(
+            base_url=f"{self.base_url}/bot{self.token}/",
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def call(self, method: str, **params) -> httpx.Response:
+        """POST a Bot API method and return the final response (after retries)."""
+        if self._client is None:
+            raise RuntimeError("TelegramClient.start() was not awaited")
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                resp = await self._client.post(method, json=params)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            if resp.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return resp
+            delay = self._backoff(attempt)
+            if resp.status_code == 429:
+                retry_after = self._retry_after(resp)
+                if retry_after:
+                    self.limiter.pause(retry_after)
+                    delay = retry_after
+            await asyncio.sleep(delay)
+
+    async def send_message(self, chat_id, text: str, **params) -> httpx.Response:
+        return await self.call("sendMessage", chat_id=chat_id, text=text, **params)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    @staticmethod
+    def _retry_after(resp: httpx.Response) -> Optional[float]:
+        try:
+            return float(resp.json()["parameters"]["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+telegram = TelegramClient(
+    settings.BOT_TOKEN,
+    base_url=settings.TELEGRAM_API_URL,
+    rate=settings.TELEGRAM_RATE,
+    timeout=settings.TELEGRAM_TIMEOUT,
+    max_retries=settings.TELEGRAM_MAX_RETRIES,
+)
@@ -0,0 +1,81 @@
+"""
+Check the shared Telegram client against a local fake Bot API server.
+
+    cd backend && python -m app.telegram_client_check
+
+The fake server (FastAPI on uvicorn) answers one 429 with retry_after=1 and
+one 502, then 200s, and records the client port of every request, i.e. the
+TCP connection it came in on. The check fails unless
+
+* the app's startup/shutdown hooks drive the shared client,
+* every send ends in 200 (the 429 and 502 were retried),
+* sequential sends all reuse a single keep-alive connection,
+* concurrent sends stay within the client's connection limit.
+"""
+import asyncio
+import socket
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from . import main
+from .routers import telegram as telegram_router
+from .telegram_client import telegram
+
+
+def fake_bot_api(failures):
+    api = FastAPI()
+    api.state.ports = []
+
+    @api.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        api.state.ports.append(request.client.port)
+        body = await request.json()
+        if failures:
+            status = failures.pop(0)
+            if status == 429:
+                return JSONResponse({"ok": False, "error_code": 429, "parameters": {"retry_after": 1}}, 429)
+            return JSONResponse({"ok": False, "error_code": status}, status)
+        return {"ok": True, "result": {"chat": {"id": body["chat_id"]}, "text": body["text"]}}
+
+    return api
+
+
+async def run(sequential: int = 50, concurrent: int = 50) -> None:
+    assert getattr(main, "telegram_client", None) is telegram, "app startup does not start the shared Telegram client"
+
+    api = fake_bot_api([429, 502])
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(api, log_level="warning"))
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    telegram.base_url = "http://127.0.0.1:%d" % sock.getsockname()[1]
+    await telegram.start()
+    try:
+        results = [await telegram_router.send_message({"chat_id": i + 1, "text": "check"})
+                   for i in range(sequential)]
+        seq_ports = list(api.state.ports)
+        api.state.ports.clear()
+        results += await asyncio.gather(*(telegram.send_message(i + 1, "check") for i in range(concurrent)))
+        conc_ports = list(api.state.ports)
+    finally:
+        await telegram.close()
+        server.should_exit = True
+        await serving
+
+    statuses = [r["status"] if isinstance(r, dict) else r.status_code for r in results]
+    print(f"sequential: {sequential} sends, {len(seq_ports)} requests, {len(set(seq_ports))} connection(s)")
+    print(f"concurrent: {concurrent} sends, {len(conc_ports)} requests, {len(set(conc_ports))} connection(s)")
+    assert statuses == [200] * (sequential + concurrent), statuses
+    assert len(seq_ports) == sequential + 2, "the 429 and the 502 were not retried exactly once"
+    assert len(set(seq_ports)) == 1, "sequential sends did not reuse one keep-alive connection"
+    assert len(set(conc_ports)) <= telegram.max_connections
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,45 @@
+"""
+Per-request cost of admin authentication: verifying the JWT on every
+request against get_current_admin with the verified-token cache.
+
+    cd backend && python -m app.token_bench --iterations 50000
+
+Both variants check the denylist, as get_current_admin does.
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+
+from .auth import ALGO, create_access_token, denylist, get_current_admin, token_cache
+from .config import settings
+
+
+async def main(args):
+    token = create_access_token({"sub": "bench", "admin_id": 1})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[ALGO])
+        denylist.is_revoked(payload)
+    decode = (time.perf_counter() - started) / args.iterations * 1e6
+
+    await get_current_admin(credentials)  # first call verifies and caches
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        await get_current_admin(credentials)
+    cached = (time.perf_counter() - started) / args.iterations * 1e6
+
+    print(f"{ALGO}, {args.iterations} iterations")
+    print(f"jwt.decode every request: {decode:8.2f} us")
+    hit_rate = token_cache.hits / (token_cache.hits + token_cache.misses)
+    print(f"cache hit + denylist:     {cached:8.2f} us  (hit rate {hit_rate:.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50000)
+    asyncio.run(main(parser.parse_args()))
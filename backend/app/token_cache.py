@@ -0,0 +1,105 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+
+class TokenCache:
+    """
+    Bounded LRU of token -> verified claims. A cached token skips signature
+    verification until its ``exp``; after that it is dropped and decoded
+    (and rejected) again. Only tokens that verified are ever cached.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[dict]:
+        claims = self._items.get(token)
+        if claims is None:
+            self.misses += 1
+            return None
+        if claims.get("exp", 0) <= time.time():
+            del self._items[token]
+            self.misses += 1
+            return None
+        self._items.move_to_end(token)
+        self.hits += 1
+        return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        self._items[token] = claims
+        self._items.move_to_end(token)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class Denylist:
+    """
+    In-memory copy of revoked tokens (by ``jti``) and per-admin cutoffs
+    (tokens issued before ``admins.tokens_valid_after``). Revocations made
+    by this process apply at once; ``refresh`` picks up the ones made by
+    other API workers.
+
+    JWT ``iat`` is whole seconds, so cutoffs are kept at second precision:
+    tokens issued in the same second as the revocation (e.g. the re-login
+    right after it) stay valid.
+    """
+
+    def __init__(self):
+        self._jtis: Set[str] = set()
+        self._cutoffs: Dict[int, float] = {}
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self._jtis:
+            return True
+        cutoff = self._cutoffs.get(claims.get("admin_id"))
+        return cutoff is not None and claims.get("iat", 0) < cutoff
+
+    async def refresh(self, database) -> None:
+        jtis, cutoffs_before = set(self._jtis), dict(self._cutoffs)
+        await database.execute("DELETE FROM revoked_tokens WHERE expires_at < NOW()")
+        rows = await database.fetch_all("SELECT jti FROM revoked_tokens")
+        cutoffs = await database.fetch_all(
+            "SELECT id, EXTRACT(EPOCH FROM tokens_valid_after) AS cutoff FROM admins "
+            "WHERE tokens_valid_after IS NOT NULL"
+        )
+        # keep revocations this process made while the queries ran
+        self._jtis = {r["jti"] for r in rows} | (self._jtis - jtis)
+        self._cutoffs = {
+            **{r["id"]: math.floor(r["cutoff"]) for r in cutoffs},
+            **{k: v for k, v in self._cutoffs.items() if cutoffs_before.get(k) != v},
+        }
+
+    async def revoke(self, database, claims: dict) -> None:
+        """Revoke one token (tokens issued before jti existed: all of the admin's tokens)."""
+        if "jti" not in claims:
+            return await self.revoke_admin(database, claims["admin_id"])
+        await database.execute(
+            "INSERT INTO revoked_tokens (jti, admin_id, expires_at) VALUES ($1, $2, to_timestamp($3)) "
+            "ON CONFLICT DO NOTHING",
+            values=[claims["jti"], claims.get("admin_id"), claims["exp"]],
+        )
+        self._jtis.add(claims["jti"])
+
+    async def revoke_admin(self, database, admin_id: int) -> None:
+        """Revoke every token issued to ``admin_id`` so far."""
+        cutoff = await database.fetch_val(
+            "UPDATE admins SET tokens_valid_after = date_trunc('second', NOW()) WHERE id=$1 "
+            "RETURNING EXTRACT(EPOCH FROM tokens_valid_after)",
+            values=[admin_id],
+        )
+        if cutoff is not None:
+            self._cutoffs[admin_id] = math.floor(cutoff)
+
+    async def run(self, database, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(database)
+            except Exception as e:
+                print("[auth] denylist refresh failed:", e)
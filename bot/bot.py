@@ -5,14 +5,29 @@ import uuid
 import json
 import csv
 import asyncio
+import time
+import sys
+import multiprocessing
 from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import ReplyKeyboardRemove
+from text_normalize import prefix_tsquery
+from migrate import migrate
+from ref_cache import RefCache
+from keyboard_cache import KeyboardCache
+from seed_cities import seed_cities
+from broadcast import BroadcastEngine, BroadcastJobs, DeliveryQueue, TokenBucket
+from fsm_storage_postgres import CachedPostgresStorage, FSMFlushMiddleware
+from conversation import ConversationStore
+from routing import Router
+from callbacks import CallbackCodec
+from webhook import run_webhook
+from update_queue import PostgresUpdateQueue, ShardWorker, poll_into
+from cache_bus import CacheInvalidationBus
 
 class OrderForm(StatesGroup):
     waiting_for_documents = State()
@@ -29,17 +44,6 @@ class UserStates(StatesGroup):
     waiting_for_tracking_code = State()
 
 
-add_tool_state = {}
-edit_tool_state = {}
-user_manage_state = {}
-cafenet_manage_state = {}
-user_search_state = {}
-broadcast_state = {}
-cafenet_location_state = {}
-cafenet_state = {}
-cafenet_page_state = {}
-cafenet_filter_state = {}
-
 
 # ---------------- تنظیمات ----------------
 API_TOKEN = os.getenv("BOT_TOKEN")
@@ -49,12 +53,107 @@ logging.basicConfig(level=logging.INFO)
 ADMIN_ID = 7918162941
 ADMINS = [ADMIN_ID]
 
+# ارسال انبوه: سقف پیام در ثانیه (محدودیت سراسری تلگرام ~۳۰) و تعداد ارسال هم‌زمان
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+
+# نگهداری پست‌ها: حداکثر تعداد و/یا حداکثر عمر (۰ یعنی بدون محدودیت)
+POSTS_MAX_ROWS = int(os.getenv("POSTS_MAX_ROWS", "100"))
+POSTS_MAX_AGE_DAYS = int(os.getenv("POSTS_MAX_AGE_DAYS", "0"))
+POSTS_PRUNE_INTERVAL = int(os.getenv("POSTS_PRUNE_INTERVAL", "300"))  # ثانیه
+
+# مدت اعتبار کش داده‌های مرجع (استان، شهر، دسته‌بندی، خدمات، ابزار)
+REF_CACHE_TTL = int(os.getenv("REF_CACHE_TTL", "600"))  # ثانیه
+
+# فاصله‌ی ذخیره‌ی دسته‌ای «آخرین فعالیت» کاربران در دیتابیس
+LAST_SEEN_FLUSH_INTERVAL = int(os.getenv("LAST_SEEN_FLUSH_INTERVAL", "30"))  # ثانیه
+
+# وضعیت FSM: تعداد گفتگوهای نگه‌داشته‌شده در حافظه و عمر گفتگوهای رهاشده
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_TTL_HOURS = int(os.getenv("FSM_TTL_HOURS", "48"))
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", "3600"))  # ثانیه
+# گفتگوهای چندمرحله‌ای بدون StatesGroup (افزودن ابزار، جستجو، پیام انبوه ...) بعد از این مدت منقضی می‌شوند
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "1800"))  # ثانیه
+
+# وب‌هوک: اگر WEBHOOK_HOST تنظیم شود ربات به‌جای polling با وب‌هوک اجرا می‌شود
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST")  # مثل https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# چند پردازه‌ای: با UPDATE_SHARDS > 0 پردازه اصلی آپدیت‌ها را فقط در صف Postgres می‌گذارد
+# و `python bot.py worker` آنها را (شارد‌شده بر اساس user_id) در WORKER_PROCESSES پردازه اجرا می‌کند
+UPDATE_SHARDS = int(os.getenv("UPDATE_SHARDS", "0"))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+IS_WORKER = sys.argv[1:2] == ["worker"]
+
 # ---------------- اتصال بات ----------------
 bot = Bot(token=API_TOKEN, parse_mode="HTML")
-storage = MemoryStorage()
+# وضعیت گفتگوها (FSM) در جدول fsm_storage می‌ماند و با ری‌استارت از بین نمی‌رود؛
+# pool در on_startup به آن داده می‌شود
+storage = CachedPostgresStorage(None, max_size=FSM_CACHE_SIZE)
 dp = Dispatcher(bot, storage=storage)
+# دکمه‌های متنی و callback_dataها از طریق یک ایندکس (dict + trie) مسیریابی می‌شوند؛
+# باید قبل از همه‌ی هندلرهای دیگر ثبت شود
+router = Router()
+router.setup(dp)
+
+# ---------------- callback_data ----------------
+# دکمه‌های اینلاین پارامتردار: کد کوتاه + شناسه‌های عددی فشرده (به‌جای رشته و split("_"))
+callback_codec = CallbackCodec()
+ADMIN_ADD_CAT = callback_codec.action("admin_add_category", "aac")
+ADMIN_DEL_CAT = callback_codec.action("admin_delete_category", "adc")
+ADMIN_DEL_SERVICE = callback_codec.action("admin_delete_service", "ads")
+ADMIN_CONFIRM_DEL = callback_codec.action("admin_confirm_delete", "acd")
+SEARCH_PROVINCE = callback_codec.action("search_province", "sp")
+SEARCH_CITY = callback_codec.action("search_city", "sc")
+REG_PROVINCE = callback_codec.action("register_province", "rp")
+REG_CITY = callback_codec.action("register_city", "rc", arity=2)  # province_id, city_id
+ORDER_CAT = callback_codec.action("order_category", "oc")
+ORDER_SERVICE = callback_codec.action("order_service", "os")
+COMPLETE_ORDER = callback_codec.action("complete_order", "co")  # orders.id
+ADD_SERVICE_CAT = callback_codec.action("add_service_category", "asc")
+TOOL = callback_codec.action("tool", "t")
+EDIT_TOOL = callback_codec.action("edit_tool", "et")
+EDIT_TOOL_NAME = callback_codec.action("edit_tool_name", "etn")
+EDIT_TOOL_MSG = callback_codec.action("edit_tool_message", "etm")
+DELETE_TOOL = callback_codec.action("delete_tool", "dt")
+DELETE_TOOL_YES = callback_codec.action("delete_tool_confirm", "dty")
+DEL_USER = callback_codec.action("delete_user", "du")
+DEL_USER_YES = callback_codec.action("delete_user_confirm", "duy")
+BLOCK_USER = callback_codec.action("block_user", "bu")
+UNBLOCK_USER = callback_codec.action("unblock_user", "ubu")
+USERS_BY_PROVINCE = callback_codec.action("users_by_province", "up")
+BCAST_PAUSE = callback_codec.action("broadcast_pause", "bp")
+BCAST_RESUME = callback_codec.action("broadcast_resume", "br")
+BCAST_CANCEL = callback_codec.action("broadcast_cancel", "bc")
+CAFENET_PROVINCE = callback_codec.action("cafenet_province", "cp")
+FULL_POST = callback_codec.action("full_post", "fp")
+TAG_POSTS = callback_codec.action("tag_posts", "tg")  # hashtags.id
+TOGGLE_SUB = callback_codec.action("toggle_subscription", "ts")
+DELETE_CAT = callback_codec.action("delete_category", "dc")
+DELETE_SERVICE = callback_codec.action("delete_service", "ds")
+dp.middleware.setup(FSMFlushMiddleware(storage))
+conversations = ConversationStore(storage, ttl=CONVERSATION_TTL)
 
 pool = None  # اتصال دیتابیس
+broadcast_engine = None  # در on_startup ساخته می‌شود
+broadcast_jobs = None
+delivery_queue = None  # صف ارسال اعلان پست‌های کانال
+telegram_limiter = TokenBucket(BROADCAST_RATE)
+
+# نگه‌داشتن ارجاع به تسک‌های پس‌زمینه تا قبل از اتمام توسط GC جمع نشوند
+background_tasks = set()
+
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 # ---------------- دیتابیس ----------------
 async def init_db():
@@ -65,205 +164,115 @@ async def init_db():
         print(f"❌ خطا در ایجاد pool دیتابیس: {e}")
         raise
 
+    # اسکیما با مهاجرت‌های نسخه‌دار در bot/migrations ساخته می‌شود (مشترک با backend)؛
+    # روی دیتابیس به‌روز فقط یک SELECT روی schema_migrations اجرا می‌شود.
     try:
         async with pool.acquire() as conn:
-            # جدول کاربران
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT UNIQUE,
-                first_name TEXT,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT now()
-            );
-            """)
-
-            # دسته‌بندی خدمات
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS service_categories (
-                id SERIAL PRIMARY KEY,
-                name TEXT UNIQUE
-            );
-            """)
+            applied = await migrate(conn)
+        if applied:
+            print(f"🧱 مهاجرت‌های اعمال‌شده: {', '.join(applied)}")
+        print("✅ دیتابیس آماده شد.")
+    except Exception as e:
+        print(f"❌ خطا در init_db: {e}")
+        raise
 
-            # خدمات (اطمینان از ستون documents)
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS services (
-                id SERIAL PRIMARY KEY,
-                category_id INTEGER REFERENCES service_categories(id) ON DELETE CASCADE,
-                title TEXT
-            );
-            """)
-            await conn.execute("""
-            ALTER TABLE services
-            ADD COLUMN IF NOT EXISTS documents TEXT
-            """)
 
-            # orders (یکبار و کامل)
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
-                order_code TEXT UNIQUE,
-                docs TEXT,
-                status TEXT DEFAULT 'new',
-                created_at TIMESTAMP DEFAULT now()
-            );
-            """)
+# ---------------- کش داده‌های مرجع ----------------
+# داده‌هایی که تقریباً تغییر نمی‌کنند از حافظه خوانده می‌شوند؛ هر جا ادمین
+# این جداول را تغییر می‌دهد، ref_cache.invalidate صدا زده می‌شود.
+ref_cache = RefCache(ttl=REF_CACHE_TTL)
+# کیبوردها یک بار ساخته و به صورت JSON نگه داشته می‌شوند و همراه داده مرجع منقضی می‌شوند
+keyboard_cache = KeyboardCache(ttl=REF_CACHE_TTL)
+ref_cache.on_invalidate(keyboard_cache.invalidate)
+# invalidate() در یک پردازه به بقیه پردازه‌ها هم می‌رسد (LISTEN/NOTIFY)
+cache_bus = CacheInvalidationBus(ref_cache)
+# pool در on_startup به آن داده می‌شود
+update_queue = PostgresUpdateQueue(None, shards=max(UPDATE_SHARDS, 1))
 
-            # تنظیمات کاربر
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_settings (
-                user_id BIGINT PRIMARY KEY,
-                post_limit INTEGER DEFAULT 5,
-                notifications_enabled BOOLEAN DEFAULT TRUE
-                );
-            """)
 
-            # جدول های مربوط به پست/هشتگ — ابتدا هشتگ‌ها و پست‌ها
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS hashtags (
-                id SERIAL PRIMARY KEY,
-                name TEXT UNIQUE
-            );
-            """)
+async def _cached_fetch(key, query, *args, one=False):
+    async def load():
+        async with pool.acquire() as conn:
+            if one:
+                return await conn.fetchrow(query, *args)
+            return await conn.fetch(query, *args)
+    return await ref_cache.get(key, load)
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS posts (
-                id SERIAL PRIMARY KEY,
-                message_id BIGINT UNIQUE,
-                title TEXT,
-                content TEXT,
-                created_at TIMESTAMP DEFAULT now()
-            );
-            """)
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS post_hashtags (
-                post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
-                hashtag_id INTEGER REFERENCES hashtags(id) ON DELETE CASCADE,
-                PRIMARY KEY (post_id, hashtag_id)
-            );
-            """)
+async def get_provinces():
+    return await _cached_fetch("provinces", "SELECT id, name FROM provinces ORDER BY name")
 
-            # جدول اشتراک (اکنون که hashtags وجود دارد)
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                user_id BIGINT,
-                hashtag_id INTEGER REFERENCES hashtags(id) ON DELETE CASCADE,
-                PRIMARY KEY (user_id, hashtag_id)
-            );
-            """)
 
-            # بقیه جداول (provinces, cities, cafenets)
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS provinces (
-                id SERIAL PRIMARY KEY,
-                name TEXT UNIQUE
-            );
-            """)
+async def get_cities(province_id):
+    return await _cached_fetch(
+        f"cities:{province_id}",
+        "SELECT id, name FROM cities WHERE province_id=$1 ORDER BY name",
+        province_id,
+    )
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS cities (
-                id SERIAL PRIMARY KEY,
-                province_id INTEGER REFERENCES provinces(id) ON DELETE CASCADE,
-                name TEXT
-            );
-            """)
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS cafenets (
-                id SERIAL PRIMARY KEY,
-                province_id INTEGER REFERENCES provinces(id) ON DELETE CASCADE,
-                city_id INTEGER REFERENCES cities(id) ON DELETE CASCADE,
-                name TEXT,
-                address TEXT,
-                phone TEXT,
-                created_at TIMESTAMP DEFAULT now()
-            );
-            """)
+async def get_all_cities():
+    return await _cached_fetch("cities:all", """
+        SELECT c.id, c.name, p.name AS province
+        FROM cities c
+        JOIN provinces p ON p.id=c.province_id
+        ORDER BY p.name, c.name
+    """)
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS tools (
-                id SERIAL PRIMARY KEY,
-                name TEXT,
-                message TEXT
-            );
-            """)
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                id SERIAL PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                full_name TEXT,
-                created_at TIMESTAMP DEFAULT now()
-            );
-            """)
+async def get_service_categories():
+    return await _cached_fetch("service_categories", "SELECT id, name FROM service_categories ORDER BY id")
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS tickets (
-               id SERIAL PRIMARY KEY,
-               user_id BIGINT NOT NULL,
-               subject TEXT,
-               message TEXT,
-               status TEXT DEFAULT 'open', -- open | answered | closed
-               admin_reply TEXT,
-               created_at TIMESTAMP DEFAULT now(),
-               updated_at TIMESTAMP
-            );
-            """)
 
-            await conn.execute("""
-            CREATE TABLE IF NOT EXISTS auto_replies (
-                id SERIAL PRIMARY KEY,
-                trigger TEXT NOT NULL,
-                reply TEXT NOT NULL,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT now()
-            );
-            """)
+async def get_services(category_id):
+    return await _cached_fetch(
+        f"services:cat:{category_id}",
+        "SELECT id, title, documents FROM services WHERE category_id=$1 ORDER BY id",
+        category_id,
+    )
 
-            # *** خطای اصلی در این ناحیه بود ***
-            # شما تعریف تکراری جدول tools را داشتید اما گیومه بسته را فراموش کرده بودید.
-            # من آن را حذف کردم و خطای سینتکسی برطرف شد.
 
-            # به‌روزرسانی جدول users
-            await conn.execute("""
-                ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE;
-            """)
-            await conn.execute("""
-                ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP DEFAULT NOW();
-            """)
+async def get_service(service_id):
+    return await _cached_fetch(
+        f"services:id:{service_id}",
+        "SELECT id, title, documents FROM services WHERE id=$1",
+        service_id,
+        one=True,
+    )
 
-            # به‌روزرسانی جدول cafenets (ستون‌های موقعیت مکانی و متصدی)
-            await conn.execute("""
-                ALTER TABLE cafenets
-                ADD COLUMN IF NOT EXISTS location_lat DOUBLE PRECISION
-            """)
 
-            await conn.execute("""
-                ALTER TABLE cafenets
-                ADD COLUMN IF NOT EXISTS location_lon DOUBLE PRECISION
-            """)
+async def get_tools():
+    return await _cached_fetch("tools", "SELECT id, name FROM tools ORDER BY id DESC")
 
-            await conn.execute("""
-                ALTER TABLE cafenets
-                ADD COLUMN IF NOT EXISTS owner_user_id BIGINT
-            """)
-            
 
-        print("✅ دیتابیس آماده شد.")
-    except Exception as e:
-        print(f"❌ خطا در init_db: {e}")
-        raise
+async def get_tool(tool_id):
+    return await _cached_fetch(
+        f"tools:{tool_id}", "SELECT name, message FROM tools WHERE id=$1", tool_id, one=True
+    )
 
 
 # ---------------- کیبورد ----------------
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+async def list_keyboard(key, loader, callback, back=None, row_width=1, text="{name}"):
+    """
+    کیبورد اینلاین یک لیست مرجع (استان، شهر، دسته‌بندی، ابزار) از کش.
+    callback یک CallbackAction است (با id هر ردیف پر می‌شود) یا تابعی از ردیف؛
+    text قالبی است که با ستون‌های هر ردیف پر می‌شود.
+    """
+    async def build():
+        kb = InlineKeyboardMarkup(row_width=row_width)
+        for row in await loader():
+            data = callback(row) if callable(callback) else callback.pack(row["id"])
+            kb.add(InlineKeyboardButton(text.format_map(row), callback_data=data))
+        if back:
+            kb.add(InlineKeyboardButton(back[0], callback_data=back[1]))
+        return kb
+    return await keyboard_cache.aget(key, build)
+
+
 # منوی اصلی
+@keyboard_cache.memoize("menu:main")
 def main_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add(KeyboardButton("📋 سفارش خدمات"))
@@ -277,6 +286,7 @@ def main_menu():
     return kb
 
 # زیرمنوی سفارشات
+@keyboard_cache.memoize("menu:orders")
 def orders_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add(KeyboardButton("➕ ثبت سفارش"))
@@ -285,52 +295,28 @@ def orders_menu():
     return kb
 
 
-# ===========================
-# کیبورد دسته بندی
-# ===========================
-async def service_categories_keyboard(prefix: str = "order"):
-    kb = InlineKeyboardMarkup(row_width=2)
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT id, name FROM service_categories ORDER BY id")
-    if not rows:
-        kb.add(InlineKeyboardButton("⛔ هیچ دسته‌ای وجود ندارد", callback_data="none"))
-        return kb
-
-    for r in rows:
-        cid = r["id"]
-        name = r["name"]
-        cb = f"{prefix}_cat_{cid}"
-        kb.add(InlineKeyboardButton(name, callback_data=cb))
-
-    return kb
-
 # --------------------------
 # مدیریت (افزودن / حذف) خدمات — FSM-based
 # --------------------------
 
 # 1) شروع افزودن خدمت (ریپلی کیبورد -> '➕ افزودن خدمات')
-@dp.message_handler(lambda m: m.text == "➕ افزودن خدمات")
+@router.text("➕ افزودن خدمات")
 async def admin_add_service_start(msg: types.Message):
     if msg.from_user.id != ADMIN_ID:
         return await msg.answer("⛔ شما دسترسی به این بخش ندارید.")
     # نمایش دسته‌بندی‌ها با callback_data مخصوص ادمین:
-    async with pool.acquire() as conn:
-        cats = await conn.fetch("SELECT id, name FROM service_categories ORDER BY id")
-    kb = InlineKeyboardMarkup(row_width=1)
-    for c in cats:
-        kb.add(InlineKeyboardButton(c["name"], callback_data=f"admin_addcat_{c['id']}"))
-    kb.add(InlineKeyboardButton("⬅️ بازگشت", callback_data="admin_back_main"))
+    kb = await list_keyboard(
+        "service_categories:admin_add", get_service_categories, ADMIN_ADD_CAT,
+        back=("⬅️ بازگشت", "admin_back_main"),
+    )
     await msg.answer("📂 یک دسته‌بندی برای افزودن خدمت انتخاب کنید:", reply_markup=kb)
 
 
 # 2) ادمین یک دسته را انتخاب می‌کند -> درخواست عنوان (FSM set)
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("admin_addcat_"))
+@router.action(ADMIN_ADD_CAT)
 async def admin_addcat_choose(call: types.CallbackQuery, state: FSMContext):
     await call.answer()  # برداشتن لودینگ
-    try:
-        category_id = int(call.data.split("_")[-1])
-    except:
-        return await call.message.answer("❌ داده نامعتبر.")
+    category_id, = ADMIN_ADD_CAT.unpack(call.data)
     await state.update_data(category_id=category_id, documents=[])
     await AdminAddService.waiting_for_title.set()
     await call.message.answer("✍️ لطفاً عنوان خدمت جدید را ارسال کنید:")
@@ -388,7 +374,7 @@ async def admin_add_docs(msg: types.Message, state: FSMContext):
 
 
 # 5) ادمین دکمه ثبت را می‌زند -> ذخیره در DB
-@dp.callback_query_handler(lambda c: c.data == "admin_confirm_add_service", state=AdminAddService.waiting_for_docs)
+@router.callback("admin_confirm_add_service", state=AdminAddService.waiting_for_docs)
 async def admin_confirm_add(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
     data = await state.get_data()
@@ -404,42 +390,37 @@ async def admin_confirm_add(call: types.CallbackQuery, state: FSMContext):
             "INSERT INTO services (category_id, title, documents) VALUES ($1, $2, $3)",
             category_id, title, docs_json
         )
+    ref_cache.invalidate("services")
 
     await call.message.answer(f"✅ خدمت «{title}» با موفقیت ثبت شد.", reply_markup=main_menu())
     await state.finish()
 
 
 # 6) انصراف از افزودن
-@dp.callback_query_handler(lambda c: c.data == "admin_cancel_add_service", state=AdminAddService.waiting_for_docs)
+@router.callback("admin_cancel_add_service", state=AdminAddService.waiting_for_docs)
 async def admin_cancel_add(call: types.CallbackQuery, state: FSMContext):
     await call.answer("❌ افزودن خدمت لغو شد.")
     await state.finish()
     await call.message.answer("❌ افزودن خدمت لغو شد.", reply_markup=main_menu())
 
 # شروع حذف: نمایش دسته‌ها با callback admin_delcat_
-@dp.message_handler(lambda m: m.text == "❌ حذف خدمات")
+@router.text("❌ حذف خدمات")
 async def admin_delete_start(msg: types.Message):
     if msg.from_user.id != ADMIN_ID:
         return await msg.answer("⛔ شما دسترسی به این بخش ندارید.")
-    async with pool.acquire() as conn:
-        cats = await conn.fetch("SELECT id, name FROM service_categories ORDER BY id")
-    kb = InlineKeyboardMarkup(row_width=1)
-    for c in cats:
-        kb.add(InlineKeyboardButton(c["name"], callback_data=f"admin_delcat_{c['id']}"))
-    kb.add(InlineKeyboardButton("⬅️ بازگشت", callback_data="admin_back_main"))
+    kb = await list_keyboard(
+        "service_categories:admin_del", get_service_categories, ADMIN_DEL_CAT,
+        back=("⬅️ بازگشت", "admin_back_main"),
+    )
     await msg.answer("📂 یک دسته‌بندی برای حذف خدمت انتخاب کنید:", reply_markup=kb)
 
 
 # وقتی ادمین یک دسته را انتخاب کرد -> لیست خدمات آن گروه
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("admin_delcat_"))
+@router.action(ADMIN_DEL_CAT)
 async def admin_delcat_choose(call: types.CallbackQuery):
     await call.answer()
-    try:
-        cat_id = int(call.data.split("_")[-1])
-    except:
-        return await call.message.answer("❌ داده نامعتبر.")
-    async with pool.acquire() as conn:
-        services = await conn.fetch("SELECT id, title FROM services WHERE category_id=$1 ORDER BY id", cat_id)
+    cat_id, = ADMIN_DEL_CAT.unpack(call.data)
+    services = await get_services(cat_id)
 
     if not services:
         await call.message.answer("⛔ خدمتی در این دسته موجود نیست.")
@@ -447,81 +428,75 @@ async def admin_delcat_choose(call: types.CallbackQuery):
 
     kb = InlineKeyboardMarkup(row_width=1)
     for s in services:
-        kb.add(InlineKeyboardButton(f"❌ {s['title']}", callback_data=f"admin_delservice_{s['id']}"))
+        kb.add(InlineKeyboardButton(f"❌ {s['title']}", callback_data=ADMIN_DEL_SERVICE.pack(s['id'])))
     kb.add(InlineKeyboardButton("⬅️ بازگشت", callback_data="admin_back_main"))
     await call.message.answer("🗑 یکی از خدمات را برای حذف انتخاب کنید:", reply_markup=kb)
 
 
 # انتخاب خدمت -> نمایش پیغام تایید (حذف نهایی)
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("admin_delservice_"))
+@router.action(ADMIN_DEL_SERVICE)
 async def admin_delservice_confirm(call: types.CallbackQuery):
     await call.answer()
-    service_id = int(call.data.split("_")[-1])
-    async with pool.acquire() as conn:
-        s = await conn.fetchrow("SELECT title FROM services WHERE id=$1", service_id)
+    service_id, = ADMIN_DEL_SERVICE.unpack(call.data)
+    s = await get_service(service_id)
     if not s:
         return await call.message.answer("⛔ خدمت پیدا نشد.")
 
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
-        InlineKeyboardButton("✅ حذف نهایی", callback_data=f"admin_confirm_del_{service_id}"),
+        InlineKeyboardButton("✅ حذف نهایی", callback_data=ADMIN_CONFIRM_DEL.pack(service_id)),
         InlineKeyboardButton("❌ انصراف", callback_data="admin_cancel_del"),
     )
     await call.message.answer(f"⚠️ آیا مطمئن هستید که می‌خواهید خدمت «{s['title']}» را حذف کنید؟", reply_markup=kb)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("admin_confirm_del_"))
+@router.action(ADMIN_CONFIRM_DEL)
 async def admin_confirm_del(call: types.CallbackQuery):
     await call.answer()
-    service_id = int(call.data.split("_")[-1])
+    service_id, = ADMIN_CONFIRM_DEL.unpack(call.data)
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM services WHERE id=$1", service_id)
+    ref_cache.invalidate("services")
     await call.message.answer("✅ خدمت حذف شد.", reply_markup=main_menu())
 
 
-@dp.callback_query_handler(lambda c: c.data == "admin_cancel_del")
+@router.callback("admin_cancel_del")
 async def admin_cancel_del(call: types.CallbackQuery):
     await call.answer("❌ حذف لغو شد.")
     await call.message.answer("❌ حذف لغو شد.", reply_markup=main_menu())
 
 
 # بازگشت به منوی اصلی
-@dp.message_handler(lambda m: m.text == "⬅️ بازگشت به منوی اصلی")
+@router.text("⬅️ بازگشت به منوی اصلی")
 async def back_to_main(message: types.Message):
     await message.answer("🔙 بازگشت به منوی اصلی", reply_markup=main_menu())
     
 # =========================
 # 🧭 مراجعه حضوری
 # =========================
-@dp.message_handler(lambda m: m.text == "🧭 مراجعه حضوری")
+@router.text("🧭 مراجعه حضوری")
 async def visit_in_person(message: types.Message):
     kb = InlineKeyboardMarkup(row_width=1)
     kb.add(InlineKeyboardButton("📍 جستجوی کافی‌نت نزدیک شما", callback_data="search_cafenet"))
     kb.add(InlineKeyboardButton("➕ ثبت کافی‌نت شما", callback_data="register_cafenet"))
     await message.answer("لطفاً یکی از گزینه‌های زیر را انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data == "search_cafenet")
+@router.callback("search_cafenet")
 async def choose_province_for_search(call: types.CallbackQuery):
-    async with pool.acquire() as conn:
-        provinces = await conn.fetch("SELECT id, name FROM provinces ORDER BY name")
-    kb = InlineKeyboardMarkup(row_width=2)
-    for p in provinces:
-        kb.add(InlineKeyboardButton(p["name"], callback_data=f"search_province_{p['id']}"))
+    kb = await list_keyboard("provinces:search", get_provinces, SEARCH_PROVINCE, row_width=2)
     await call.message.edit_text("🌍 استان خود را انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("search_province_"))
+@router.action(SEARCH_PROVINCE)
 async def choose_city_for_search(call: types.CallbackQuery):
-    province_id = int(call.data.split("_")[2])
-    async with pool.acquire() as conn:
-        cities = await conn.fetch("SELECT id, name FROM cities WHERE province_id=$1 ORDER BY name", province_id)
-    kb = InlineKeyboardMarkup(row_width=2)
-    for cty in cities:
-        kb.add(InlineKeyboardButton(cty["name"], callback_data=f"search_city_{cty['id']}"))
+    province_id, = SEARCH_PROVINCE.unpack(call.data)
+    kb = await list_keyboard(
+        f"cities:{province_id}:search", lambda: get_cities(province_id), SEARCH_CITY, row_width=2
+    )
     await call.message.edit_text("🏙 شهر خود را انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("search_city_"))
+@router.action(SEARCH_CITY)
 async def show_cafenets_in_city(call: types.CallbackQuery):
-    city_id = int(call.data.split("_")[2])
+    city_id, = SEARCH_CITY.unpack(call.data)
     async with pool.acquire() as conn:
         cafenets = await conn.fetch("""
             SELECT name, address, phone FROM cafenets WHERE city_id=$1 ORDER BY name
@@ -548,37 +523,32 @@ class RegisterCafeNet(StatesGroup):
     waiting_for_location = State()
     finalize = State()
 
-@dp.callback_query_handler(lambda c: c.data == "register_cafenet")
+@router.callback("register_cafenet")
 async def choose_province_for_register(call: types.CallbackQuery):
-    async with pool.acquire() as conn:
-        provinces = await conn.fetch("SELECT id, name FROM provinces ORDER BY name")
-
-    kb = InlineKeyboardMarkup(row_width=2)
-    for p in provinces:
-        kb.add(InlineKeyboardButton(p["name"], callback_data=f"reg_province_{p['id']}"))
+    kb = await list_keyboard("provinces:reg", get_provinces, REG_PROVINCE, row_width=2)
 
     await call.message.edit_text("📍 لطفاً استان خود را انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("reg_province_"))
+@router.action(REG_PROVINCE)
 async def choose_city_for_register(call: types.CallbackQuery):
-    province_id = int(call.data.split("_")[2])
-
-    async with pool.acquire() as conn:
-        cities = await conn.fetch("SELECT id, name FROM cities WHERE province_id=$1 ORDER BY name", province_id)
+    province_id, = REG_PROVINCE.unpack(call.data)
 
-    kb = InlineKeyboardMarkup(row_width=2)
-    for cty in cities:
-        kb.add(InlineKeyboardButton(cty["name"], callback_data=f"reg_city_{province_id}_{cty['id']}"))
+    kb = await list_keyboard(
+        f"cities:{province_id}:reg",
+        lambda: get_cities(province_id),
+        lambda row: REG_CITY.pack(province_id, row["id"]),
+        row_width=2,
+    )
 
     await call.message.edit_text("🏙 شهر خود را انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("reg_city_"))
+@router.action(REG_CITY)
 async def ask_cafenet_name(call: types.CallbackQuery, state: FSMContext):
-    _, _, province_id, city_id = call.data.split("_")
+    province_id, city_id = REG_CITY.unpack(call.data)
 
     await state.update_data(
-        province_id=int(province_id),
-        city_id=int(city_id)
+        province_id=province_id,
+        city_id=city_id
     )
 
     await RegisterCafeNet.waiting_for_name.set()
@@ -625,7 +595,7 @@ async def save_location(msg: types.Message, state: FSMContext):
     await msg.answer("✅ موقعیت ثبت شد.", reply_markup=ReplyKeyboardRemove())
     await finalize_cafenet_registration(msg, state)
 
-@dp.message_handler(lambda m: m.text == "⏭ بدون موقعیت", state=RegisterCafeNet.waiting_for_location)
+@router.text("⏭ بدون موقعیت", state=RegisterCafeNet.waiting_for_location)
 async def skip_location(msg: types.Message, state: FSMContext):
     await state.update_data(location_lat=None, location_lon=None)
 
@@ -659,36 +629,32 @@ async def finalize_cafenet_registration(msg: types.Message, state: FSMContext):
 
 #===============================
 # رفتن به زیرمنوی سفارشات
-@dp.message_handler(lambda m: m.text == "📋 سفارش خدمات")
+@router.text("📋 سفارش خدمات")
 async def show_orders_menu(message: types.Message):
     await message.answer("📋 لطفاً یکی از گزینه‌های زیر را انتخاب کنید:", reply_markup=orders_menu())
 
 # ===== سفارش خدمات =====
 
 # مرحله ۱: نمایش دسته‌بندی‌ها
-@dp.message_handler(lambda m: m.text == "➕ ثبت سفارش")
+@router.text("➕ ثبت سفارش")
 async def add_order(message: types.Message):
-    async with pool.acquire() as conn:
-        cats = await conn.fetch("SELECT id, name FROM service_categories ORDER BY id")
+    cats = await get_service_categories()
 
     if not cats:
         await message.answer("⛔ هنوز هیچ دسته‌بندی ثبت نشده.")
         return
 
-    kb = InlineKeyboardMarkup(row_width=1)
-    for c in cats:
-        kb.add(InlineKeyboardButton(c["name"], callback_data=f"order_cat_{c['id']}"))
+    kb = await list_keyboard("service_categories:order", get_service_categories, ORDER_CAT)
 
     await message.answer("📂 لطفاً یک دسته‌بندی انتخاب کنید:", reply_markup=kb)
 
 
 # مرحله ۲: نمایش خدمات یک دسته
-@dp.callback_query_handler(lambda c: c.data.startswith("order_cat_"))
+@router.action(ORDER_CAT)
 async def process_order_category(call: types.CallbackQuery):
-    cat_id = int(call.data.split("_")[2])
+    cat_id, = ORDER_CAT.unpack(call.data)
 
-    async with pool.acquire() as conn:
-        services = await conn.fetch("SELECT id, title, documents FROM services WHERE category_id=$1", cat_id)
+    services = await get_services(cat_id)
 
     if not services:
         await call.message.answer("⛔ برای این دسته خدمتی ثبت نشده.")
@@ -696,18 +662,17 @@ async def process_order_category(call: types.CallbackQuery):
 
     kb = InlineKeyboardMarkup(row_width=1)
     for s in services:
-        kb.add(InlineKeyboardButton(s["title"], callback_data=f"order_service_{s['id']}"))
+        kb.add(InlineKeyboardButton(s["title"], callback_data=ORDER_SERVICE.pack(s['id'])))
 
     await call.message.answer("🔎 یکی از خدمات زیر را انتخاب کنید:", reply_markup=kb)
 
 
 # مرحله ۳: نمایش توضیحات و درخواست مدارک
-@dp.callback_query_handler(lambda c: c.data.startswith("order_service_"))
+@router.action(ORDER_SERVICE)
 async def start_order_form(call: types.CallbackQuery, state: FSMContext):
-    service_id = int(call.data.split("_")[2])
+    service_id, = ORDER_SERVICE.unpack(call.data)
 
-    async with pool.acquire() as conn:
-        service = await conn.fetchrow("SELECT id, title, documents FROM services WHERE id=$1", service_id)
+    service = await get_service(service_id)
 
     if not service:
         await call.message.answer("⛔ این خدمت یافت نشد.")
@@ -749,7 +714,7 @@ async def collect_documents(message: types.Message, state: FSMContext):
 
 
 # مرحله ۵: ثبت سفارش نهایی
-@dp.callback_query_handler(lambda c: c.data == "submit_order", state=OrderForm.waiting_for_documents)
+@router.callback("submit_order", state=OrderForm.waiting_for_documents)
 async def submit_order(call: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     service_id = data["service_id"]
@@ -759,12 +724,13 @@ async def submit_order(call: types.CallbackQuery, state: FSMContext):
     order_code = str(uuid.uuid4())[:8]
 
     async with pool.acquire() as conn:
-        await conn.execute("""
+        order_id = await conn.fetchval("""
             INSERT INTO orders (user_id, service_id, order_code, docs, status)
             VALUES ($1, $2, $3, $4, 'new')
+            RETURNING id
         """, call.from_user.id, service_id, order_code, docs)
 
-        service = await conn.fetchrow("SELECT title FROM services WHERE id=$1", service_id)
+    service = await get_service(service_id)
 
     # پیام تأیید به کاربر
     await call.message.answer(
@@ -780,7 +746,7 @@ async def submit_order(call: types.CallbackQuery, state: FSMContext):
     username = f"@{user.username}" if user.username else "—"
 
     # پیام به مدیر
-    kb = InlineKeyboardMarkup().add(InlineKeyboardButton("✅ تکمیل سفارش", callback_data=f"complete_{order_code}"))
+    kb = InlineKeyboardMarkup().add(InlineKeyboardButton("✅ تکمیل سفارش", callback_data=COMPLETE_ORDER.pack(order_id)))
     await bot.send_message(
         ADMIN_ID,
         f"📢 <b>سفارش جدید</b>\n\n"
@@ -805,7 +771,7 @@ async def submit_order(call: types.CallbackQuery, state: FSMContext):
 
 
 
-@dp.message_handler(lambda m: m.text == "📦 سفارش‌های من")
+@router.text("📦 سفارش‌های من")
 async def my_orders(message: types.Message):
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
@@ -827,7 +793,7 @@ async def my_orders(message: types.Message):
 
 
 # ===== مدیریت خدمات =====
-@dp.message_handler(lambda m: m.text == "⚙️ مدیریت خدمات")
+@router.text("⚙️ مدیریت خدمات")
 async def manage_services(message: types.Message):
     if message.from_user.id != ADMIN_ID:
         return await message.answer("⛔ شما دسترسی به این بخش ندارید.")
@@ -844,6 +810,7 @@ async def manage_services(message: types.Message):
     await message.answer("⚙️ بخش مدیریت خدمات", reply_markup=kb)
     
 
+@keyboard_cache.memoize("menu:admin")
 def admin_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add("➕ افزودن خدمات")
@@ -856,6 +823,7 @@ def admin_menu():
     return kb
 
 
+@keyboard_cache.memoize("menu:admin_services")
 def admin_services_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add("➕ افزودن خدمات", "❌ حذف خدمات")
@@ -864,32 +832,32 @@ def admin_services_menu():
     kb.add("⬅️ بازگشت به منوی اصلی")
     return kb
 
-@dp.message_handler(lambda m: m.text == "⬅️ بازگشت به مدیریت خدمات")
+@router.text("⬅️ بازگشت به مدیریت خدمات")
 async def back_to_admin_services(message: types.Message):
     await message.answer("به بخش مدیریت خدمات برگشتی.", reply_markup=admin_services_menu())
 
 
 
-@dp.message_handler(lambda m: m.text == "❌ حذف خدمات")
-async def delete_service_start(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
-        return await message.answer("⛔ شما دسترسی به این بخش ندارید.")
-
-    kb = await service_categories_keyboard()
-    await message.answer("📂 یک دسته‌بندی برای حذف خدمت انتخاب کنید:", reply_markup=kb)
-
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_"))
-async def process_delete_service(callback_query: types.CallbackQuery):
-    service_id = int(callback_query.data.split("_")[1])
-
-    async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM services WHERE id=$1", service_id)
-
-    await bot.answer_callback_query(callback_query.id, "✅ خدمت حذف شد")
-    await bot.send_message(callback_query.from_user.id, "خدمت مورد نظر حذف شد.", reply_markup=await main_menu())
+# ---------------- هندلرها ----------------
+@dp.message_handler(commands=["cache_stats"])
+async def cache_stats(msg: types.Message):
+    if msg.from_user.id not in ADMINS:
+        return
+    st = ref_cache.stats()
+    fsm = storage.stats()
+    await msg.answer(
+        "🗄 <b>کش داده‌های مرجع</b>\n\n"
+        f"✅ hit: {st['hits']}\n"
+        f"❌ miss: {st['misses']}\n"
+        f"📈 نرخ hit: {st['hit_rate']:.1%}\n"
+        f"📦 تعداد کلید: {st['size']}\n\n"
+        "💬 <b>کش وضعیت گفتگوها (FSM)</b>\n\n"
+        f"📈 نرخ hit: {fsm['hit_rate']:.1%}\n"
+        f"📦 گفتگوهای در حافظه: {fsm['size']}\n"
+        f"✏️ در انتظار ذخیره: {fsm['dirty']}"
+    )
 
 
-# ---------------- هندلرها ----------------
 @dp.message_handler(commands=["start"])
 async def start_cmd(msg: types.Message):
     async with pool.acquire() as conn:
@@ -905,26 +873,12 @@ async def start_cmd(msg: types.Message):
         reply_markup=main_menu()
     )
 
-# بازگشت به منوی اصلی
-@dp.message_handler(lambda m: m.text == "⬅️ بازگشت به منوی اصلی")
-async def back_to_main(message: types.Message):
-    await message.answer("🔙 بازگشت به منوی اصلی", reply_markup=main_menu())
-
-
-# رفتن به زیرمنوی سفارشات
-@dp.message_handler(lambda m: m.text == "📋 سفارش خدمات")
-async def show_orders_menu(message: types.Message):
-    await message.answer("📋 لطفاً یکی از گزینه‌های زیر را انتخاب کنید:", reply_markup=orders_menu())
-
-
-@dp.callback_query_handler(lambda c: c.data == "manage_add_service")
+@router.callback("manage_add_service")
 async def manage_add_service(callback: types.CallbackQuery):
-    async with pool.acquire() as conn:
-        categories = await conn.fetch("SELECT * FROM service_categories")
-    kb = InlineKeyboardMarkup(row_width=1)
-    for cat in categories:
-        kb.add(InlineKeyboardButton(cat["name"], callback_data=f"add_service_cat_{cat['id']}"))
-    kb.add(InlineKeyboardButton("⬅️ بازگشت", callback_data="manage_services"))
+    kb = await list_keyboard(
+        "service_categories:manage_add", get_service_categories, ADD_SERVICE_CAT,
+        back=("⬅️ بازگشت", "manage_services"),
+    )
     await callback.message.edit_text("📂 یک دسته‌بندی انتخاب کنید:", reply_markup=kb)
 
 from aiogram.dispatcher import FSMContext
@@ -935,9 +889,9 @@ class AddServiceFSM(StatesGroup):
     waiting_for_docs = State()
     category_id = State()
 
-@dp.callback_query_handler(lambda c: c.data.startswith("add_service_cat_"))
+@router.action(ADD_SERVICE_CAT)
 async def choose_category(callback: types.CallbackQuery, state: FSMContext):
-    category_id = int(callback.data.split("_")[-1])
+    category_id, = ADD_SERVICE_CAT.unpack(callback.data)
     await state.update_data(category_id=category_id)
     await AddServiceFSM.waiting_for_title.set()
     await callback.message.answer("📝 عنوان خدمت جدید را بفرستید:")
@@ -960,6 +914,7 @@ async def get_service_docs(msg: types.Message, state: FSMContext):
         await conn.execute("""
             INSERT INTO services (category_id, title, documents) VALUES ($1, $2, $3)
         """, category_id, title, docs)
+    ref_cache.invalidate("services")
 
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
@@ -974,26 +929,24 @@ async def get_service_docs(msg: types.Message, state: FSMContext):
 # ======================
 # افزودن ابزار
 # =======================
-@dp.message_handler(lambda m: m.text == "➕ افزودن ابزار")
+@router.text("➕ افزودن ابزار")
 async def start_add_tool(msg: types.Message):
-    add_tool_state[msg.from_user.id] = {"step": 1}
+    await conversations.start(msg.from_user.id, "add_tool", step=1)
     await msg.answer("🛠 نام ابزار را ارسال کنید:", reply_markup=ReplyKeyboardRemove())
 
 
-@dp.message_handler(lambda m: m.from_user.id in add_tool_state and add_tool_state[m.from_user.id]["step"] == 1)
-async def get_tool_name(msg: types.Message):
-    add_tool_state[msg.from_user.id]["name"] = msg.text
-    add_tool_state[msg.from_user.id]["step"] = 2
+@conversations.step("add_tool", step=1)
+async def get_tool_name(msg: types.Message, fields: dict):
+    await conversations.update(msg.from_user.id, name=msg.text, step=2)
     await msg.answer("✏️ پیام مربوط به این ابزار را ارسال کنید:")
 
 
-@dp.message_handler(lambda m: m.from_user.id in add_tool_state and add_tool_state[m.from_user.id]["step"] == 2)
-async def get_tool_message(msg: types.Message):
-    add_tool_state[msg.from_user.id]["message"] = msg.text
-    add_tool_state[msg.from_user.id]["step"] = 3
+@conversations.step("add_tool", step=2)
+async def get_tool_message(msg: types.Message, fields: dict):
+    await conversations.update(msg.from_user.id, message=msg.text, step=3)
 
-    name = add_tool_state[msg.from_user.id]["name"]
-    message = add_tool_state[msg.from_user.id]["message"]
+    name = fields["name"]
+    message = msg.text
 
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("✅ تأیید", callback_data="confirm_add_tool"))
@@ -1006,12 +959,12 @@ async def get_tool_message(msg: types.Message):
         reply_markup=kb
     )
 
-@dp.callback_query_handler(lambda c: c.data == "confirm_add_tool")
+@router.callback("confirm_add_tool")
 async def confirm_tool(call: types.CallbackQuery):
     user_id = call.from_user.id
-    data = add_tool_state.get(user_id)
+    data = await conversations.get(user_id, "add_tool")
 
-    if not data:
+    if not data.get("message"):
         return await call.answer("خطا! داده‌ای یافت نشد.", show_alert=True)
 
     name = data["name"]
@@ -1022,50 +975,45 @@ async def confirm_tool(call: types.CallbackQuery):
             "INSERT INTO tools (name, message) VALUES ($1, $2)",
             name, message
         )
+    ref_cache.invalidate("tools")
 
-    add_tool_state.pop(user_id, None)
+    await conversations.end(user_id)
 
     await call.message.edit_text("✅ ابزار با موفقیت اضافه شد.")
     await call.message.answer("به منو مدیریت برگشتی.", reply_markup=admin_menu())
 
-@dp.callback_query_handler(lambda c: c.data == "cancel_add_tool")
+@router.callback("cancel_add_tool")
 async def cancel_tool(call: types.CallbackQuery):
-    add_tool_state.pop(call.from_user.id, None)
+    await conversations.end(call.from_user.id)
     await call.message.edit_text("❌ افزودن ابزار لغو شد.")
     await call.message.answer("به منوی مدیریت برگشتی.", reply_markup=admin_menu())
 
 # ==========================
 # 🛠 نمایش ابزارهای کافی نتی
 # ==========================
-@dp.message_handler(lambda m: m.text == "🛠 ابزارهای کافی نتی")
+@router.text("🛠 ابزارهای کافی نتی")
 async def show_tools(msg: types.Message):
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT id, name FROM tools ORDER BY id DESC")
+    rows = await get_tools()
 
     if not rows:
         return await msg.answer("هیچ ابزاری ثبت نشده است.", reply_markup=main_menu())
 
-    kb = InlineKeyboardMarkup()
-    for row in rows:
-        kb.add(InlineKeyboardButton(row["name"], callback_data=f"tool_{row['id']}"))
-
-    kb.add(InlineKeyboardButton("🔙 برگشت", callback_data="back_to_main"))
+    kb = await list_keyboard("tools:list", get_tools, TOOL, back=("🔙 برگشت", "back_to_main"))
 
     await msg.answer("🛠 فهرست ابزارها:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("tool_"))
+@router.action(TOOL)
 async def show_tool_message(call: types.CallbackQuery):
-    tool_id = int(call.data.split("_")[1])
+    tool_id, = TOOL.unpack(call.data)
 
-    async with pool.acquire() as conn:
-        tool = await conn.fetchrow("SELECT name, message FROM tools WHERE id=$1", tool_id)
+    tool = await get_tool(tool_id)
 
     kb = InlineKeyboardMarkup()
 
     # اگر مدیر است → گزینه‌های مدیریت نیز نمایش داده شود
     if call.from_user.id in ADMINS:
-        kb.add(InlineKeyboardButton("✏️ ویرایش ابزار", callback_data=f"edit_tool_{tool_id}"))
-        kb.add(InlineKeyboardButton("🗑 حذف ابزار", callback_data=f"delete_tool_{tool_id}"))
+        kb.add(InlineKeyboardButton("✏️ ویرایش ابزار", callback_data=EDIT_TOOL.pack(tool_id)))
+        kb.add(InlineKeyboardButton("🗑 حذف ابزار", callback_data=DELETE_TOOL.pack(tool_id)))
 
     # گزینه برگشت برای همه
     kb.add(InlineKeyboardButton("🔙 برگشت", callback_data="back_to_tools"))
@@ -1076,119 +1024,104 @@ async def show_tool_message(call: types.CallbackQuery):
         reply_markup=kb
     )
 
-@dp.callback_query_handler(lambda c: c.data.startswith("edit_tool_"))
-async def edit_tool_start(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        return await call.answer("⛔ فقط مدیر می‌تواند ابزار را ویرایش کند.", show_alert=True)
-
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_tool_"))
-async def delete_tool_confirm(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        return await call.answer("⛔ فقط مدیر می‌تواند ابزار را حذف کند.", show_alert=True)
-
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_yes_"))
-async def delete_tool(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        return await call.answer("⛔ فقط مدیر می‌تواند حذف کند.", show_alert=True)
-
-
-@dp.callback_query_handler(lambda c: c.data == "back_to_tools")
+@router.callback("back_to_tools")
 async def back_to_tools(call: types.CallbackQuery):
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT id, name FROM tools ORDER BY id DESC")
-
-    kb = InlineKeyboardMarkup()
-    for row in rows:
-        kb.add(InlineKeyboardButton(row["name"], callback_data=f"tool_{row['id']}"))
-    kb.add(InlineKeyboardButton("🔙 برگشت", callback_data="back_to_main"))
+    kb = await list_keyboard("tools:list", get_tools, TOOL, back=("🔙 برگشت", "back_to_main"))
 
     await call.message.edit_text("🛠 فهرست ابزارها:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data == "back_to_main")
-async def back_to_main(call: types.CallbackQuery):
+@router.callback("back_to_main")
+async def back_to_main_inline(call: types.CallbackQuery):
     await call.message.edit_text("منو اصلی:")
     await call.message.answer("👇 انتخاب کن:", reply_markup=main_menu())
 
 # ===============================
 # ویرایش ابزار
 # ===============================
-@dp.callback_query_handler(lambda c: c.data.startswith("edit_tool_"))
+@router.action(EDIT_TOOL)
 async def edit_tool_start(call: types.CallbackQuery):
-    tool_id = int(call.data.split("_")[2])
-    edit_tool_state[call.from_user.id] = {"step": 1, "tool_id": tool_id}
+    if call.from_user.id not in ADMINS:
+        return await call.answer("⛔ فقط مدیر می‌تواند ابزار را ویرایش کند.", show_alert=True)
+    tool_id, = EDIT_TOOL.unpack(call.data)
+    await conversations.start(call.from_user.id, "edit_tool", step=1, tool_id=tool_id)
 
     kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("📝 ویرایش نام", callback_data=f"edit_name_{tool_id}"))
-    kb.add(InlineKeyboardButton("💬 ویرایش پیام", callback_data=f"edit_msg_{tool_id}"))
-    kb.add(InlineKeyboardButton("🔙 برگشت", callback_data=f"tool_{tool_id}"))
+    kb.add(InlineKeyboardButton("📝 ویرایش نام", callback_data=EDIT_TOOL_NAME.pack(tool_id)))
+    kb.add(InlineKeyboardButton("💬 ویرایش پیام", callback_data=EDIT_TOOL_MSG.pack(tool_id)))
+    kb.add(InlineKeyboardButton("🔙 برگشت", callback_data=TOOL.pack(tool_id)))
 
     await call.message.edit_text(
         "کدام بخش ابزار را می‌خواهی ویرایش کنی؟",
         reply_markup=kb
     )
 
-@dp.callback_query_handler(lambda c: c.data.startswith("edit_name_"))
+@router.action(EDIT_TOOL_NAME)
 async def edit_name_request(call: types.CallbackQuery):
-    tool_id = int(call.data.split("_")[2])
+    tool_id, = EDIT_TOOL_NAME.unpack(call.data)
 
-    edit_tool_state[call.from_user.id] = {"step": "name", "tool_id": tool_id}
+    await conversations.start(call.from_user.id, "edit_tool", step="name", tool_id=tool_id)
 
     await call.message.edit_text("📝 نام جدید ابزار را ارسال کنید:")
 
-@dp.message_handler(lambda m: m.from_user.id in edit_tool_state and edit_tool_state[m.from_user.id]["step"] == "name")
-async def edit_name_save(msg: types.Message):
-    data = edit_tool_state[msg.from_user.id]
-    tool_id = data["tool_id"]
+@conversations.step("edit_tool", step="name")
+async def edit_name_save(msg: types.Message, fields: dict):
+    tool_id = fields["tool_id"]
 
     async with pool.acquire() as conn:
         await conn.execute("UPDATE tools SET name=$1 WHERE id=$2", msg.text, tool_id)
+    ref_cache.invalidate("tools")
 
-    edit_tool_state.pop(msg.from_user.id, None)
+    await conversations.end(msg.from_user.id)
 
     await msg.answer("✅ نام ابزار با موفقیت به‌روزرسانی شد.")
 
-@dp.callback_query_handler(lambda c: c.data.startswith("edit_msg_"))
+@router.action(EDIT_TOOL_MSG)
 async def edit_message_request(call: types.CallbackQuery):
-    tool_id = int(call.data.split("_")[2])
+    tool_id, = EDIT_TOOL_MSG.unpack(call.data)
 
-    edit_tool_state[call.from_user.id] = {"step": "message", "tool_id": tool_id}
+    await conversations.start(call.from_user.id, "edit_tool", step="message", tool_id=tool_id)
 
     await call.message.edit_text("💬 پیام جدید ابزار را ارسال کنید:")
 
-@dp.message_handler(lambda m: m.from_user.id in edit_tool_state and edit_tool_state[m.from_user.id]["step"] == "message")
-async def edit_message_save(msg: types.Message):
-    data = edit_tool_state[msg.from_user.id]
-    tool_id = data["tool_id"]
+@conversations.step("edit_tool", step="message")
+async def edit_message_save(msg: types.Message, fields: dict):
+    tool_id = fields["tool_id"]
 
     async with pool.acquire() as conn:
         await conn.execute("UPDATE tools SET message=$1 WHERE id=$2", msg.text, tool_id)
+    ref_cache.invalidate("tools")
 
-    edit_tool_state.pop(msg.from_user.id, None)
+    await conversations.end(msg.from_user.id)
 
     await msg.answer("✅ پیام ابزار با موفقیت ویرایش شد.")
 
 # ===============================
 # حذف ابزار
 # ===============================
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_tool_"))
+@router.action(DELETE_TOOL)
 async def delete_tool_confirm(call: types.CallbackQuery):
-    tool_id = int(call.data.split("_")[2])
+    if call.from_user.id not in ADMINS:
+        return await call.answer("⛔ فقط مدیر می‌تواند ابزار را حذف کند.", show_alert=True)
+    tool_id, = DELETE_TOOL.unpack(call.data)
 
     kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("🗑 حذف نهایی", callback_data=f"delete_yes_{tool_id}"))
-    kb.add(InlineKeyboardButton("❌ لغو", callback_data=f"tool_{tool_id}"))
+    kb.add(InlineKeyboardButton("🗑 حذف نهایی", callback_data=DELETE_TOOL_YES.pack(tool_id)))
+    kb.add(InlineKeyboardButton("❌ لغو", callback_data=TOOL.pack(tool_id)))
 
     await call.message.edit_text(
         "⚠️ آیا از حذف این ابزار مطمئن هستی؟",
         reply_markup=kb
     )
 
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_yes_"))
+@router.action(DELETE_TOOL_YES)
 async def delete_tool(call: types.CallbackQuery):
-    tool_id = int(call.data.split("_")[2])
+    if call.from_user.id not in ADMINS:
+        return await call.answer("⛔ فقط مدیر می‌تواند حذف کند.", show_alert=True)
+    tool_id, = DELETE_TOOL_YES.unpack(call.data)
 
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM tools WHERE id=$1", tool_id)
+    ref_cache.invalidate("tools")
 
     await call.message.edit_text("🗑 ابزار با موفقیت حذف شد.")
 
@@ -1197,7 +1130,7 @@ async def delete_tool(call: types.CallbackQuery):
 # ======================
 # مدیریت کاربران
 # =======================
-@dp.message_handler(lambda m: m.text == "👤 مدیریت کاربران")
+@router.text("👤 مدیریت کاربران")
 async def manage_users(message: types.Message):
     if message.from_user.id not in ADMINS:
         return await message.answer("⛔ اجازه دسترسی ندارید.")
@@ -1213,6 +1146,7 @@ async def manage_users(message: types.Message):
 
     await message.answer("👤 مدیریت کاربران:", reply_markup=kb)
 
+@keyboard_cache.memoize("menu:admin_users")
 def admin_users_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add("📅 کاربران امروز", "📆 کاربران هفته")
@@ -1221,6 +1155,7 @@ def admin_users_menu():
     kb.add("⬅️ بازگشت به مدیریت خدمات")
     return kb
 
+@keyboard_cache.memoize("menu:admin_cafenet")
 def admin_cafenet_menu():
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.add("➕ افزودن کافی‌نت")
@@ -1232,7 +1167,7 @@ def admin_cafenet_menu():
 async def fetch_users(filter_type):
     async with pool.acquire() as conn:
         if filter_type == "today":
-            return await conn.fetch("SELECT user_id FROM users WHERE created_at::date = CURRENT_DATE")
+            return await conn.fetch("SELECT user_id FROM users WHERE created_at >= CURRENT_DATE")
         
         elif filter_type == "week":
             return await conn.fetch("""
@@ -1246,7 +1181,7 @@ async def fetch_users(filter_type):
                 WHERE created_at >= NOW() - INTERVAL '30 days'
             """)
 
-@dp.callback_query_handler(lambda c: c.data in ["users_today", "users_week", "users_month"])
+@router.callback("users_today", "users_week", "users_month")
 async def show_filtered_users(call: types.CallbackQuery):
     filter_map = {
         "users_today": "today",
@@ -1272,16 +1207,14 @@ async def show_filtered_users(call: types.CallbackQuery):
 
     await call.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
 
-user_manage_state = {}
-
-@dp.callback_query_handler(lambda c: c.data == "manage_user_select")
+@router.callback("manage_user_select")
 async def ask_user_id(call: types.CallbackQuery):
-    user_manage_state[call.from_user.id] = "awaiting_user_id"
+    await conversations.start(call.from_user.id, "manage_user")
     await call.message.edit_text("🔎 آیدی عددی کاربر را ارسال کنید:")
 
-@dp.message_handler(lambda m: user_manage_state.get(m.from_user.id) == "awaiting_user_id")
-async def show_user_info(msg: types.Message):
-    user_manage_state.pop(msg.from_user.id, None)
+@conversations.step("manage_user")
+async def show_user_info(msg: types.Message, fields: dict):
+    await conversations.end(msg.from_user.id)
     
     try:
         uid = int(msg.text)
@@ -1325,26 +1258,26 @@ async def show_user_info(msg: types.Message):
     )
 
     kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("🗑 حذف کاربر", callback_data=f"del_user_{uid}"))
-    kb.add(InlineKeyboardButton("🚫 بلاک کاربر", callback_data=f"block_user_{uid}"))
-    kb.add(InlineKeyboardButton("♻️ آن‌بلاک کاربر", callback_data=f"unblock_user_{uid}"))
+    kb.add(InlineKeyboardButton("🗑 حذف کاربر", callback_data=DEL_USER.pack(uid)))
+    kb.add(InlineKeyboardButton("🚫 بلاک کاربر", callback_data=BLOCK_USER.pack(uid)))
+    kb.add(InlineKeyboardButton("♻️ آن‌بلاک کاربر", callback_data=UNBLOCK_USER.pack(uid)))
     kb.add(InlineKeyboardButton("🔙 بازگشت", callback_data="user_mgmt_back"))
 
     await msg.answer(text, parse_mode="HTML", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("del_user_"))
+@router.action(DEL_USER)
 async def confirm_delete_user(call: types.CallbackQuery):
-    uid = int(call.data.replace("del_user_", ""))
+    uid, = DEL_USER.unpack(call.data)
 
     kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("🗑 حذف نهایی", callback_data=f"del_user_yes_{uid}"))
+    kb.add(InlineKeyboardButton("🗑 حذف نهایی", callback_data=DEL_USER_YES.pack(uid)))
     kb.add(InlineKeyboardButton("❌ انصراف", callback_data="user_mgmt_back"))
 
     await call.message.edit_text("⚠️ آیا از حذف کاربر مطمئنی؟", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("del_user_yes_"))
+@router.action(DEL_USER_YES)
 async def delete_user(call: types.CallbackQuery):
-    uid = int(call.data.replace("del_user_yes_", ""))
+    uid, = DEL_USER_YES.unpack(call.data)
 
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM users WHERE user_id=$1", uid)
@@ -1354,18 +1287,18 @@ async def delete_user(call: types.CallbackQuery):
 
     await call.message.edit_text("🗑 کاربر حذف شد.")
 
-@dp.callback_query_handler(lambda c: c.data.startswith("block_user_"))
+@router.action(BLOCK_USER)
 async def block_user(call: types.CallbackQuery):
-    uid = int(call.data.replace("block_user_", ""))
+    uid, = BLOCK_USER.unpack(call.data)
 
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET is_blocked=TRUE WHERE user_id=$1", uid)
 
     await call.message.edit_text("🚫 کاربر با موفقیت بلاک شد.")
 
-@dp.callback_query_handler(lambda c: c.data.startswith("unblock_user_"))
+@router.action(UNBLOCK_USER)
 async def unblock_user(call: types.CallbackQuery):
-    uid = int(call.data.replace("unblock_user_", ""))
+    uid, = UNBLOCK_USER.unpack(call.data)
 
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET is_blocked=FALSE WHERE user_id=$1", uid)
@@ -1374,17 +1307,7 @@ async def unblock_user(call: types.CallbackQuery):
 
 
 
-@dp.callback_query_handler(lambda c: c.data == "user_mgmt_back")
-async def user_mgmt_back(call: types.CallbackQuery):
-    kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("📅 کاربران امروز", callback_data="users_today"))
-    kb.add(InlineKeyboardButton("📆 کاربران هفته", callback_data="users_week"))
-    kb.add(InlineKeyboardButton("🗓 کاربران ماه", callback_data="users_month"))
-    kb.add(InlineKeyboardButton("🔙 بازگشت", callback_data="back_admin"))
-
-    await call.message.edit_text("یک فیلتر انتخاب کنید:", reply_markup=kb)
-
-@dp.callback_query_handler(lambda c: c.data == "users_count")
+@router.callback("users_count")
 async def users_count(call: types.CallbackQuery):
     async with pool.acquire() as conn:
         count = await conn.fetchval("SELECT COUNT(*) FROM users")
@@ -1398,24 +1321,19 @@ async def users_count(call: types.CallbackQuery):
         reply_markup=kb
     )
 
-user_search_state = {}
-
-@dp.callback_query_handler(lambda c: c.data == "users_search")
+@router.callback("users_search")
 async def user_search_start(call: types.CallbackQuery):
-    user_search_state[call.from_user.id] = True
-    await call.message.edit_text("🔍 نام یا یوزرنیم کاربر را وارد کنید:")
+    await conversations.start(call.from_user.id, "user_search")
+    await call.message.edit_text("🔍 نام، @یوزرنیم یا آیدی عددی کاربر را وارد کنید:")
 
-@dp.message_handler(lambda m: user_search_state.get(m.from_user.id))
-async def user_search_result(msg: types.Message):
+@conversations.step("user_search")
+async def user_search_result(msg: types.Message, fields: dict):
     term = msg.text.strip()
-    user_search_state.pop(msg.from_user.id, None)
+    await conversations.end(msg.from_user.id)
 
     async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT user_id, first_name, username
-            FROM users
-            WHERE first_name ILIKE $1 OR username ILIKE $1
-        """, f"%{term}%")
+        # جستجوی مشترک با پنل ادمین (تابع SQL در migrations/0011)
+        rows = await conn.fetch("SELECT * FROM search_users($1)", term)
 
     if not rows:
         return await msg.answer("❌ هیچ کاربری با این مشخصات یافت نشد.")
@@ -1431,21 +1349,17 @@ async def user_search_result(msg: types.Message):
 
     await msg.answer(text, parse_mode="HTML", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data == "users_by_province")
+@router.callback("users_by_province")
 async def users_by_province(call: types.CallbackQuery):
-    async with pool.acquire() as conn:
-        provinces = await conn.fetch("SELECT id, name FROM provinces ORDER BY name")
-
-    kb = InlineKeyboardMarkup()
-    for p in provinces:
-        kb.add(InlineKeyboardButton(p["name"], callback_data=f"userprov_{p['id']}"))
-    kb.add(InlineKeyboardButton("🔙 بازگشت", callback_data="user_mgmt_back"))
+    kb = await list_keyboard(
+        "provinces:users", get_provinces, USERS_BY_PROVINCE, back=("🔙 بازگشت", "user_mgmt_back")
+    )
 
     await call.message.edit_text("🗂 استان مورد نظر را انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("userprov_"))
+@router.action(USERS_BY_PROVINCE)
 async def users_by_province_list(call: types.CallbackQuery):
-    prov_id = int(call.data.split("_")[1])
+    prov_id, = USERS_BY_PROVINCE.unpack(call.data)
 
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
@@ -1469,7 +1383,7 @@ async def users_by_province_list(call: types.CallbackQuery):
 
     await call.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data == "user_mgmt_back")
+@router.callback("user_mgmt_back")
 async def user_mgmt_back(call: types.CallbackQuery):
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("📅 کاربران امروز", callback_data="users_today"))
@@ -1482,24 +1396,22 @@ async def user_mgmt_back(call: types.CallbackQuery):
 
     await call.message.edit_text("یک فیلتر انتخاب کنید:", reply_markup=kb)
 
-broadcast_state = {}
-
 
 # ==============================
 #  مدیریت کاربران - آمار
 # ==============================
 
-@dp.message_handler(lambda m: m.text == "📅 کاربران امروز")
+@router.text("📅 کاربران امروز")
 async def users_today(message: types.Message):
     async with pool.acquire() as conn:
         count = await conn.fetchval("""
             SELECT COUNT(*) FROM users 
-            WHERE created_at::date = CURRENT_DATE
+            WHERE created_at >= CURRENT_DATE
         """)
     await message.answer(f"📅 تعداد کاربران امروز: {count}")
 
 
-@dp.message_handler(lambda m: m.text == "📆 کاربران هفته")
+@router.text("📆 کاربران هفته")
 async def users_week(message: types.Message):
     async with pool.acquire() as conn:
         count = await conn.fetchval("""
@@ -1509,7 +1421,7 @@ async def users_week(message: types.Message):
     await message.answer(f"📆 تعداد کاربران هفته: {count}")
 
 
-@dp.message_handler(lambda m: m.text == "🗓 کاربران ماه")
+@router.text("🗓 کاربران ماه")
 async def users_month(message: types.Message):
     async with pool.acquire() as conn:
         count = await conn.fetchval("""
@@ -1519,12 +1431,12 @@ async def users_month(message: types.Message):
     await message.answer(f"🗓 تعداد کاربران ماه: {count}")
 
 
-@dp.message_handler(lambda m: m.text == "⏱ آخرین فعالیت کاربران")
+@router.text("⏱ آخرین فعالیت کاربران")
 async def last_seen_users(message: types.Message):
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
             SELECT user_id, last_seen FROM users 
-            ORDER BY last_seen DESC 
+            ORDER BY last_seen DESC NULLS LAST
             LIMIT 20
         """)
     txt = "⏱ آخرین فعالیت 20 کاربر اخیر:\n\n"
@@ -1533,92 +1445,149 @@ async def last_seen_users(message: types.Message):
     await message.answer(txt)
 
 
-@dp.message_handler(lambda m: m.text == "📊 تعداد کل کاربران")
+@router.text("📊 تعداد کل کاربران")
 async def total_users(message: types.Message):
     async with pool.acquire() as conn:
         count = await conn.fetchval("SELECT COUNT(*) FROM users")
     await message.answer(f"📊 تعداد کل کاربران: {count}")
 
 
-@dp.message_handler(lambda m: m.text == "🔍 جستجوی کاربر")
+@router.text("🔍 جستجوی کاربر")
 async def search_user_start(message: types.Message):
-    await message.answer("🔍 لطفاً آیدی عددی کاربر را وارد کنید:")
-    user_states[message.from_user.id] = "search_user"
-
-
-@dp.message_handler(lambda m: user_states.get(m.from_user.id) == "search_user")
-async def search_user_process(message: types.Message):
-    uid = message.text.strip()
+    await message.answer("🔍 لطفاً آیدی عددی، @یوزرنیم یا نام کاربر را وارد کنید:")
+    await conversations.start(message.from_user.id, "search_user")
 
-    if not uid.isdigit():
-        return await message.answer("❌ آیدی باید فقط عدد باشد.")
-
-    uid = int(uid)
 
+@conversations.step("search_user")
+async def search_user_process(message: types.Message, fields: dict):
     async with pool.acquire() as conn:
-        user = await conn.fetchrow("""
-            SELECT * FROM users WHERE user_id=$1
-        """, uid)
+        users = await conn.fetch("SELECT * FROM search_users($1, $2)", message.text or "", 10)
 
-    if not user:
+    if not users:
         await message.answer("❌ کاربری با این مشخصات پیدا نشد.")
     else:
-        await message.answer(f"👤 کاربر پیدا شد:\n\n"
-                             f"ID: {user['user_id']}\n"
-                             f"نام: {user['first_name']}\n"
-                             f"نام‌کاربری: @{user['username']}\n"
-                             f"آخرین فعالیت: {user['last_seen']}")
+        header = "👤 کاربر پیدا شد:" if len(users) == 1 else f"👤 {len(users)} کاربر پیدا شد:"
+        await message.answer(header + "\n\n" + "\n\n".join(
+            f"ID: {user['user_id']}\n"
+            f"نام: {user['first_name']}\n"
+            f"نام‌کاربری: @{user['username']}\n"
+            f"آخرین فعالیت: {user['last_seen']}"
+            for user in users
+        ))
 
-    user_states.pop(message.from_user.id, None)
+    await conversations.end(message.from_user.id)
 
 
 # ===================================
-@dp.message_handler(lambda m: m.text == "⬅️ بازگشت به مدیریت کافی‌نت")
+@router.text("⬅️ بازگشت به مدیریت کافی‌نت")
 async def back_to_cafenet_menu(message: types.Message):
     await message.answer("🏢 مدیریت کافی‌نت", reply_markup=admin_cafenet_menu())
 
-@dp.message_handler(lambda m: m.text == "⬅️ بازگشت به مدیریت خدمات")
-async def back_to_services(message: types.Message):
-    await message.answer("⚙️ مدیریت خدمات", reply_markup=admin_services_menu())
 
 
-@dp.message_handler(lambda m: m.text == "📨 ارسال پیام انبوه")
+@router.text("📨 ارسال پیام انبوه")
 async def broadcast_start(message: types.Message):
     if message.from_user.id not in ADMINS:
         return await message.answer("⛔ اجازه دسترسی ندارید.")
 
-    broadcast_state[message.from_user.id] = True
+    await conversations.start(message.from_user.id, "broadcast")
     await message.answer("📨 لطفاً پیام موردنظر برای ارسال انبوه را ارسال کنید:")
 
-@dp.message_handler(lambda m: broadcast_state.get(m.from_user.id))
-async def broadcast_send(message: types.Message):
+@conversations.step("broadcast")
+async def broadcast_send(message: types.Message, fields: dict):
     text = message.text
-    del broadcast_state[message.from_user.id]
+    await conversations.end(message.from_user.id)
 
-    async with pool.acquire() as conn:
-        users = await conn.fetch("SELECT user_id FROM users WHERE is_blocked=FALSE")
+    job_id = await broadcast_jobs.create(message.from_user.id, message.chat.id, text)
+    job = await broadcast_jobs.get(job_id)
+    status_msg = await message.answer(
+        broadcast_job_text(job), reply_markup=broadcast_job_keyboard(job)
+    )
+    await broadcast_jobs.attach_message(job_id, status_msg.message_id)
+    # ارسال در پس‌زمینه انجام می‌شود تا چت ادمین مسدود نشود
+    broadcast_jobs.start(job_id)
 
-    sent = 0
-    failed = 0
 
-    for u in users:
-        try:
-            await bot.send_message(u["user_id"], text)
-            await asyncio.sleep(0.05)
-            sent += 1
-        except:
-            failed += 1
+BROADCAST_STATUS_LABELS = {
+    "running": "⏳ در حال ارسال",
+    "paused": "⏸ متوقف شده",
+    "cancelled": "⛔ لغو شده",
+    "done": "✅ پایان یافته",
+}
+
 
-    await message.answer(f"✔️ ارسال موفق: {sent}\n❌ ارسال ناموفق: {failed}")
+def broadcast_job_text(job):
+    done = job["sent"] + job["failed"] + job["blocked"]
+    return (
+        f"📨 ارسال انبوه #{job['id']} — {BROADCAST_STATUS_LABELS.get(job['status'], job['status'])}\n\n"
+        f"📊 پیشرفت: {done}/{job['total']}\n"
+        f"✔️ موفق: {job['sent']} | ❌ ناموفق: {job['failed']} | 🚫 بلاک: {job['blocked']}"
+    )
 
 
-@dp.callback_query_handler(lambda c: c.data == "users_last_seen")
+def broadcast_job_keyboard(job):
+    kb = InlineKeyboardMarkup(row_width=2)
+    if job["status"] == "running":
+        kb.add(
+            InlineKeyboardButton("⏸ توقف موقت", callback_data=BCAST_PAUSE.pack(job['id'])),
+            InlineKeyboardButton("⛔ لغو", callback_data=BCAST_CANCEL.pack(job['id'])),
+        )
+    elif job["status"] == "paused":
+        kb.add(
+            InlineKeyboardButton("▶️ ادامه", callback_data=BCAST_RESUME.pack(job['id'])),
+            InlineKeyboardButton("⛔ لغو", callback_data=BCAST_CANCEL.pack(job['id'])),
+        )
+    return kb
+
+
+async def report_broadcast_job(job):
+    if not job["chat_id"] or not job["message_id"]:
+        return
+    try:
+        await bot.edit_message_text(
+            broadcast_job_text(job),
+            chat_id=job["chat_id"],
+            message_id=job["message_id"],
+            reply_markup=broadcast_job_keyboard(job),
+        )
+    except Exception as e:
+        # MessageNotModified و پیام‌های حذف‌شده مانع ادامه ارسال نشوند
+        logging.debug("broadcast status edit skipped: %s", e)
+
+    if job["status"] == "done":
+        await bot.send_message(
+            job["chat_id"],
+            f"✔️ ارسال موفق: {job['sent']}\n"
+            f"❌ ارسال ناموفق: {job['failed']}\n"
+            f"🚫 بلاک‌شده (غیرفعال شد): {job['blocked']}"
+        )
+
+
+@router.action(BCAST_PAUSE, BCAST_RESUME, BCAST_CANCEL)
+async def broadcast_job_control(call: types.CallbackQuery):
+    if call.from_user.id not in ADMINS:
+        return await call.answer("⛔ اجازه دسترسی ندارید.", show_alert=True)
+
+    action, (job_id,) = callback_codec.resolve(call.data)
+    actions = {
+        BCAST_PAUSE: (broadcast_jobs.pause, "⏸ ارسال متوقف شد."),
+        BCAST_RESUME: (broadcast_jobs.resume, "▶️ ارسال ادامه یافت."),
+        BCAST_CANCEL: (broadcast_jobs.cancel, "⛔ ارسال لغو شد."),
+    }
+    func, done_text = actions[action]
+    if await func(job_id):
+        await call.answer(done_text)
+    else:
+        await call.answer("⚠️ وضعیت این ارسال قابل تغییر نیست.", show_alert=True)
+
+
+@router.callback("users_last_seen")
 async def users_last_seen(call: types.CallbackQuery):
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
             SELECT user_id, first_name, username, last_seen
             FROM users
-            ORDER BY last_seen DESC
+            ORDER BY last_seen DESC NULLS LAST
             LIMIT 20
         """)
 
@@ -1643,7 +1612,7 @@ async def users_last_seen(call: types.CallbackQuery):
 # ======================
 # مدیریت کافی‌نت
 # =======================
-@dp.message_handler(lambda m: m.text == "🏢 مدیریت کافی‌نت")
+@router.text("🏢 مدیریت کافی‌نت")
 async def manage_cafenet(message: types.Message):
     if message.from_user.id not in ADMINS:
         return await message.answer("⛔ اجازه دسترسی ندارید.")
@@ -1657,26 +1626,26 @@ async def manage_cafenet(message: types.Message):
 
     await message.answer("🏢 مدیریت کافی‌نت‌ها:", reply_markup=kb)
 
-@dp.message_handler(lambda m: m.text == "🌍 فیلتر بر اساس استان")
+@router.text("🌍 فیلتر بر اساس استان")
 async def filter_by_province(message: types.Message):
-    cafenet_filter_state[message.from_user.id] = "province"
-
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT id, name FROM provinces ORDER BY name")
+    await conversations.start(message.from_user.id, "cafenet_filter", by="province")
 
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    for p in rows:
-        kb.add(f"{p['id']} - {p['name']}")
+    async def build():
+        kb = ReplyKeyboardMarkup(resize_keyboard=True)
+        for p in await get_provinces():
+            kb.add(f"{p['id']} - {p['name']}")
+        kb.add("⬅️ بازگشت")
+        return kb
 
-    kb.add("⬅️ بازگشت")
+    kb = await keyboard_cache.aget("provinces:filter", build)
 
     await message.answer("🌍 استان موردنظر را انتخاب کنید:", reply_markup=kb)
 
 
-@dp.message_handler(lambda m: " - " in m.text and cafenet_filter_state.get(m.from_user.id) == "province")
-async def show_by_province(message: types.Message):
+@conversations.step("cafenet_filter", lambda m: " - " in m.text, by="province")
+async def show_by_province(message: types.Message, fields: dict):
     prov_id = int(message.text.split(" - ")[0])
-    del cafenet_filter_state[message.from_user.id]
+    await conversations.end(message.from_user.id)
 
     async with pool.acquire() as conn:
         nets = await conn.fetch("""
@@ -1696,15 +1665,15 @@ async def show_by_province(message: types.Message):
 
     await message.answer(text, reply_markup=kb)
 
-@dp.message_handler(lambda m: m.text == "📋 نمایش همه کافی‌نت‌ها")
+@router.text("📋 نمایش همه کافی‌نت‌ها")
 async def show_all_cafenets(message: types.Message):
-    cafenet_page_state[message.from_user.id] = 1
+    await conversations.start(message.from_user.id, "cafenet_list", page=1)
     await send_cafenet_list(message)
 
 
 async def send_cafenet_list(message):
     uid = message.from_user.id
-    page = cafenet_page_state.get(uid, 1)
+    page = (await conversations.get(uid, "cafenet_list")).get("page", 1)
     limit = 20
     offset = (page - 1) * limit
 
@@ -1736,25 +1705,31 @@ async def send_cafenet_list(message):
 
     await message.answer(text, reply_markup=kb)
 
-@dp.message_handler(lambda m: m.text in ["⬅️ صفحه قبل", "➡️ صفحه بعد"])
+@router.text("⬅️ صفحه قبل", "➡️ صفحه بعد")
 async def paginate_cafenets(message: types.Message):
     uid = message.from_user.id
-    page = cafenet_page_state.get(uid, 1)
+    page = (await conversations.get(uid, "cafenet_list")).get("page", 1)
 
     if message.text == "⬅️ صفحه قبل":
         page -= 1
     else:
         page += 1
 
-    cafenet_page_state[uid] = max(1, page)
+    await conversations.start(uid, "cafenet_list", page=max(1, page))
 
     await send_cafenet_list(message)
 
 
 
-@dp.message_handler(lambda m: cafenet_manage_state.get(m.from_user.id))
-async def show_cafenet_info(msg: types.Message):
-    cafenet_manage_state.pop(msg.from_user.id, None)
+@router.callback("cn_manage_select")
+async def ask_cafenet_manage_id(call: types.CallbackQuery):
+    await conversations.start(call.from_user.id, "cafenet_manage")
+    await call.message.edit_text("🔎 آیدی عددی کافی‌نت را ارسال کنید:")
+
+
+@conversations.step("cafenet_manage")
+async def show_cafenet_info_inline(msg: types.Message, fields: dict):
+    await conversations.end(msg.from_user.id)
 
     try:
         cid = int(msg.text)
@@ -1810,8 +1785,8 @@ async def show_cafenet_info(msg: types.Message):
 
     await msg.answer(text, parse_mode="HTML", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data == "back_cafenet")
-async def back_to_cafenet_menu(call: types.CallbackQuery):
+@router.callback("back_cafenet")
+async def back_to_cafenet_menu_inline(call: types.CallbackQuery):
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("🌍 فیلتر بر اساس استان", callback_data="cn_filter_province"))
     kb.add(InlineKeyboardButton("🏙 فیلتر بر اساس شهر", callback_data="cn_filter_city"))
@@ -1821,21 +1796,17 @@ async def back_to_cafenet_menu(call: types.CallbackQuery):
     await call.message.edit_text("🏢 مدیریت کافی‌نت‌ها:", reply_markup=kb)
 
 
-@dp.callback_query_handler(lambda c: c.data == "cn_filter_province")
+@router.callback("cn_filter_province")
 async def select_cafenet_province(call: types.CallbackQuery):
-    async with pool.acquire() as conn:
-        provinces = await conn.fetch("SELECT id, name FROM provinces ORDER BY name")
-
-    kb = InlineKeyboardMarkup()
-    for p in provinces:
-        kb.add(InlineKeyboardButton(p["name"], callback_data=f"cn_prov_{p['id']}"))
-    kb.add(InlineKeyboardButton("🔙 بازگشت", callback_data="back_cafenet"))
+    kb = await list_keyboard(
+        "provinces:cafenet", get_provinces, CAFENET_PROVINCE, back=("🔙 بازگشت", "back_cafenet")
+    )
 
     await call.message.edit_text("🌍 یک استان انتخاب کنید:", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("cn_prov_"))
+@router.action(CAFENET_PROVINCE)
 async def show_cafenets_by_province(call: types.CallbackQuery):
-    prov_id = int(call.data.split("_")[2])
+    prov_id, = CAFENET_PROVINCE.unpack(call.data)
 
     async with pool.acquire() as conn:
         nets = await conn.fetch("""
@@ -1855,30 +1826,25 @@ async def show_cafenets_by_province(call: types.CallbackQuery):
 
     await call.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
 
-@dp.message_handler(lambda m: m.text == "🏙 فیلتر بر اساس شهر")
+@router.text("🏙 فیلتر بر اساس شهر")
 async def filter_by_city(message: types.Message):
-    cafenet_filter_state[message.from_user.id] = "city"
+    await conversations.start(message.from_user.id, "cafenet_filter", by="city")
 
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT c.id, c.name, p.name AS province
-            FROM cities c
-            JOIN provinces p ON p.id=c.province_id
-            ORDER BY p.name, c.name
-        """)
-
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    for row in rows:
-        kb.add(f"{row['id']} - {row['province']} / {row['name']}")
+    async def build():
+        kb = ReplyKeyboardMarkup(resize_keyboard=True)
+        for row in await get_all_cities():
+            kb.add(f"{row['id']} - {row['province']} / {row['name']}")
+        kb.add("⬅️ بازگشت")
+        return kb
 
-    kb.add("⬅️ بازگشت")
+    kb = await keyboard_cache.aget("cities:all:filter", build)
 
     await message.answer("🏙 شهر را انتخاب کنید:", reply_markup=kb)
 
-@dp.message_handler(lambda m: " - " in m.text and cafenet_filter_state.get(m.from_user.id) == "city")
-async def show_by_city(message: types.Message):
+@conversations.step("cafenet_filter", lambda m: " - " in m.text, by="city")
+async def show_by_city(message: types.Message, fields: dict):
     city_id = int(message.text.split(" - ")[0])
-    del cafenet_filter_state[message.from_user.id]
+    await conversations.end(message.from_user.id)
 
     async with pool.acquire() as conn:
         nets = await conn.fetch("""
@@ -1900,18 +1866,15 @@ async def show_by_city(message: types.Message):
 
 
 
-cafenet_search_state = {}
-
-
-@dp.message_handler(lambda m: m.text == "🔍 جستجو با نام")
-async def ask_cafenet_name(message: types.Message):
-    cafenet_search_state[message.from_user.id] = True
+@router.text("🔍 جستجو با نام")
+async def ask_cafenet_search_term(message: types.Message):
+    await conversations.start(message.from_user.id, "cafenet_search")
     await message.answer("🔍 نام کافی‌نت را وارد کنید:")
 
-@dp.message_handler(lambda m: cafenet_search_state.get(m.from_user.id))
-async def search_cafenet(message: types.Message):
+@conversations.step("cafenet_search")
+async def search_cafenet(message: types.Message, fields: dict):
     term = message.text
-    del cafenet_search_state[message.from_user.id]
+    await conversations.end(message.from_user.id)
 
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
@@ -1932,15 +1895,15 @@ async def search_cafenet(message: types.Message):
 
     await message.answer(text, reply_markup=kb)
 
-@dp.message_handler(lambda m: m.text == "🔎 مدیریت کافی‌نت")
+@router.text("🔎 مدیریت کافی‌نت")
 async def ask_cafenet_id(message: types.Message):
-    cafenet_state[message.from_user.id] = True
+    await conversations.start(message.from_user.id, "cafenet_manage_reply")
     await message.answer("🔎 آیدی عددی کافی‌نت را ارسال کنید:")
 
 
-@dp.message_handler(lambda m: cafenet_state.get(m.from_user.id))
-async def show_cafenet_info(message: types.Message):
-    del cafenet_state[message.from_user.id]
+@conversations.step("cafenet_manage_reply")
+async def show_cafenet_info(message: types.Message, fields: dict):
+    await conversations.end(message.from_user.id)
 
     try:
         cid = int(message.text)
@@ -1989,25 +1952,25 @@ async def show_cafenet_info(message: types.Message):
 
 # ========================
 # هندلر برای تکمیل سفارش
-@dp.callback_query_handler(lambda c: c.data.startswith("complete_"))
+@router.action(COMPLETE_ORDER)
 async def complete_order(callback_query: types.CallbackQuery):
-    order_code = callback_query.data.split("_")[1]
+    order_id, = COMPLETE_ORDER.unpack(callback_query.data)
 
     async with pool.acquire() as conn:
         # گرفتن سفارش برای پیدا کردن user_id
-        order = await conn.fetchrow("SELECT user_id FROM orders WHERE order_code=$1", order_code)
+        order = await conn.fetchrow("SELECT user_id, order_code FROM orders WHERE id=$1", order_id)
         if not order:
             await bot.answer_callback_query(callback_query.id, "⛔ سفارش پیدا نشد.", show_alert=True)
             return
 
-        user_id = order["user_id"]
+        user_id, order_code = order["user_id"], order["order_code"]
 
         # تغییر وضعیت به completed و پاک کردن مدارک
         await conn.execute("""
             UPDATE orders
             SET status='completed', docs=NULL
-            WHERE order_code=$1
-        """, order_code)
+            WHERE id=$1
+        """, order_id)
 
     # پیام به مدیر
     await bot.answer_callback_query(callback_query.id, "✅ سفارش تکمیل شد.", show_alert=True)
@@ -2020,103 +1983,52 @@ async def complete_order(callback_query: types.CallbackQuery):
 
 
 # بازگشت به منو
-@dp.callback_query_handler(lambda c: c.data == "back_main")
+@router.callback("back_main")
 async def back_main(callback_query: types.CallbackQuery):
     await bot.answer_callback_query(callback_query.id)
     await bot.send_message(callback_query.from_user.id, "🏠 منوی اصلی:", reply_markup=main_menu())
 
-# مرحله ۱: درخواست کلیدواژه
-@dp.message_handler(lambda m: m.text == "🔍 جستجو در اطلاعیه/خبر")
-async def ask_keyword(msg: types.Message):
-    await msg.answer("🔎 لطفاً کلیدواژه مورد نظر خود را وارد کنید:")
-    await SearchForm.waiting_for_keyword.set()
-
-# مرحله ۲: جستجو
-@dp.message_handler(state=SearchForm.waiting_for_keyword)
-async def search_posts(msg: types.Message, state: FSMContext):
-    keyword = msg.text
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT p.id, p.title, p.content, array_agg(h.name) AS hashtags
+async def find_posts(conn, keyword, limit):
+    """
+    جستجوی تمام‌متن روی عنوان و متن پست‌ها با ایندکس GIN.
+    رتبه‌بندی بر اساس ارتباط (عنوان وزن بیشتری دارد) و تازگی پست.
+    """
+    query = prefix_tsquery(keyword)
+    if not query:
+        return []
+    return await conn.fetch("""
+        WITH hits AS (
+            SELECT p.id, p.title, p.content, p.created_at,
+                   ts_rank(p.search_vector, to_tsquery('simple', $1))
+                     / (1 + EXTRACT(EPOCH FROM NOW() - p.created_at) / 2592000) AS score
             FROM posts p
-            LEFT JOIN post_hashtags ph ON p.id = ph.post_id
-            LEFT JOIN hashtags h ON ph.hashtag_id = h.id
-            WHERE p.title ILIKE $1
-            GROUP BY p.id
-            ORDER BY p.created_at DESC
-            LIMIT 5
-        """, f"%{keyword}%")
-
-    if not rows:
-        await msg.answer("⛔ هیچ خبری با این کلیدواژه یافت نشد.")
-        await state.finish()
-        return
-
-    for row in rows:
-        summary = (row["content"][:100] + "...") if row["content"] else "⛔ بدون توضیحات"
-        kb = InlineKeyboardMarkup()
-        kb.add(InlineKeyboardButton("🔽 نمایش کامل خبر", callback_data=f"full_{row['id']}"))
-
-        # دکمه هشتگ‌ها
-        if row["hashtags"]:
-            for h in row["hashtags"]:
-                kb.add(InlineKeyboardButton(f"#{h}", callback_data=f"tag_{h}"))
-
-        await msg.answer(
-            f"📌 <b>{row['title']}</b>\n\n"
-            f"📝 {summary}",
-            reply_markup=kb
-        )
-
-    await state.finish()
-
-# مرحله ۳: نمایش کامل خبر
-@dp.callback_query_handler(lambda c: c.data.startswith("full_"))
-async def show_full(callback_query: types.CallbackQuery):
-    post_id = int(callback_query.data.split("_")[1])
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT title, content FROM posts WHERE id=$1", post_id)
-
-    if row:
-        await bot.send_message(
-            callback_query.from_user.id,
-            f"📌 <b>{row['title']}</b>\n\n{row['content']}"
+            -- inline, not a FROM item: only then is it a GIN index condition
+            WHERE p.search_vector @@ to_tsquery('simple', $1)
+            ORDER BY score DESC, p.created_at DESC
+            LIMIT $2
         )
+        SELECT h.id, h.title, h.content,
+               ARRAY(
+                   SELECT t.name FROM post_hashtags ph
+                   JOIN hashtags t ON t.id = ph.hashtag_id
+                   WHERE ph.post_id = h.id
+                   ORDER BY t.id
+               ) AS hashtags,
+               ARRAY(
+                   SELECT ph.hashtag_id FROM post_hashtags ph
+                   WHERE ph.post_id = h.id
+                   ORDER BY ph.hashtag_id
+               ) AS hashtag_ids
+        FROM hits h
+        ORDER BY h.score DESC, h.created_at DESC
+    """, query, limit)
 
-    await bot.answer_callback_query(callback_query.id)
-
-# مرحله ۴: نمایش پست‌های مرتبط با هشتگ
-@dp.callback_query_handler(lambda c: c.data.startswith("tag_"))
-async def show_tag_posts(callback_query: types.CallbackQuery):
-    tag = callback_query.data.split("_")[1]
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT p.title, p.content
-            FROM posts p
-            JOIN post_hashtags ph ON p.id = ph.post_id
-            JOIN hashtags h ON ph.hashtag_id = h.id
-            WHERE h.name=$1
-            ORDER BY p.created_at DESC
-            LIMIT 5
-        """, tag)
-
-    if not rows:
-        await bot.send_message(callback_query.from_user.id, "⛔ خبری برای این هشتگ یافت نشد.")
-    else:
-        for row in rows:
-            summary = (row["content"][:100] + "...") if row["content"] else "⛔ بدون توضیحات"
-            await bot.send_message(
-                callback_query.from_user.id,
-                f"📌 <b>{row['title']}</b>\n\n📝 {summary}"
-            )
-
-    await bot.answer_callback_query(callback_query.id)
 
 # =========================
 # 🔍 جستجو اطلاعیه/خبر
 # =========================
 # مرحله ۱: درخواست کلیدواژه
-@dp.message_handler(lambda m: m.text == "🔍 جستجو اطلاعیه/خبر")
+@router.text("🔍 جستجو اطلاعیه/خبر", "🔍 جستجو در اطلاعیه/خبر")
 async def ask_keyword(msg: types.Message):
     await msg.answer("🔎 لطفاً کلیدواژه مورد نظر خود را وارد کنید:")
     await SearchForm.waiting_for_keyword.set()
@@ -2135,16 +2047,7 @@ async def search_posts(msg: types.Message, state: FSMContext):
         if not post_limit:
             post_limit = 5  # پیش‌فرض
 
-        rows = await conn.fetch("""
-            SELECT p.id, p.title, p.content, array_agg(h.name) AS hashtags
-            FROM posts p
-            LEFT JOIN post_hashtags ph ON p.id = ph.post_id
-            LEFT JOIN hashtags h ON ph.hashtag_id = h.id
-            WHERE p.title ILIKE $1
-            GROUP BY p.id
-            ORDER BY p.created_at DESC
-            LIMIT $2
-        """, f"%{keyword}%", post_limit)
+        rows = await find_posts(conn, keyword, post_limit)
 
     if not rows:
         await msg.answer("⛔ هیچ خبری با این کلیدواژه یافت نشد.")
@@ -2154,13 +2057,12 @@ async def search_posts(msg: types.Message, state: FSMContext):
     for row in rows:
         summary = (row["content"][:120] + "...") if row["content"] else "⛔ بدون توضیحات"
         kb = InlineKeyboardMarkup()
-        kb.add(InlineKeyboardButton("🔽 نمایش کامل خبر", callback_data=f"full_{row['id']}"))
+        kb.add(InlineKeyboardButton("🔽 نمایش کامل خبر", callback_data=FULL_POST.pack(row['id'])))
 
         # دکمه هشتگ‌ها
-        if row["hashtags"]:
-            for h in row["hashtags"]:
-                if h:  # حذف None
-                    kb.add(InlineKeyboardButton(f"#{h}", callback_data=f"tag_{h}"))
+        for tag_id, h in zip(row["hashtag_ids"] or [], row["hashtags"] or []):
+            if h:  # حذف None
+                kb.add(InlineKeyboardButton(f"#{h}", callback_data=TAG_POSTS.pack(tag_id)))
 
         await msg.answer(
             f"📌 <b>{row['title']}</b>\n\n"
@@ -2173,9 +2075,9 @@ async def search_posts(msg: types.Message, state: FSMContext):
 
 
 # مرحله ۳: نمایش کامل خبر
-@dp.callback_query_handler(lambda c: c.data.startswith("full_"))
+@router.action(FULL_POST)
 async def show_full(callback_query: types.CallbackQuery):
-    post_id = int(callback_query.data.split("_")[1])
+    post_id, = FULL_POST.unpack(callback_query.data)
     async with pool.acquire() as conn:
         row = await conn.fetchrow("SELECT title, content FROM posts WHERE id=$1", post_id)
 
@@ -2190,9 +2092,9 @@ async def show_full(callback_query: types.CallbackQuery):
 
 
 # مرحله ۴: نمایش پست‌های مرتبط با هشتگ
-@dp.callback_query_handler(lambda c: c.data.startswith("tag_"))
+@router.action(TAG_POSTS)
 async def show_tag_posts(callback_query: types.CallbackQuery):
-    tag = callback_query.data.split("_", 1)[1]
+    hashtag_id, = TAG_POSTS.unpack(callback_query.data)
 
     async with pool.acquire() as conn:
         # 🔹 تعداد پست مجاز را از تنظیمات کاربر بخوان
@@ -2206,11 +2108,10 @@ async def show_tag_posts(callback_query: types.CallbackQuery):
             SELECT p.title, p.content
             FROM posts p
             JOIN post_hashtags ph ON p.id = ph.post_id
-            JOIN hashtags h ON ph.hashtag_id = h.id
-            WHERE h.name=$1
+            WHERE ph.hashtag_id=$1
             ORDER BY p.created_at DESC
             LIMIT $2
-        """, tag, post_limit)
+        """, hashtag_id, post_limit)
 
     if not rows:
         await bot.send_message(callback_query.from_user.id, "⛔ خبری برای این هشتگ یافت نشد.")
@@ -2229,7 +2130,7 @@ async def show_tag_posts(callback_query: types.CallbackQuery):
 # ======================
 # 🔔 دریافت خودکار خبر
 # ======================
-@dp.message_handler(lambda m: m.text == "🔔 دریافت خودکار خبر")
+@router.text("🔔 دریافت خودکار خبر")
 async def show_subscriptions(message: types.Message):
     async with pool.acquire() as conn:
         hashtags = await conn.fetch("SELECT * FROM hashtags ORDER BY name")
@@ -2242,15 +2143,15 @@ async def show_subscriptions(message: types.Message):
             )
             status = "✅" if subscribed else "❌"
             keyboard.add(
-                InlineKeyboardButton(f"{h['name']} {status}", callback_data=f"toggle_sub_{h['id']}")
+                InlineKeyboardButton(f"{h['name']} {status}", callback_data=TOGGLE_SUB.pack(h['id']))
             )
 
     await message.answer("🔔 هشتگ‌هایی که می‌خواهید دنبال کنید رو انتخاب کنید:", reply_markup=keyboard)
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("toggle_sub_"))
+@router.action(TOGGLE_SUB)
 async def toggle_subscription(callback_query: types.CallbackQuery):
-    hashtag_id = int(callback_query.data.split("_")[2])
+    hashtag_id, = TOGGLE_SUB.unpack(callback_query.data)
     user_id = callback_query.from_user.id
 
     async with pool.acquire() as conn:
@@ -2271,7 +2172,7 @@ async def toggle_subscription(callback_query: types.CallbackQuery):
                 user_id, h["id"]
             )
             status = "✅" if subscribed else "❌"
-            keyboard.add(InlineKeyboardButton(f"{h['name']} {status}", callback_data=f"toggle_sub_{h['id']}"))
+            keyboard.add(InlineKeyboardButton(f"{h['name']} {status}", callback_data=TOGGLE_SUB.pack(h['id'])))
 
     await callback_query.message.edit_reply_markup(reply_markup=keyboard)
     await callback_query.answer("وضعیت بروزرسانی شد ✅")
@@ -2281,45 +2182,59 @@ async def toggle_subscription(callback_query: types.CallbackQuery):
 # ==========================
 #  حذف خدمات
 # ==========================
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_cat_"))
+@router.action(DELETE_CAT)
 async def process_delete_category(call: types.CallbackQuery):
-    category_id = int(call.data.split("_")[2])
-    async with pool.acquire() as conn:
-        services = await conn.fetch("SELECT id, title FROM services WHERE category_id=$1", category_id)
+    category_id, = DELETE_CAT.unpack(call.data)
+    services = await get_services(category_id)
     if not services:
         await call.message.edit_text("⛔ خدمتی در این دسته وجود ندارد.")
         return
     kb = InlineKeyboardMarkup()
     for s in services:
-        kb.add(InlineKeyboardButton(f"❌ {s['title']}", callback_data=f"delete_service_{s['id']}"))
+        kb.add(InlineKeyboardButton(f"❌ {s['title']}", callback_data=DELETE_SERVICE.pack(s['id'])))
     await call.message.edit_text("🗑 یکی از خدمات را برای حذف انتخاب کنید:", reply_markup=kb)
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_service_"))
+@router.action(DELETE_SERVICE)
 async def process_delete_service(call: types.CallbackQuery):
-    service_id = int(call.data.split("_")[2])
+    service_id, = DELETE_SERVICE.unpack(call.data)
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM services WHERE id=$1", service_id)
+    ref_cache.invalidate("services")
     await call.answer("✅ خدمت حذف شد", show_alert=True)
     await call.message.edit_text("خدمت با موفقیت حذف شد.", reply_markup=main_menu())
 
 
-# ==========================
-#  مرحله: کاربر میزند ➕ افزودن خدمات (در ریپلای کیبورد)
-# ==========================
-@dp.message_handler(lambda m: m.text == "➕ افزودن خدمات")
-async def cmd_add_service_menu(msg: types.Message):
-    # فقط ادمین اجازه داره اضافه کنه
-    if msg.from_user.id != ADMIN_ID:
-        await msg.answer("⛔ شما دسترسی به این بخش ندارید.")
-        return
-
-    kb = await service_categories_keyboard(prefix="add")
-    await msg.answer("📂 لطفاً دسته‌بندی موردنظر برای افزودن خدمت را انتخاب کنید:", reply_markup=kb)
-
 # ======================
 # ذخیره پست‌های جدید کانال
 # ======================
+async def store_channel_post(conn, message_id, title, content, tags):
+    """
+    ذخیره پست، upsert همه هشتگ‌ها و اتصال آنها به پست در یک دستور (یک رفت‌وبرگشت).
+    چون همه در یک statement است، پست نیمه‌کاره در دیتابیس باقی نمی‌ماند.
+    هشتگ‌ها مرتب درج می‌شوند تا درج‌های هم‌زمان به deadlock نخورند.
+    """
+    return await conn.fetchval("""
+        WITH p AS (
+            INSERT INTO posts (message_id, title, content, created_at)
+            VALUES ($1, $2, $3, NOW())
+            ON CONFLICT (message_id) DO UPDATE
+              SET title=EXCLUDED.title, content=EXCLUDED.content
+            RETURNING id
+        ), t AS (
+            INSERT INTO hashtags (name)
+            SELECT DISTINCT name FROM unnest($4::text[]) AS name ORDER BY name
+            ON CONFLICT (name) DO UPDATE SET name=EXCLUDED.name
+            RETURNING id
+        ), l AS (
+            INSERT INTO post_hashtags (post_id, hashtag_id)
+            SELECT p.id, t.id FROM p CROSS JOIN t
+            ON CONFLICT DO NOTHING
+        )
+        SELECT id FROM p
+    """, message_id, title, content, tags)
+
+
 @dp.channel_post_handler(content_types=types.ContentTypes.ANY)
 async def process_channel_post(message: types.Message):
 
@@ -2337,82 +2252,15 @@ async def process_channel_post(message: types.Message):
             title = "پست بدون عنوان"
 
         # --- ۲. ذخیره پست در دیتابیس ---
+        tags = list(dict.fromkeys(t for t in hashtags if t))
         async with pool.acquire() as conn:
-            # استفاده از ON CONFLICT تا duplicate باعث crash نشود
-            post_row = await conn.fetchrow("""
-                INSERT INTO posts (message_id, title, content, created_at)
-                VALUES ($1, $2, $3, NOW())
-                ON CONFLICT (message_id) DO UPDATE
-                  SET title=EXCLUDED.title, content=EXCLUDED.content
-                RETURNING id
-            """, message.message_id, title, content)
-            post_id = post_row["id"]
-
-            # ذخیره هشتگ‌ها و اتصال آنها به پست
-            for tag in hashtags:
-                # اگر رشته خالی بود نادیده بگیر
-                if not tag:
-                    continue
-                hashtag_row = await conn.fetchrow(
-                    "INSERT INTO hashtags (name) VALUES ($1) ON CONFLICT (name) DO UPDATE SET name=EXCLUDED.name RETURNING id",
-                    tag
-                )
-                hashtag_id = hashtag_row["id"]
-                await conn.execute(
-                    "INSERT INTO post_hashtags (post_id, hashtag_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
-                    post_id, hashtag_id
-                )
+            post_id = await store_channel_post(conn, message.message_id, title, content, tags)
 
-            # --- محدودیت حداکثر ۱۰۰ پست ---
-            count = await conn.fetchval("SELECT COUNT(*) FROM posts")
-            if count > 100:
-                excess = count - 100
-                old_ids = await conn.fetch(
-                    "SELECT id FROM posts ORDER BY created_at ASC LIMIT $1", excess
-                )
-                old_ids = [r["id"] for r in old_ids]
-                if old_ids:
-                    await conn.execute(
-                        "DELETE FROM post_hashtags WHERE post_id = ANY($1::int[])", old_ids
-                    )
-                    await conn.execute(
-                        "DELETE FROM posts WHERE id = ANY($1::int[])", old_ids
-                    )
-                    print(f"🧹 {len(old_ids)} پست قدیمی حذف شد (برای حفظ محدودیت ۱۰۰ پست).")
-
-
-        # --- ۳. ارسال خودکار به کاربران مشترک ---
-        async with pool.acquire() as conn:
-            for tag in hashtags:
-                if not tag:
-                    continue
-                hashtag_row = await conn.fetchrow("SELECT id FROM hashtags WHERE name=$1", tag)
-                if not hashtag_row:
-                    continue
-                hashtag_id = hashtag_row["id"]
-
-                users = await conn.fetch("""
-                    SELECT s.user_id FROM subscriptions s
-                    JOIN user_settings us ON us.user_id = s.user_id
-                    WHERE s.hashtag_id=$1 AND us.notifications_enabled=TRUE
-                """, hashtag_id)
-
-                for u in users:
-                    try:
-                        summary = (content[:200] + "...") if len(content) > 200 else content
-                        kb = InlineKeyboardMarkup().add(
-                            InlineKeyboardButton("🔽 نمایش کامل", callback_data=f"full_{post_id}")
-                        )
-                        await bot.send_message(
-                            u["user_id"],
-                            f"📢 <b>{title}</b>\n\n{summary}",
-                            parse_mode="HTML",
-                            reply_markup=kb
-                        )
-                    except Exception as e:
-                        print(f"⚠️ خطا در ارسال خودکار برای کاربر {u['user_id']}: {e}")
-
-        print(f"✅ پست {post_id} ذخیره و به کاربران مرتبط ارسال شد.")
+        # --- ۳. ارسال خودکار به کاربران مشترک (در پس‌زمینه) ---
+        if tags:
+            spawn(notify_subscribers(post_id, title, content, tags))
+
+        print(f"✅ پست {post_id} ذخیره شد و ارسال به مشترکین در صف قرار گرفت.")
 
     except Exception as e:
         print(f"❌ خطا در process_channel_post: {e}")
@@ -2420,15 +2268,93 @@ async def process_channel_post(message: types.Message):
 
 
 
+async def prune_posts():
+    """
+    اعمال سیاست نگهداری پست‌ها بدون COUNT(*): هر شرط یک DELETE است که از
+    ایندکس کلید اصلی استفاده می‌کند. post_hashtags با ON DELETE CASCADE پاک می‌شود.
+    """
+    deleted = 0
+    async with pool.acquire() as conn:
+        if POSTS_MAX_ROWS > 0:
+            result = await conn.execute("""
+                DELETE FROM posts WHERE id <= (
+                    SELECT id FROM posts ORDER BY id DESC OFFSET $1 LIMIT 1
+                )
+            """, POSTS_MAX_ROWS)
+            deleted += int(result.split()[-1])
+        if POSTS_MAX_AGE_DAYS > 0:
+            result = await conn.execute("""
+                DELETE FROM posts WHERE created_at < NOW() - make_interval(days => $1)
+            """, POSTS_MAX_AGE_DAYS)
+            deleted += int(result.split()[-1])
+    return deleted
+
+
+async def posts_pruner():
+    while True:
+        try:
+            deleted = await prune_posts()
+            if deleted:
+                print(f"🧹 {deleted} پست قدیمی حذف شد (سیاست نگهداری پست‌ها).")
+        except Exception as e:
+            print(f"⚠️ خطا در پاک‌سازی پست‌های قدیمی: {e}")
+        await asyncio.sleep(POSTS_PRUNE_INTERVAL)
+
+
+async def fsm_sweeper():
+    while True:
+        try:
+            expired = await storage.expire(FSM_TTL_HOURS * 3600)
+            if expired:
+                print(f"🧹 {expired} گفتگوی رهاشده (FSM) حذف شد.")
+        except Exception as e:
+            print(f"⚠️ خطا در پاک‌سازی وضعیت‌های FSM: {e}")
+        await asyncio.sleep(FSM_SWEEP_INTERVAL)
+
+
 # ===============================
 # 📢 هندلر پست‌های جدید کانال (با ارسال خودکار به مشترکین)
 # ===============================
+async def notify_subscribers(post_id, title, content, tags):
+    """یک کوئری برای همه هشتگ‌ها؛ هر کاربر فقط یک بار پیام می‌گیرد."""
+    try:
+        async with pool.acquire() as conn:
+            users = await conn.fetch("""
+                SELECT DISTINCT s.user_id
+                FROM hashtags h
+                JOIN subscriptions s ON s.hashtag_id = h.id
+                JOIN user_settings us ON us.user_id = s.user_id
+                WHERE h.name = ANY($1::text[])
+                  AND us.notifications_enabled = TRUE
+                  AND NOT EXISTS (
+                      SELECT 1 FROM users u WHERE u.user_id = s.user_id AND u.is_blocked
+                  )
+            """, tags)
+    except Exception as e:
+        print(f"⚠️ خطا در یافتن مشترکین پست {post_id}: {e}")
+        return
+
+    if not users:
+        return
+
+    summary = (content[:200] + "...") if len(content) > 200 else content
+    text = f"📢 <b>{title}</b>\n\n{summary}"
+    kb = InlineKeyboardMarkup().add(
+        InlineKeyboardButton("🔽 نمایش کامل", callback_data=FULL_POST.pack(post_id))
+    )
+
+    queued = delivery_queue.put(
+        (u["user_id"] for u in users),
+        lambda chat_id: bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=kb),
+    )
+    print(f"📢 پست {post_id} برای {queued} مشترک در صف ارسال قرار گرفت.")
+
 
 # ===============================
 # تنظیمات
 # ===============================
 
-@dp.message_handler(lambda m: m.text == "⚙️ تنظیمات")
+@router.text("⚙️ تنظیمات")
 async def settings_menu(message: types.Message):
     kb = InlineKeyboardMarkup(row_width=1)
     kb.add(
@@ -2443,7 +2369,7 @@ async def settings_menu(message: types.Message):
 # ===============================
 # محدودیت پست
 # ===============================
-@dp.callback_query_handler(lambda c: c.data == "set_post_limit")
+@router.callback("set_post_limit")
 async def ask_post_limit(callback_query: types.CallbackQuery):
     await bot.answer_callback_query(callback_query.id)
     await bot.send_message(callback_query.from_user.id, "📊 لطفاً تعداد پست‌های قابل نمایش در جستجو را وارد کنید (مثلاً 5 یا 10):")
@@ -2474,7 +2400,7 @@ async def save_post_limit(message: types.Message, state: FSMContext):
 # ===============================
 # غیرفعال سازی اشتراک
 # ===============================
-@dp.callback_query_handler(lambda c: c.data == "disable_notifications")
+@router.callback("disable_notifications")
 async def disable_notifications(callback_query: types.CallbackQuery):
     async with pool.acquire() as conn:
         await conn.execute("""
@@ -2489,7 +2415,7 @@ async def disable_notifications(callback_query: types.CallbackQuery):
 # ===============================
 # فعالسازی اشتراک
 # ===============================
-@dp.callback_query_handler(lambda c: c.data == "enable_notifications")
+@router.callback("enable_notifications")
 async def enable_notifications(callback_query: types.CallbackQuery):
     async with pool.acquire() as conn:
         await conn.execute("""
@@ -2504,7 +2430,7 @@ async def enable_notifications(callback_query: types.CallbackQuery):
 # ===============================
 # رهگیری سفارش
 # ===============================
-@dp.callback_query_handler(lambda c: c.data == "track_order")
+@router.callback("track_order")
 async def ask_tracking_code(callback_query: types.CallbackQuery):
     await bot.answer_callback_query(callback_query.id)
     await bot.send_message(callback_query.from_user.id, "🔎 لطفاً کد رهگیری سفارش را وارد کنید:")
@@ -2548,7 +2474,7 @@ async def show_order_status(message: types.Message, state: FSMContext):
 # ===============================
 # راهنما
 # ===============================
-@dp.message_handler(lambda m: m.text == "📘 راهنما")
+@router.text("📘 راهنما")
 async def show_help(message: types.Message):
     help_text = (
         "📘 <b>راهنمای استفاده از ربات</b>\n\n"
@@ -2608,7 +2534,7 @@ async def show_help(message: types.Message):
     await message.answer(help_text_with_link, parse_mode="HTML", reply_markup=kb)
 
 
-@dp.callback_query_handler(lambda c: c.data == "contact_support")
+@router.callback("contact_support")
 async def contact_support_callback(call: types.CallbackQuery):
     await call.answer()  # برداشتن لودینگ
     try:
@@ -2627,37 +2553,146 @@ async def contact_support_callback(call: types.CallbackQuery):
 
 
 class LastSeenMiddleware(BaseMiddleware):
-    async def _update_last_seen(self, uid: int):
-        if pool is None or uid is None:
-            return
+    """
+    Write-behind last-seen tracking: updates only touch an in-memory dict;
+    ``flush`` writes every pending user with a single UPDATE.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pending = {}  # user_id -> unix time of the latest update
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        # پیام، کال‌بک، اینلاین و ... همه از همین‌جا رد می‌شوند؛ فقط یک بار برای هر آپدیت
+        event = (update.message or update.edited_message or update.callback_query
+                 or update.inline_query or update.chosen_inline_result)
+        user = getattr(event, "from_user", None)
+        if user is not None:
+            self.pending[user.id] = time.time()
+
+    async def flush(self):
+        if pool is None or not self.pending:
+            return 0
+        batch, self.pending = self.pending, {}
         try:
             async with pool.acquire() as conn:
                 await conn.execute(
-                    "UPDATE users SET last_seen = NOW() WHERE user_id=$1",
-                    uid
+                    """
+                    UPDATE users u
+                    SET last_seen = to_timestamp(v.seen)::timestamp
+                    FROM unnest($1::bigint[], $2::float8[]) AS v(user_id, seen)
+                    WHERE u.user_id = v.user_id
+                      AND (u.last_seen IS NULL OR u.last_seen < to_timestamp(v.seen)::timestamp)
+                    """,
+                    list(batch), list(batch.values()),
                 )
         except Exception:
-            logging.exception("error updating last_seen")
+            logging.exception("error flushing last_seen")
+            # دفعه‌ی بعد دوباره تلاش می‌شود؛ زمان جدیدتر برنده است
+            for uid, seen in batch.items():
+                if seen > self.pending.get(uid, 0):
+                    self.pending[uid] = seen
+            return 0
+        return len(batch)
 
-    async def on_pre_process_message(self, message: types.Message, data: dict):
-        await self._update_last_seen(message.from_user.id)
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
 
-    async def on_pre_process_update(self, update: types.Update, data: dict):
-        # این متد هم callback_query و message و ... را پوشش می‌دهد
-        try:
-            if update.message:
-                await self._update_last_seen(update.message.from_user.id)
-            elif update.callback_query:
-                await self._update_last_seen(update.callback_query.from_user.id)
-        except Exception:
-            # لاگ کن و ادامه بده
-            logging.exception("LastSeenMiddleware.on_pre_process_update error")
+
+last_seen_middleware = LastSeenMiddleware()
+dp.middleware.setup(last_seen_middleware)
+
+# یک هندلر برای همه‌ی گفتگوها (conversations.step)؛ بعد از دستورها ثبت می‌شود
+# تا مثلاً /start وسط یک گفتگو هم کار کند
+conversations.setup(dp)
 
 
 # ---------------- راه‌اندازی ----------------
 async def on_startup(dispatcher):
+    global broadcast_engine, broadcast_jobs, delivery_queue
     await init_db()
+    storage.pool = pool
+    update_queue.pool = pool
+    if UPDATE_SHARDS:
+        await cache_bus.start(pool)
+    if not IS_WORKER:
+        # فقط وقتی محتوای Iran-Cities.csv تغییر کرده باشد کاری انجام می‌دهد
+        seeded = await seed_cities(pool)
+        if seeded:
+            ref_cache.invalidate("provinces", "cities")
+            print(f"🏙 {seeded} شهر از Iran-Cities.csv بارگذاری شد.")
+    broadcast_engine = BroadcastEngine(pool, telegram_limiter, concurrency=BROADCAST_CONCURRENCY)
+    broadcast_jobs = BroadcastJobs(
+        broadcast_engine,
+        lambda text: (lambda chat_id: bot.send_message(chat_id, text)),
+        on_progress=report_broadcast_job,
+    )
+    delivery_queue = DeliveryQueue(broadcast_engine)
+    delivery_queue.start()
+    spawn(last_seen_middleware.run(LAST_SEEN_FLUSH_INTERVAL))
+    if IS_WORKER:
+        # کارهای یکتا (پاکسازی، ادامه ارسال‌های انبوه) فقط در پردازه اصلی
+        print(f"🧵 worker {os.getpid()} شروع به کار کرد.")
+        return
+    spawn(posts_pruner())
+    spawn(fsm_sweeper())
+    resumed = await broadcast_jobs.resume_pending()
+    if resumed:
+        print(f"📨 {resumed} ارسال انبوه نیمه‌تمام از سر گرفته شد.")
+    # ارسال‌هایی که پردازه‌شان از کار افتاده (lease منقضی شده) دوباره گرفته می‌شوند
+    spawn(broadcast_jobs.watch())
     print("🚀 ربات شروع به کار کرد.")
 
+async def on_shutdown(dispatcher):
+    await last_seen_middleware.flush()
+    if delivery_queue is not None:
+        await delivery_queue.close()
+    await cache_bus.close()
+
+
+def forget_shard_users(shards):
+    """کش FSM کاربرانی که شاردشان تازه از پردازه دیگری به این پردازه رسیده معتبر نیست"""
+    storage.forget_users(lambda user_id: update_queue.shard_of(user_id) in shards)
+
+
+async def consume_update_queue():
+    await ShardWorker(dp, update_queue, on_acquire=forget_shard_users).run()
+
+
+def run_worker():
+    executor.start(dp, consume_update_queue(), on_startup=on_startup, on_shutdown=on_shutdown)
+
+
+def run_workers(processes):
+    if processes <= 1:
+        return run_worker()
+    workers = [multiprocessing.Process(target=run_worker, daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    if IS_WORKER:
+        run_workers(WORKER_PROCESSES)
+    elif WEBHOOK_HOST:
+        run_webhook(
+            dp,
+            url=WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            host=WEBAPP_HOST,
+            port=WEBAPP_PORT,
+            workers=WEBHOOK_WORKERS,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            sink=update_queue if UPDATE_SHARDS else None,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+        )
+    elif UPDATE_SHARDS:
+        executor.start(dp, poll_into(bot, update_queue), on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
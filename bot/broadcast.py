@@ -0,0 +1,531 @@
+# broadcast.py
+import asyncio
+import logging
+import os
+import socket
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+import asyncpg
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    ChatNotFound,
+    RetryAfter,
+    TelegramAPIError,
+    UserDeactivated,
+)
+
+log = logging.getLogger(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+# Telegram allows ~30 messages/second globally for a bot; stay a bit below it.
+DEFAULT_RATE = 25.0
+DEFAULT_CONCURRENCY = 20
+
+
+class TokenBucket:
+    """
+    Async token bucket shared by every sender that talks to Telegram.
+    ``acquire`` waits until a token is available; ``pause`` drains the bucket
+    for a flood-wait period so all concurrent senders back off together.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Block new tokens for ``seconds`` (used on RetryAfter)."""
+        self._tokens = 0
+        self._updated = max(self._updated, time.monotonic() + seconds)
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def add(self, status: str) -> None:
+        if status == SENT:
+            self.sent += 1
+        elif status == BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+
+SendFunc = Callable[[int], Awaitable]
+ProgressFunc = Callable[[BroadcastResult], Awaitable]
+DeliveredFunc = Callable[[int, str], Awaitable]
+
+
+class BroadcastEngine:
+    """
+    Rate-limited, concurrent message delivery.
+    ``send`` is a coroutine function taking a chat id, e.g.
+    ``lambda chat_id: bot.send_message(chat_id, text)``.
+    Chats that blocked the bot (or no longer exist) are marked
+    ``users.is_blocked`` so later broadcasts skip them.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.pool.Pool,
+        limiter: Optional[TokenBucket] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = 3,
+    ):
+        self.pool = pool
+        self.limiter = limiter or TokenBucket()
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max_retries
+
+    async def mark_blocked(self, chat_id: int) -> None:
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute("UPDATE users SET is_blocked=TRUE WHERE user_id=$1", chat_id)
+        except Exception:
+            log.exception("could not mark user %s as blocked", chat_id)
+
+    async def deliver(self, chat_id: int, send: SendFunc) -> str:
+        """Send to a single chat, honouring the limiter and flood waits."""
+        for _ in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                await send(chat_id)
+                return SENT
+            except RetryAfter as e:
+                log.warning("flood wait %ss while sending to %s", e.timeout, chat_id)
+                self.limiter.pause(e.timeout)
+                await asyncio.sleep(e.timeout)
+            except (BotBlocked, ChatNotFound, UserDeactivated):
+                await self.mark_blocked(chat_id)
+                return BLOCKED
+            except TelegramAPIError as e:
+                log.warning("send to %s failed: %s", chat_id, e)
+                return FAILED
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("unexpected error sending to %s", chat_id)
+                return FAILED
+        return FAILED
+
+    async def run(
+        self,
+        chat_ids: Iterable[int],
+        send: SendFunc,
+        on_progress: Optional[ProgressFunc] = None,
+        progress_interval: float = 5.0,
+        on_delivered: Optional[DeliveredFunc] = None,
+        stop: Optional[asyncio.Event] = None,
+    ) -> BroadcastResult:
+        """
+        Deliver to every chat in ``chat_ids`` using ``concurrency`` workers.
+        ``on_progress`` is awaited at most every ``progress_interval`` seconds,
+        ``on_delivered(chat_id, status)`` after every single attempt.
+        Setting ``stop`` makes the workers return before the next send.
+        """
+        chat_ids = list(chat_ids)
+        result = BroadcastResult(total=len(chat_ids))
+        it = iter(chat_ids)
+        last_report = time.monotonic()
+
+        async def worker():
+            nonlocal last_report
+            for chat_id in it:
+                if stop is not None and stop.is_set():
+                    return
+                status = await self.deliver(chat_id, send)
+                result.add(status)
+                if on_delivered:
+                    await on_delivered(chat_id, status)
+                now = time.monotonic()
+                if on_progress and now - last_report >= progress_interval:
+                    last_report = now
+                    try:
+                        await on_progress(result)
+                    except Exception:
+                        log.exception("broadcast progress callback failed")
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(chat_ids)) or 1)))
+        return result
+
+
+JobFunc = Callable[[asyncpg.Record], Awaitable]
+
+# running | paused | cancelled | done
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_CANCELLED = "cancelled"
+JOB_DONE = "done"
+
+
+class BroadcastJobs:
+    """
+    Persistent, resumable broadcasts stored in ``broadcast_jobs`` and
+    ``broadcast_deliveries``.
+    Recipients are walked in ``users.user_id`` order in batches; every delivery
+    is recorded and the cursor is checkpointed after each batch, so a worker
+    restarted mid-job skips users that were already handled.
+    ``on_progress(job_row)`` is awaited after each batch and when the job stops.
+
+    With several bot processes (``python bot.py worker``) a job is sent only
+    by the process holding its lease (``broadcast_jobs.owner`` /
+    ``lease_until``), renewed every ``lease_seconds / 3``. ``resume_pending``
+    skips jobs whose lease is still live, so a job is never sent twice.
+    """
+
+    def __init__(
+        self,
+        engine: BroadcastEngine,
+        send_factory: Callable[[str], SendFunc],
+        on_progress: Optional[JobFunc] = None,
+        batch_size: int = 200,
+        lease_seconds: float = 60,
+        owner: Optional[str] = None,
+    ):
+        self.engine = engine
+        self.send_factory = send_factory
+        self.on_progress = on_progress
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[int, asyncio.Event] = {}
+        self._tasks = set()
+
+    @property
+    def pool(self) -> asyncpg.pool.Pool:
+        return self.engine.pool
+
+    async def create(self, admin_id: int, chat_id: int, text: str) -> int:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                INSERT INTO broadcast_jobs (admin_id, chat_id, text, total)
+                VALUES ($1, $2, $3, (SELECT COUNT(*) FROM users WHERE is_blocked=FALSE))
+                RETURNING id
+                """,
+                admin_id,
+                chat_id,
+                text,
+            )
+
+    async def attach_message(self, job_id: int, message_id: int) -> None:
+        """Remember the admin's status message so progress can be edited into it."""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE broadcast_jobs SET message_id=$2 WHERE id=$1", job_id, message_id
+            )
+
+    async def get(self, job_id: int) -> Optional[asyncpg.Record]:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id=$1", job_id)
+
+    def is_running(self, job_id: int) -> bool:
+        return job_id in self._running
+
+    def start(self, job_id: int) -> None:
+        if job_id in self._running:
+            return
+        stop = asyncio.Event()
+        self._running[job_id] = stop
+        task = asyncio.create_task(self._run(job_id, stop))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def resume_pending(self) -> int:
+        """Restart every job left ``running`` by a process that no longer holds its lease."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT id FROM broadcast_jobs WHERE status=$1 AND lease_until <= NOW() ORDER BY id",
+                JOB_RUNNING,
+            )
+        for r in rows:
+            self.start(r["id"])
+        return len(rows)
+
+    async def watch(self, interval: Optional[float] = None) -> None:
+        """Keep resuming jobs whose process died (their lease expires)."""
+        while True:
+            await asyncio.sleep(interval or self.lease_seconds)
+            try:
+                await self.resume_pending()
+            except Exception:
+                log.exception("broadcast resume failed")
+
+    async def _claim(self, job_id: int) -> bool:
+        """Take or renew the job's lease; False if another process holds it."""
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE broadcast_jobs SET owner=$2, lease_until = NOW() + make_interval(secs => $3)
+                WHERE id=$1 AND status=$4 AND (owner = $2 OR lease_until <= NOW())
+                """,
+                job_id,
+                self.owner,
+                self.lease_seconds,
+                JOB_RUNNING,
+            )
+        return result != "UPDATE 0"
+
+    async def _release(self, job_id: int) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE broadcast_jobs SET owner=NULL, lease_until='epoch' WHERE id=$1 AND owner=$2",
+                job_id,
+                self.owner,
+            )
+
+    async def _keep_lease(self, job_id: int, stop: asyncio.Event) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self._claim(job_id):
+                    # paused/cancelled elsewhere, or the lease was lost
+                    stop.set()
+                    return
+            except Exception:
+                log.exception("broadcast job %s lease renewal failed", job_id)
+
+    async def _set_status(self, job_id: int, status: str, *from_statuses: str) -> bool:
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE broadcast_jobs
+                SET status=$2, updated_at=NOW(), finished_at = CASE WHEN $4 THEN NOW() END
+                WHERE id=$1 AND status = ANY($3::text[])
+                """,
+                job_id,
+                status,
+                list(from_statuses),
+                status in (JOB_CANCELLED, JOB_DONE),
+            )
+        return result != "UPDATE 0"
+
+    async def pause(self, job_id: int) -> bool:
+        ok = await self._set_status(job_id, JOB_PAUSED, JOB_RUNNING)
+        await self._stop(job_id)
+        return ok
+
+    async def resume(self, job_id: int) -> bool:
+        ok = await self._set_status(job_id, JOB_RUNNING, JOB_PAUSED)
+        if ok:
+            self.start(job_id)
+        return ok
+
+    async def cancel(self, job_id: int) -> bool:
+        ok = await self._set_status(job_id, JOB_CANCELLED, JOB_RUNNING, JOB_PAUSED)
+        await self._stop(job_id)
+        return ok
+
+    async def _stop(self, job_id: int) -> None:
+        stop = self._running.get(job_id)
+        if stop is not None:
+            # the worker reports its own final state when it exits
+            stop.set()
+        else:
+            await self._report(job_id)
+
+    async def _report(self, job_id: int) -> None:
+        if not self.on_progress:
+            return
+        job = await self.get(job_id)
+        if job is None:
+            return
+        try:
+            await self.on_progress(job)
+        except Exception:
+            log.exception("broadcast job %s progress callback failed", job_id)
+
+    async def _checkpoint(self, job_id: int, cursor: int) -> asyncpg.Record:
+        """
+        Move the cursor to ``cursor`` and add the deliveries recorded between
+        the old and the new cursor to the job's counts: an index range of
+        about one batch, and every delivery is counted exactly once, also
+        ones recorded before a crash or a pause, once the cursor passes them.
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(
+                """
+                UPDATE broadcast_jobs j
+                SET (sent, failed, blocked) = (
+                        SELECT j.sent + COUNT(*) FILTER (WHERE d.status='sent'),
+                               j.failed + COUNT(*) FILTER (WHERE d.status='failed'),
+                               j.blocked + COUNT(*) FILTER (WHERE d.status='blocked')
+                        FROM broadcast_deliveries d
+                        WHERE d.job_id = j.id AND d.user_id > j.cursor_user_id AND d.user_id <= $2
+                    ),
+                    cursor_user_id = GREATEST(j.cursor_user_id, $2),
+                    updated_at = NOW()
+                WHERE j.id=$1
+                RETURNING j.*
+                """,
+                job_id,
+                cursor,
+            )
+
+    async def _record(self, job_id: int, chat_id: int, status: str) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO broadcast_deliveries (job_id, user_id, status)
+                VALUES ($1, $2, $3) ON CONFLICT DO NOTHING
+                """,
+                job_id,
+                chat_id,
+                status,
+            )
+
+    async def _run(self, job_id: int, stop: asyncio.Event) -> None:
+        try:
+            claimed = await self._claim(job_id)
+        except Exception:
+            log.exception("broadcast job %s could not be claimed", job_id)
+            claimed = False
+        if not claimed:
+            # not running any more, or being sent by another process
+            self._running.pop(job_id, None)
+            return
+        lease = asyncio.create_task(self._keep_lease(job_id, stop))
+        crashed = False
+        try:
+            while not stop.is_set():
+                async with self.pool.acquire() as conn:
+                    job = await conn.fetchrow(
+                        "SELECT status, text, cursor_user_id FROM broadcast_jobs WHERE id=$1", job_id
+                    )
+                    if not job or job["status"] != JOB_RUNNING:
+                        break
+                    rows = await conn.fetch(
+                        """
+                        SELECT u.user_id FROM users u
+                        WHERE u.user_id > $2 AND u.is_blocked=FALSE
+                          AND NOT EXISTS (
+                              SELECT 1 FROM broadcast_deliveries d
+                              WHERE d.job_id=$1 AND d.user_id=u.user_id
+                          )
+                        ORDER BY u.user_id
+                        LIMIT $3
+                        """,
+                        job_id,
+                        job["cursor_user_id"],
+                        self.batch_size,
+                    )
+
+                if not rows:
+                    # count what a partly sent last batch recorded past the cursor
+                    async with self.pool.acquire() as conn:
+                        last = await conn.fetchval(
+                            "SELECT MAX(user_id) FROM broadcast_deliveries WHERE job_id=$1", job_id
+                        )
+                    await self._checkpoint(job_id, max(job["cursor_user_id"], last or 0))
+                    await self._set_status(job_id, JOB_DONE, JOB_RUNNING)
+                    break
+
+                user_ids = [r["user_id"] for r in rows]
+                result = await self.engine.run(
+                    user_ids,
+                    self.send_factory(job["text"]),
+                    on_delivered=lambda chat_id, status: self._record(job_id, chat_id, status),
+                    stop=stop,
+                )
+                # only move the cursor past a batch that was fully handled
+                cursor = user_ids[-1] if result.done == len(user_ids) else job["cursor_user_id"]
+                row = await self._checkpoint(job_id, cursor)
+                if self.on_progress and not stop.is_set():
+                    try:
+                        await self.on_progress(row)
+                    except Exception:
+                        log.exception("broadcast job %s progress callback failed", job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            crashed = True
+            log.exception("broadcast job %s crashed", job_id)
+        finally:
+            lease.cancel()
+            self._running.pop(job_id, None)
+            await self._release(job_id)
+        job = await self.get(job_id)
+        if not crashed and job is not None and job["status"] == JOB_RUNNING:
+            # resumed while this worker was still winding down; start() only
+            # takes over if no other process claimed the job meanwhile
+            self.start(job_id)
+            return
+        await self._report(job_id)
+
+
+class DeliveryQueue:
+    """
+    Long-lived fan-out queue for event-driven sends (e.g. channel-post
+    notifications). ``put`` only enqueues and returns immediately; a fixed
+    pool of workers drains the queue through ``engine.deliver`` so these
+    sends share the same rate limiter as broadcasts.
+    """
+
+    def __init__(self, engine: BroadcastEngine, workers: Optional[int] = None):
+        self.engine = engine
+        self.workers = workers or engine.concurrency
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def put(self, chat_ids: Iterable[int], send: SendFunc) -> int:
+        n = 0
+        for chat_id in chat_ids:
+            self._queue.put_nowait((chat_id, send))
+            n += 1
+        return n
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id, send = await self._queue.get()
+            try:
+                await self.engine.deliver(chat_id, send)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("queued delivery to %s failed", chat_id)
+            finally:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,73 @@
+# cache_bus.py
+import asyncio
+import json
+import logging
+import os
+import socket
+from typing import List, Optional
+
+import asyncpg
+
+from ref_cache import RefCache
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "ref_cache_invalidate"
+
+
+class CacheInvalidationBus:
+    """
+    Keeps ``RefCache`` consistent across processes: every local
+    ``invalidate(...)`` is published with ``NOTIFY`` and replayed by the
+    other processes listening on the same database (their keyboard caches
+    follow through ``RefCache.on_invalidate``). The TTL remains the safety
+    net for writes made outside the bot.
+    """
+
+    def __init__(self, cache: RefCache, channel: str = CHANNEL):
+        self.cache = cache
+        self.channel = channel
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.pool: Optional[asyncpg.pool.Pool] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._replaying = False
+        self._tasks = set()
+        cache.on_invalidate(self._publish)
+
+    async def start(self, pool: asyncpg.pool.Pool) -> None:
+        self.pool = pool
+        self._listener = await pool.acquire()
+        await self._listener.add_listener(self.channel, self._on_notify)
+
+    def _publish(self, prefixes: List[str]) -> None:
+        if self._replaying or self._listener is None:
+            return
+        payload = json.dumps({"origin": self.origin, "prefixes": prefixes})
+        task = asyncio.create_task(self._notify(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, payload: str) -> None:
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+        except Exception:
+            log.exception("cache invalidation was not published")
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        message = json.loads(payload)
+        if message["origin"] == self.origin:
+            return
+        self._replaying = True
+        try:
+            self.cache.invalidate(*message["prefixes"])
+        finally:
+            self._replaying = False
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._listener is not None:
+            await self._listener.remove_listener(self.channel, self._on_notify)
+            await self.pool.release(self._listener)
+            self._listener = None
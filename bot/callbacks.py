@@ -0,0 +1,101 @@
+# callbacks.py
+import base64
+from typing import Dict, Tuple
+
+# Telegram rejects callback_data longer than this many bytes
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = ":"
+
+
+def _zigzag(v: int) -> int:
+    return v * 2 if v >= 0 else -v * 2 - 1
+
+
+def _unzigzag(v: int) -> int:
+    return v // 2 if not v & 1 else -(v + 1) // 2
+
+
+def pack_ints(values) -> str:
+    """Varint-encode (zigzag, so negative chat ids stay short) and base64url, unpadded."""
+    out = bytearray()
+    for value in values:
+        v = _zigzag(int(value))
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode("ascii")
+
+
+def unpack_ints(payload: str) -> Tuple[int, ...]:
+    raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    values, v, shift = [], 0, 0
+    for byte in raw:
+        v |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(_unzigzag(v))
+        v, shift = 0, 0
+    return tuple(values)
+
+
+class CallbackAction:
+    """
+    One kind of inline button: a short code plus a fixed number of integer
+    fields, e.g. ``TOOL.pack(12)`` -> ``"t:GA"`` and
+    ``TOOL.unpack("t:GA")`` -> ``(12,)``.
+
+    Strings (hashtag names, order codes) are never put in the payload;
+    buttons carry the row id and the handler looks the value up in the
+    database, so payloads stay a few bytes long whatever the text is.
+    """
+
+    __slots__ = ("name", "code", "prefix", "arity")
+
+    def __init__(self, name: str, code: str, arity: int):
+        self.name = name
+        self.code = code
+        self.prefix = code + SEPARATOR
+        self.arity = arity
+
+    def pack(self, *values: int) -> str:
+        if len(values) != self.arity:
+            raise ValueError(f"{self.name} takes {self.arity} field(s), got {len(values)}")
+        data = self.prefix + pack_ints(values)
+        if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"callback_data for {self.name} exceeds {MAX_CALLBACK_BYTES} bytes")
+        return data
+
+    def unpack(self, data: str) -> Tuple[int, ...]:
+        values = unpack_ints(data[len(self.prefix):])
+        if len(values) != self.arity:
+            raise ValueError(f"malformed callback_data for {self.name}: {data!r}")
+        return values
+
+    def __repr__(self):
+        return f"CallbackAction({self.name!r}, {self.code!r})"
+
+
+class CallbackCodec:
+    """Registry of ``CallbackAction``s; codes must be unique and separator-free."""
+
+    def __init__(self):
+        self._actions: Dict[str, CallbackAction] = {}
+
+    def action(self, name: str, code: str, arity: int = 1) -> CallbackAction:
+        if SEPARATOR in code:
+            raise ValueError(f"callback code {code!r} may not contain {SEPARATOR!r}")
+        if code in self._actions:
+            raise ValueError(f"callback code {code!r} is already used by {self._actions[code].name}")
+        action = CallbackAction(name, code, arity)
+        self._actions[code] = action
+        return action
+
+    def resolve(self, data: str):
+        """Return (action, fields) for ``data``, or (None, ()) if it isn't codec-encoded."""
+        code, sep, payload = data.partition(SEPARATOR)
+        action = self._actions.get(code) if sep else None
+        if action is None:
+            return None, ()
+        return action, action.unpack(data)
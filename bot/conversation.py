@@ -0,0 +1,103 @@
+# conversation.py
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.handler import SkipHandler
+from aiogram.dispatcher.storage import BaseStorage
+
+# key of the conversation inside the user's own FSM data. StatesGroup flows
+# run with a state set and conversations without one, so the two never
+# share the data at the same time; a flow's ``state.finish()`` simply ends
+# a conversation the user left for it.
+CONVERSATION_KEY = "conversation"
+
+Step = Callable[[types.Message, Dict[str, Any]], Awaitable[Any]]
+
+
+class ConversationStore:
+    """
+    Per-user conversation state for the flows that don't use a StatesGroup
+    (adding a tool, searching users, broadcasting ...).
+
+    Each user has at most one conversation: a ``name`` plus free-form
+    fields. It lives in the user's FSM record, so with
+    ``CachedPostgresStorage`` it comes with the cache entry aiogram already
+    loads for the state check: no second entry per user, state survives
+    restarts and is shared by every process, and abandoned conversations are
+    removed by the FSM sweeper. A conversation also expires ``ttl`` seconds
+    after it was last touched.
+
+    Step handlers are registered with ``step`` and reached through the one
+    message handler ``setup`` adds, which reads the conversation once per
+    message and looks the handlers up by conversation name.
+    """
+
+    def __init__(self, storage: BaseStorage, ttl: float = 1800):
+        self.storage = storage
+        self.ttl = ttl
+        self._steps: Dict[str, List[Tuple[Dict[str, Any], Tuple[Callable, ...], Step]]] = {}
+
+    async def _load(self, user_id: int) -> Dict[str, Any]:
+        data = await self.storage.get_data(chat=user_id, user=user_id)
+        conv = data.get(CONVERSATION_KEY)
+        # an expired conversation reads as none; it is overwritten by the
+        # next start() or removed with the record by the sweeper
+        if not conv or conv.get("expires", 0) < time.time():
+            return {}
+        return conv
+
+    async def _save(self, user_id: int, name: str, fields: Dict[str, Any]) -> None:
+        await self.storage.update_data(
+            chat=user_id,
+            user=user_id,
+            data={CONVERSATION_KEY: {"name": name, "fields": fields, "expires": time.time() + self.ttl}},
+        )
+
+    async def name(self, user_id: int) -> Optional[str]:
+        return (await self._load(user_id)).get("name")
+
+    async def get(self, user_id: int, name: str = None) -> Dict[str, Any]:
+        """Fields of the user's conversation ({} if none, or if it isn't ``name``)."""
+        conv = await self._load(user_id)
+        if not conv or (name is not None and conv["name"] != name):
+            return {}
+        return conv["fields"]
+
+    async def start(self, user_id: int, name: str, **fields) -> None:
+        """Begin ``name``, replacing whatever conversation the user was in."""
+        await self._save(user_id, name, fields)
+
+    async def update(self, user_id: int, **fields) -> None:
+        conv = await self._load(user_id)
+        if conv:
+            await self._save(user_id, conv["name"], {**conv["fields"], **fields})
+
+    async def end(self, user_id: int) -> None:
+        await self.storage.update_data(chat=user_id, user=user_id, data={CONVERSATION_KEY: None})
+
+    def step(self, name: str, *checks: Callable[[types.Message], bool], **fields):
+        """
+        Decorator: handle messages of users in conversation ``name`` whose
+        fields equal ``fields`` and that pass every ``checks`` predicate,
+        e.g. ``@conversations.step("add_tool", step=1)``. The handler is
+        called as ``handler(message, fields)``; the first match wins.
+        """
+        def decorator(handler: Step) -> Step:
+            self._steps.setdefault(name, []).append((fields, checks, handler))
+            return handler
+        return decorator
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Register the message handler that dispatches to the steps (outside FSM states)."""
+        dp.register_message_handler(self._dispatch)
+
+    async def _dispatch(self, message: types.Message):
+        conv = await self._load(message.from_user.id)
+        if conv:
+            current = conv["fields"]
+            for fields, checks, handler in self._steps.get(conv["name"], ()):
+                if all(current.get(k) == v for k, v in fields.items()) and all(c(message) for c in checks):
+                    return await handler(message, current)
+        # not in a conversation (or no step for it): let later handlers try
+        raise SkipHandler()
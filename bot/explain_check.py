@@ -0,0 +1,330 @@
+# explain_check.py
+"""
+Regression check for the query plans of the bot and the admin API.
+
+Collects every SQL string literal in ``SOURCES``, plus the statements that
+the admin API builds at run time, rendered by their own builders
+(``RENDERED``). Each one is prepared against a local Postgres that has the
+migrations applied, and the check asks for the generic plan
+(``EXPLAIN EXECUTE`` with ``plan_cache_mode = force_generic_plan``, so no
+parameter values are needed). The check fails on:
+
+* a sequential scan over a table with more than ``--min-rows`` rows, unless
+  the whole statement is listed in ``ALLOWED_SEQ_SCANS``;
+* a statement that can't be prepared or explained, unless it is listed in
+  ``KNOWN_BROKEN`` with the reason;
+* an f-string query whose site has no entry in ``RENDERED``;
+* a database where no table has more than ``--min-rows`` rows, since
+  nothing would be checked.
+
+    DATABASE_URL=postgresql://localhost/cafenet_check python explain_check.py
+
+Rendering imports backend/app, so the admin API's requirements must be
+installed too. ``--seed`` (default 50000) fills the hot tables with
+synthetic rows inside the check's transaction, which is rolled back, so the
+planner sees realistic sizes. ``--seed 0`` checks the data as it is.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import asyncpg
+
+from migrate import migrate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCES = [
+    os.path.join(ROOT, "bot", name)
+    for name in (
+        "bot.py",
+        "broadcast.py",
+        "update_queue.py",
+        "fsm_storage_postgres.py",
+        "seed_cities.py",
+        "cache_bus.py",
+    )
+] + [os.path.join(ROOT, "backend", "app")]
+
+_SQL = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b")
+# command tags such as "UPDATE 0", compared with conn.execute() results
+_TAG = re.compile(r"^(SELECT|INSERT|UPDATE|DELETE)( \d+)+$")
+_PARAM = re.compile(r"\$(\d+)")
+
+# Statements that read a whole table on purpose: unfiltered counts and the
+# full listing of a small table. Matched against the whole
+# whitespace-normalized statement, so a filtered variant of the same query
+# (e.g. the created_at stats counts) is still checked.
+ALLOWED_SEQ_SCANS = {
+    "SELECT COUNT(*) FROM users",
+    "SELECT COUNT(*) FROM cafenets",
+    "SELECT * FROM hashtags ORDER BY name",
+    # a new broadcast job's total
+    "INSERT INTO broadcast_jobs (admin_id, chat_id, text, total) VALUES ($1, $2, $3, "
+    "(SELECT COUNT(*) FROM users WHERE is_blocked=FALSE)) RETURNING id",
+}
+
+# Statements that don't prepare against the schema, each with the reason.
+# They fail at run time as well; listing one here only keeps the check
+# usable until its handler is fixed.
+KNOWN_BROKEN = {
+    "SELECT name FROM cafenets WHERE id = (SELECT cafenet_id FROM user_settings WHERE user_id=$1)":
+        "user_settings has no cafenet_id column",
+    "SELECT u.user_id FROM users u JOIN user_settings us ON us.user_id = u.user_id "
+    "JOIN cafenets c ON c.id = us.cafenet_id WHERE c.province_id = $1":
+        "user_settings has no cafenet_id column",
+    "SELECT full_name, username FROM users WHERE user_id=$1":
+        "users has first_name, not full_name",
+}
+
+SEED_SQL = """
+INSERT INTO users (user_id, first_name, username, created_at, last_seen)
+SELECT 1000000 + g, 'user ' || g, 'user' || g,
+       now() - (g % 365) * interval '1 day', now() - (g % 90) * interval '1 hour'
+FROM generate_series(1, $1) AS g
+ON CONFLICT DO NOTHING;
+
+INSERT INTO orders (user_id, order_code, status, created_at)
+SELECT 1000000 + g % ($1 / 4 + 1), 'CHK' || g, 'new', now() - (g % 365) * interval '1 day'
+FROM generate_series(1, $1) AS g
+ON CONFLICT DO NOTHING;
+
+INSERT INTO tickets (user_id, subject, message, status, created_at)
+SELECT 1000000 + g, 'subject', 'message', (ARRAY['open', 'answered', 'closed'])[g % 3 + 1],
+       now() - (g % 365) * interval '1 day'
+FROM generate_series(1, $1) AS g;
+
+INSERT INTO posts (message_id, title, content, created_at)
+SELECT -g, 'title ' || g, 'content ' || g, now() - (g % 365) * interval '1 day'
+FROM generate_series(1, $1) AS g
+ON CONFLICT DO NOTHING;
+
+INSERT INTO hashtags (name) SELECT 'chk' || g FROM generate_series(1, least($1, 50)) AS g
+ON CONFLICT DO NOTHING;
+
+INSERT INTO subscriptions (user_id, hashtag_id)
+SELECT 1000000 + g, h.id
+FROM generate_series(1, $1) AS g
+JOIN hashtags h ON h.name = 'chk' || (g % 50 + 1)
+ON CONFLICT DO NOTHING;
+
+WITH jobs AS (
+    INSERT INTO broadcast_jobs (text, status, total)
+    SELECT 'check', 'done', $1 / 100 FROM generate_series(1, 100)
+    RETURNING id
+)
+INSERT INTO broadcast_deliveries (job_id, user_id, status)
+SELECT jobs.id, 1000000 + g, 'sent'
+FROM jobs, generate_series(1, $1 / 100) AS g;
+
+INSERT INTO fsm_storage (chat_id, user_id, state, data)
+SELECT 1000000 + g, 1000000 + g, 'Check:step', '{}' FROM generate_series(1, $1) AS g
+ON CONFLICT DO NOTHING;
+
+INSERT INTO update_queue (shard, payload)
+SELECT g % 32, '{}' FROM generate_series(1, $1) AS g;
+"""
+
+
+def _backend() -> None:
+    """Make backend/app importable; its settings need these even though nothing connects."""
+    path = os.path.join(ROOT, "backend")
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    os.environ.setdefault("DATABASE_URL", "postgresql://localhost/explain_check")
+    for name in ("JWT_SECRET", "BOT_TOKEN"):
+        os.environ.setdefault(name, "explain-check")
+
+
+def _keyset_pages() -> Iterator[str]:
+    from app.pagination import encode_cursor, keyset_query
+    from app.routers.tickets import TICKET_COLUMNS
+    from app.routers.users import USER_COLUMNS
+
+    cursor = encode_cursor(datetime(2024, 1, 1), 1)
+    yield keyset_query("users", USER_COLUMNS)[0]
+    yield keyset_query("users", USER_COLUMNS, cursor=cursor)[0]
+    yield keyset_query("tickets", TICKET_COLUMNS, ["status=$1"], ["open"], cursor=cursor)[0]
+
+
+def _exports() -> Iterator[str]:
+    from app.routers.export import EXPORTS, _build_query
+
+    for entity in EXPORTS:
+        yield _build_query(entity, datetime(2024, 1, 1), datetime(2024, 2, 1), None)[0]
+        yield _build_query(entity, datetime(2024, 1, 1), datetime(2024, 2, 1), "open")[0]
+
+
+def _user_by_id() -> Iterator[str]:
+    from app.routers.users import USER_BY_ID
+
+    yield USER_BY_ID
+
+
+# f-string query site ("path:function", "<module>" at top level) -> the
+# representative statements its builder produces
+RENDERED: Dict[str, Callable[[], Iterator[str]]] = {
+    "backend/app/pagination.py:keyset_query": _keyset_pages,
+    "backend/app/routers/export.py:_build_query": _exports,
+    "backend/app/routers/users.py:<module>": _user_by_id,
+}
+
+
+class _Finder(ast.NodeVisitor):
+    """SQL string literals, and the functions that build SQL with f-strings."""
+
+    def __init__(self):
+        self.scope: List[str] = []
+        self.literals: List[Tuple[int, str]] = []
+        self.built: List[Tuple[int, str]] = []
+
+    def _scoped(self, node) -> None:
+        self.scope.append(node.name)
+        self.generic_visit(node)
+        self.scope.pop()
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _scoped
+
+    def visit_Constant(self, node: ast.Constant) -> None:
+        if isinstance(node.value, str) and _SQL.match(node.value) and not _TAG.match(node.value):
+            self.literals.append((node.lineno, node.value))
+
+    def visit_JoinedStr(self, node: ast.JoinedStr) -> None:
+        # its literal parts are fragments, not statements, so don't descend
+        head = node.values[0] if node.values else None
+        if isinstance(head, ast.Constant) and _SQL.match(head.value):
+            self.built.append((node.lineno, self.scope[-1] if self.scope else "<module>"))
+
+
+def _files(sources: List[str]) -> Iterator[str]:
+    for source in sources:
+        if os.path.isdir(source):
+            for dirpath, _, filenames in sorted(os.walk(source)):
+                for filename in sorted(filenames):
+                    if filename.endswith(".py"):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield source
+
+
+def collect(sources: List[str] = SOURCES) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """
+    Return ([(where, sql)], [where]): every SQL string literal in ``sources``
+    and the rendered statements of their f-string query sites, plus the
+    f-string sites ``RENDERED`` has no builder for.
+    """
+    statements, unrendered, sites = [], [], set()
+    for path in _files(sources):
+        rel = os.path.relpath(path, ROOT)
+        finder = _Finder()
+        with open(path, encoding="utf-8") as f:
+            finder.visit(ast.parse(f.read(), path))
+        statements.extend((f"{rel}:{line}", sql) for line, sql in finder.literals)
+        for line, function in finder.built:
+            site = f"{rel}:{function}"
+            if site not in RENDERED:
+                unrendered.append(f"{rel}:{line}")
+            elif site not in sites:
+                sites.add(site)
+                _backend()
+                statements.extend((f"{site} (rendered)", sql) for sql in RENDERED[site]())
+    return statements, unrendered
+
+
+def _squeeze(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def _seq_scans(plan: dict) -> Iterator[str]:
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", ()):
+        yield from _seq_scans(child)
+
+
+async def _table_rows(conn: asyncpg.Connection) -> dict:
+    rows = await conn.fetch(
+        "SELECT relname, reltuples::bigint AS n FROM pg_class WHERE relkind = 'r'"
+    )
+    return {r["relname"]: r["n"] for r in rows}
+
+
+async def check(conn: asyncpg.Connection, min_rows: int, seed: int = 0) -> int:
+    """Print offending statements; returns the number of failures."""
+    statements, unrendered = collect()
+    failures = len(unrendered)
+    for where in unrendered:
+        print(f"FAIL {where}: query built with an f-string that RENDERED has no builder for")
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        if seed:
+            for statement in SEED_SQL.split(";"):
+                if statement.strip():
+                    await conn.execute(statement, seed)
+        await conn.execute("ANALYZE")
+        await conn.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+        sizes = await _table_rows(conn)
+        if not any(n > min_rows for n in sizes.values()):
+            print(f"FAIL no table has more than {min_rows} rows, so no plan would be checked; "
+                  f"seed the check or lower --min-rows")
+            return failures + 1
+
+        for where, sql in statements:
+            params = max((int(n) for n in _PARAM.findall(sql)), default=0)
+            # prepared statements outlive a rollback, so DEALLOCATE explicitly
+            await conn.execute("SAVEPOINT explain_check")
+            prepared = False
+            try:
+                await conn.execute(f"PREPARE explain_check AS {sql}")
+                prepared = True
+                args = f"({', '.join(['NULL'] * params)})" if params else ""
+                plan = json.loads(
+                    await conn.fetchval(f"EXPLAIN (FORMAT JSON) EXECUTE explain_check{args}")
+                )[0]["Plan"]
+            except asyncpg.PostgresError as e:
+                if _squeeze(sql) in KNOWN_BROKEN:
+                    print(f"KNOWN {where}: {KNOWN_BROKEN[_squeeze(sql)]}")
+                else:
+                    failures += 1
+                    print(f"FAIL {where}: {e}\n    {_squeeze(sql)}")
+                await conn.execute("ROLLBACK TO SAVEPOINT explain_check")
+                continue
+            finally:
+                if prepared:
+                    await conn.execute("DEALLOCATE explain_check")
+            await conn.execute("RELEASE SAVEPOINT explain_check")
+
+            big = [t for t in _seq_scans(plan) if sizes.get(t, 0) > min_rows]
+            if big and _squeeze(sql) not in ALLOWED_SEQ_SCANS:
+                failures += 1
+                print(f"FAIL {where}: seq scan on {', '.join(big)}\n    {_squeeze(sql)}")
+        print(f"checked {len(statements)} statement(s)")
+    finally:
+        await tr.rollback()
+    return failures
+
+
+async def _main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=50000, help="synthetic rows per hot table (0: none)")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        await migrate(conn)
+        failures = await check(conn, args.min_rows, args.seed)
+    finally:
+        await conn.close()
+    print(f"{failures} failure(s)" if failures else "all plans use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,76 @@
+# fsm_bench.py
+"""
+Per-update cost of the FSM storages: MemoryStorage, PostgresStorage and
+CachedPostgresStorage (plus the flush FSMFlushMiddleware runs after each
+update).
+
+    DATABASE_URL=postgresql://localhost/cafenet_check python fsm_bench.py --updates 5000 --users 500
+
+Every simulated update does what a typical step of a conversation does:
+get_state, get_data, update_data, set_state. Users are picked round-robin,
+so after the first ``--users`` updates the cache is warm. Rows written by
+the benchmark (user ids from 9e12 up) are deleted afterwards.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import asyncpg
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from fsm_storage_postgres import CachedPostgresStorage, PostgresStorage
+from migrate import migrate
+
+FIRST_USER = 9_000_000_000_000
+
+
+async def one_update(storage, user_id: int, step: int) -> None:
+    ids = {"chat": user_id, "user": user_id}
+    await storage.get_state(**ids)
+    data = await storage.get_data(**ids)
+    await storage.update_data(**ids, step=step, seen=len(data))
+    await storage.set_state(**ids, state=f"Bench:step{step % 3}")
+
+
+async def run(storage, args, flush: bool) -> float:
+    started = time.perf_counter()
+    for i in range(args.updates):
+        await one_update(storage, FIRST_USER + i % args.users, i)
+        if flush:
+            await storage.flush()
+    return time.perf_counter() - started
+
+
+async def cleanup(pool) -> None:
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM fsm_storage WHERE user_id >= $1", FIRST_USER)
+
+
+async def main(args):
+    pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"), min_size=1, max_size=4)
+    try:
+        async with pool.acquire() as conn:
+            await migrate(conn)
+        results = [("MemoryStorage", await run(MemoryStorage(), args, flush=False))]
+        await cleanup(pool)
+        results.append(("PostgresStorage", await run(PostgresStorage(pool), args, flush=False)))
+        await cleanup(pool)
+        cached = CachedPostgresStorage(pool, max_size=args.cache_size)
+        results.append(("CachedPostgresStorage", await run(cached, args, flush=True)))
+        await cleanup(pool)
+    finally:
+        await pool.close()
+
+    for name, seconds in results:
+        print(f"{name:22} {seconds / args.updates * 1e6:8.0f} us/update")
+    stats = cached.stats()
+    print(f"cache: hit rate {stats['hit_rate']:.1%}, size {stats['size']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
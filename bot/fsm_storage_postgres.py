@@ -1,10 +1,16 @@
 # fsm_storage_postgres.py
+import asyncio
+import copy
 import json
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
 import asyncpg
-from typing import Optional, Dict, Any
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.storage import BaseStorage
 
 
-class PostgresStorage:
+class PostgresStorage(BaseStorage):
     """
     Lightweight FSM storage for aiogram v2 using asyncpg + a single table.
     Methods mirror what aiogram v2 expects: set_state, get_state, set_data,
@@ -15,7 +21,7 @@ class PostgresStorage:
         self.pool = pool
 
     async def create_table(self) -> None:
-        """Create table if not exists."""
+        """Create table if not exists (normally done by bot/migrations)."""
         async with self.pool.acquire() as conn:
             await conn.execute(
                 """
@@ -24,6 +30,7 @@ class PostgresStorage:
                     user_id BIGINT NOT NULL,
                     state TEXT,
                     data JSONB,
+                    version BIGINT NOT NULL DEFAULT 0,
                     updated_at TIMESTAMP DEFAULT now(),
                     PRIMARY KEY (chat_id, user_id)
                 );
@@ -32,16 +39,24 @@ class PostgresStorage:
 
     def _ids(self, chat, user):
         """Normalize chat/user arguments to integers (chat_id, user_id)."""
-        if chat is None or user is None:
-            raise ValueError("chat and user must be provided")
-        chat_id = chat if isinstance(chat, int) else getattr(chat, "id", None)
-        user_id = user if isinstance(user, int) else getattr(user, "id", None)
+        if chat is None and user is None:
+            raise ValueError("chat or user must be provided")
+        chat, user = self.check_address(chat=chat, user=user)
+        chat_id = chat if isinstance(chat, (int, str)) else getattr(chat, "id", None)
+        user_id = user if isinstance(user, (int, str)) else getattr(user, "id", None)
         if chat_id is None or user_id is None:
             raise ValueError("unable to determine chat_id/user_id")
         return int(chat_id), int(user_id)
 
+    @staticmethod
+    def _load(data) -> Dict[str, Any]:
+        # asyncpg returns jsonb as text unless a codec is registered
+        if data is None:
+            return {}
+        return json.loads(data) if isinstance(data, str) else dict(data)
+
     # ----- State methods -----
-    async def set_state(self, chat=None, user=None, state: Optional[str] = None):
+    async def set_state(self, *, chat=None, user=None, state: Optional[str] = None):
         chat_id, user_id = self._ids(chat, user)
         async with self.pool.acquire() as conn:
             await conn.execute(
@@ -49,14 +64,14 @@ class PostgresStorage:
                 INSERT INTO fsm_storage(chat_id, user_id, state, data, updated_at)
                 VALUES($1, $2, $3, '{}'::jsonb, NOW())
                 ON CONFLICT (chat_id,user_id)
-                DO UPDATE SET state = $3, updated_at = NOW();
+                DO UPDATE SET state = $3, version = fsm_storage.version + 1, updated_at = NOW();
                 """,
                 chat_id,
                 user_id,
-                state,
+                self.resolve_state(state),
             )
 
-    async def get_state(self, chat=None, user=None) -> Optional[str]:
+    async def get_state(self, *, chat=None, user=None, default: Optional[str] = None) -> Optional[str]:
         chat_id, user_id = self._ids(chat, user)
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
@@ -64,10 +79,10 @@ class PostgresStorage:
                 chat_id,
                 user_id,
             )
-            return row["state"] if row else None
+            return row["state"] if row and row["state"] is not None else self.resolve_state(default)
 
-    async def reset_state(self, chat=None, user=None):
-        """Clear state and data (like finishing the FSM)."""
+    async def reset_state(self, *, chat=None, user=None, with_data: bool = True):
+        """Clear state (and data unless with_data=False), like finishing the FSM."""
         chat_id, user_id = self._ids(chat, user)
         async with self.pool.acquire() as conn:
             # here we clear state and data but keep row (or create row with empty data)
@@ -75,17 +90,22 @@ class PostgresStorage:
                 """
                 INSERT INTO fsm_storage(chat_id, user_id, state, data, updated_at)
                 VALUES($1, $2, NULL, '{}'::jsonb, NOW())
-                ON CONFLICT (chat_id,user_id) DO UPDATE SET state=NULL, data='{}'::jsonb, updated_at=NOW();
+                ON CONFLICT (chat_id,user_id) DO UPDATE SET
+                    state = NULL,
+                    data = CASE WHEN $3 THEN '{}'::jsonb ELSE fsm_storage.data END,
+                    version = fsm_storage.version + 1,
+                    updated_at = NOW();
                 """,
                 chat_id,
                 user_id,
+                with_data,
             )
 
-    # alias for compatibility
-    finish = reset_state
+    async def finish(self, *, chat=None, user=None):
+        await self.reset_state(chat=chat, user=user, with_data=True)
 
     # ----- Data methods -----
-    async def set_data(self, chat=None, user=None, data: Optional[Dict[str, Any]] = None):
+    async def set_data(self, *, chat=None, user=None, data: Optional[Dict[str, Any]] = None):
         chat_id, user_id = self._ids(chat, user)
         safe = data or {}
         payload = json.dumps(safe, ensure_ascii=False)
@@ -94,14 +114,15 @@ class PostgresStorage:
                 """
                 INSERT INTO fsm_storage(chat_id, user_id, state, data, updated_at)
                 VALUES($1, $2, NULL, $3::jsonb, NOW())
-                ON CONFLICT (chat_id,user_id) DO UPDATE SET data=$3::jsonb, updated_at=NOW();
+                ON CONFLICT (chat_id,user_id)
+                DO UPDATE SET data=$3::jsonb, version = fsm_storage.version + 1, updated_at=NOW();
                 """,
                 chat_id,
                 user_id,
                 payload,
             )
 
-    async def get_data(self, chat=None, user=None) -> Dict[str, Any]:
+    async def get_data(self, *, chat=None, user=None, default: Optional[Dict] = None) -> Dict[str, Any]:
         chat_id, user_id = self._ids(chat, user)
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
@@ -110,47 +131,329 @@ class PostgresStorage:
                 user_id,
             )
             if not row or row["data"] is None:
-                return {}
-            return row["data"]
+                return copy.deepcopy(default) if default else {}
+            return self._load(row["data"])
 
-    async def update_data(self, chat=None, user=None, data: Optional[Dict[str, Any]] = None):
-        """Merge provided dict into existing data."""
+    async def update_data(self, *, chat=None, user=None, data: Optional[Dict[str, Any]] = None, **kwargs):
+        """Shallow-merge provided dict into existing data, server-side in one statement."""
+        data = {**(data or {}), **kwargs}
         if not data:
             return
         chat_id, user_id = self._ids(chat, user)
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT data FROM fsm_storage WHERE chat_id=$1 AND user_id=$2",
-                chat_id,
-                user_id,
-            )
-            existing = row["data"] if row and row["data"] else {}
-            # shallow merge
-            merged = {**existing, **data}
             await conn.execute(
                 """
                 INSERT INTO fsm_storage(chat_id, user_id, state, data, updated_at)
                 VALUES($1, $2, NULL, $3::jsonb, NOW())
-                ON CONFLICT (chat_id,user_id) DO UPDATE SET data=$3::jsonb, updated_at=NOW();
+                ON CONFLICT (chat_id,user_id) DO UPDATE SET
+                    data = COALESCE(fsm_storage.data, '{}'::jsonb) || $3::jsonb,
+                    version = fsm_storage.version + 1,
+                    updated_at = NOW();
                 """,
                 chat_id,
                 user_id,
-                json.dumps(merged, ensure_ascii=False),
+                json.dumps(data, ensure_ascii=False),
             )
 
-    async def reset_data(self, chat=None, user=None):
-        chat_id, user_id = self._ids(chat, user)
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                INSERT INTO fsm_storage(chat_id, user_id, state, data, updated_at)
-                VALUES($1, $2, NULL, '{}'::jsonb, NOW())
-                ON CONFLICT (chat_id,user_id) DO UPDATE SET data='{}'::jsonb, updated_at=NOW();
-                """,
-                chat_id,
-                user_id,
-            )
+    async def reset_data(self, *, chat=None, user=None):
+        await self.set_data(chat=chat, user=user, data={})
 
     # ----- housekeeping -----
     async def close(self):
         await self.pool.close()
+
+    async def wait_closed(self):
+        pass
+
+
+_UNSET = object()
+
+
+class _Entry:
+    """Cached row plus the writes not yet flushed to the database."""
+
+    __slots__ = ("state", "data", "db_version", "pending_state", "replace", "patch")
+
+    def __init__(self, state, data, db_version):
+        self.state = state
+        self.data = data
+        self.db_version = db_version  # version column as last seen in the database
+        self.pending_state = _UNSET
+        self.replace = False  # True: ``patch`` is the whole new data, not a merge
+        self.patch = {}
+
+    @property
+    def dirty(self) -> bool:
+        return self.pending_state is not _UNSET or self.replace or bool(self.patch)
+
+    def take_pending(self):
+        ops = (self.pending_state, self.replace, self.patch)
+        self.pending_state, self.replace, self.patch = _UNSET, False, {}
+        return ops
+
+    def restore_pending(self, ops) -> None:
+        """Put back writes whose flush failed, underneath anything written since."""
+        state, replace, patch = ops
+        if self.pending_state is _UNSET:
+            self.pending_state = state
+        if not self.replace:
+            self.replace = replace
+            self.patch = {**patch, **self.patch}
+
+
+class CachedPostgresStorage(PostgresStorage):
+    """
+    Two-tier FSM storage: a per-process LRU of (chat, user) -> (state, data)
+    in front of ``fsm_storage``.
+
+    Reads are served from memory after the first load. Writes only update the
+    cached entry and are recorded as pending; ``flush`` (run by
+    ``FSMFlushMiddleware`` after every update) writes all pending entries in a
+    single statement. Data merges are applied server-side with
+    ``data || patch``, so they never overwrite fields written by another
+    process. Every row carries a ``version`` that the flush returns; if it
+    moved by more than our own write, the row was changed elsewhere and the
+    cached entry is dropped so the next read reloads it.
+
+    Written keys are tracked in a dirty set, so a flush only touches the
+    entries written since the last one, and flushes are serialized so row
+    versions are committed in the order the writes were taken.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, max_size: int = 10000):
+        super().__init__(pool)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[int, int], _Entry]" = OrderedDict()
+        self._dirty: Set[Tuple[int, int]] = set()
+        self._flush_lock = asyncio.Lock()
+
+    async def _entry(self, key: Tuple[int, int]) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT state, data, version FROM fsm_storage WHERE chat_id=$1 AND user_id=$2",
+                *key,
+            )
+        # a concurrent handler may have loaded (and written) it meanwhile
+        entry = self._entries.get(key)
+        if entry is None:
+            if row:
+                entry = _Entry(row["state"], self._load(row["data"]), row["version"])
+            else:
+                entry = _Entry(None, {}, 0)
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        excess = len(self._entries) - self.max_size
+        if excess <= 0:
+            return
+        # least recently used first; dirty entries stay until flushed
+        victims = []
+        for key in self._entries:
+            if key not in self._dirty:
+                victims.append(key)
+                if len(victims) == excess:
+                    break
+        for key in victims:
+            del self._entries[key]
+
+    async def _written(self, chat, user) -> _Entry:
+        key = self._ids(chat, user)
+        entry = await self._entry(key)
+        self._dirty.add(key)
+        return entry
+
+    def forget(self, chat=None, user=None) -> None:
+        """Drop a cached entry (e.g. after the row was changed by another process)."""
+        key = self._ids(chat, user)
+        self._entries.pop(key, None)
+        self._dirty.discard(key)
+
+    def forget_users(self, predicate: Callable[[int], bool]) -> int:
+        """
+        Drop every clean cached entry whose user id matches ``predicate``;
+        used when this process takes over users another process served.
+        """
+        keys = [k for k in self._entries if k not in self._dirty and predicate(k[1])]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    # ----- State methods -----
+    async def get_state(self, *, chat=None, user=None, default: Optional[str] = None) -> Optional[str]:
+        entry = await self._entry(self._ids(chat, user))
+        return entry.state if entry.state is not None else self.resolve_state(default)
+
+    async def set_state(self, *, chat=None, user=None, state: Optional[str] = None):
+        entry = await self._written(chat, user)
+        entry.state = entry.pending_state = self.resolve_state(state)
+
+    async def reset_state(self, *, chat=None, user=None, with_data: bool = True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    # ----- Data methods -----
+    async def get_data(self, *, chat=None, user=None, default: Optional[Dict] = None) -> Dict[str, Any]:
+        entry = await self._entry(self._ids(chat, user))
+        if not entry.data and default:
+            return copy.deepcopy(default)
+        return copy.deepcopy(entry.data)
+
+    async def set_data(self, *, chat=None, user=None, data: Optional[Dict[str, Any]] = None):
+        entry = await self._written(chat, user)
+        entry.data = copy.deepcopy(data or {})
+        entry.replace, entry.patch = True, copy.deepcopy(entry.data)
+
+    async def update_data(self, *, chat=None, user=None, data: Optional[Dict[str, Any]] = None, **kwargs):
+        data = copy.deepcopy({**(data or {}), **kwargs})
+        if not data:
+            return
+        entry = await self._written(chat, user)
+        entry.data.update(data)
+        entry.patch.update(copy.deepcopy(data))
+
+    # ----- write-behind -----
+    async def flush(self) -> int:
+        """Write every pending entry in one upsert; returns the number of rows written."""
+        async with self._flush_lock:
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        keys, self._dirty = self._dirty, set()
+        batch = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry.dirty:
+                batch.append((key, entry, entry.take_pending()))
+        if not batch:
+            return 0
+
+        chat_ids, user_ids, set_state, states, replace, payloads = [], [], [], [], [], []
+        for (chat_id, user_id), entry, (state, rep, patch) in batch:
+            chat_ids.append(chat_id)
+            user_ids.append(user_id)
+            set_state.append(state is not _UNSET)
+            states.append(None if state is _UNSET else state)
+            replace.append(rep)
+            payloads.append(json.dumps(patch, ensure_ascii=False))
+
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    """
+                    WITH v AS (
+                        SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bool[],
+                                             $4::text[], $5::bool[], $6::jsonb[])
+                            AS v(chat_id, user_id, set_state, state, replace, data)
+                    ),
+                    upd AS (
+                        UPDATE fsm_storage f SET
+                            state = CASE WHEN v.set_state THEN v.state ELSE f.state END,
+                            data = CASE WHEN v.replace THEN v.data
+                                        ELSE COALESCE(f.data, '{}'::jsonb) || v.data END,
+                            version = f.version + 1,
+                            updated_at = NOW()
+                        FROM v
+                        WHERE f.chat_id = v.chat_id AND f.user_id = v.user_id
+                        RETURNING f.chat_id, f.user_id, f.version
+                    ),
+                    ins AS (
+                        INSERT INTO fsm_storage (chat_id, user_id, state, data, version, updated_at)
+                        SELECT v.chat_id, v.user_id, v.state, v.data, 1, NOW()
+                        FROM v
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM upd WHERE upd.chat_id = v.chat_id AND upd.user_id = v.user_id
+                        )
+                        ON CONFLICT (chat_id, user_id) DO NOTHING
+                        RETURNING chat_id, user_id, version
+                    )
+                    SELECT * FROM upd UNION ALL SELECT * FROM ins
+                    """,
+                    chat_ids, user_ids, set_state, states, replace, payloads,
+                )
+        except Exception:
+            for key, entry, ops in batch:
+                entry.restore_pending(ops)
+                self._dirty.add(key)
+            raise
+
+        versions = {(r["chat_id"], r["user_id"]): r["version"] for r in rows}
+        for key, entry, ops in batch:
+            version = versions.get(key)
+            if version is None:
+                # the row was inserted by another process in the meantime; retry as an update
+                entry.restore_pending(ops)
+                self._dirty.add(key)
+                continue
+            if version != entry.db_version + 1 and not entry.dirty:
+                # someone else wrote this row since we loaded it
+                self._entries.pop(key, None)
+            else:
+                entry.db_version = version
+        self._evict()
+        return len(batch)
+
+    async def expire(self, max_age_seconds: float, batch_size: int = 5000) -> int:
+        """
+        Delete rows untouched for ``max_age_seconds`` (abandoned conversations)
+        in batches, and drop their cached entries. Returns the number deleted.
+        """
+        deleted = 0
+        while True:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    """
+                    DELETE FROM fsm_storage
+                    WHERE ctid = ANY(ARRAY(
+                        SELECT ctid FROM fsm_storage
+                        WHERE updated_at < NOW() - make_interval(secs => $1)
+                        LIMIT $2
+                    ))
+                    RETURNING chat_id, user_id
+                    """,
+                    float(max_age_seconds),
+                    batch_size,
+                )
+            for r in rows:
+                key = (r["chat_id"], r["user_id"])
+                if key in self._entries and key not in self._dirty:
+                    del self._entries[key]
+            deleted += len(rows)
+            if len(rows) < batch_size:
+                return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": len(self._entries),
+            "dirty": len(self._dirty),
+        }
+
+    async def close(self):
+        await self.flush()
+        await super().close()
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Flushes ``CachedPostgresStorage`` once per processed update."""
+
+    def __init__(self, storage: CachedPostgresStorage):
+        super().__init__()
+        self.storage = storage
+
+    async def on_post_process_update(self, update, results, data: dict):
+        await self.storage.flush()
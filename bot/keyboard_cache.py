@@ -0,0 +1,79 @@
+# keyboard_cache.py
+import functools
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+
+def serialize_markup(markup: Any) -> str:
+    """Serialize a markup exactly like aiogram does before calling the API."""
+    return json.dumps(markup.to_python())
+
+
+class KeyboardCache:
+    """
+    Memoizes keyboards as pre-serialized JSON strings.
+    aiogram hands ``str`` reply_markup values to the Bot API untouched
+    (``aiogram.utils.payload.prepare_arg``), so sending a cached keyboard
+    costs neither markup construction nor ``json.dumps``.
+
+    Keys share the prefixes used by ``RefCache`` (``"provinces:search"``,
+    ``"cities:12:reg"`` ...) so ``invalidate`` can be registered with
+    ``RefCache.on_invalidate`` and data and keyboards expire together.
+    ``ttl`` should match the reference cache's TTL; ``None`` keeps entries
+    until invalidated (static menus).
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: Dict[str, Tuple[float, str]] = {}
+
+    def _lookup(self, key: str):
+        entry = self._items.get(key)
+        if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def _store(self, key: str, markup: Any, ttl: float = None) -> str:
+        payload = serialize_markup(markup)
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        self._items[key] = (expires, payload)
+        return payload
+
+    def get(self, key: str, build: Callable[[], Any], ttl: float = None) -> str:
+        payload = self._lookup(key)
+        if payload is None:
+            payload = self._store(key, build(), ttl)
+        return payload
+
+    async def aget(self, key: str, build: Callable[[], Awaitable[Any]], ttl: float = None) -> str:
+        payload = self._lookup(key)
+        if payload is None:
+            payload = self._store(key, await build(), ttl)
+        return payload
+
+    def memoize(self, key: str):
+        """Decorator for argument-less keyboard builders (static menus); never expires."""
+        def decorator(build):
+            @functools.wraps(build)
+            def wrapper():
+                payload = self._lookup(key)
+                if payload is None:
+                    payload = self._store(key, build(), ttl=0)
+                return payload
+            return wrapper
+        return decorator
+
+    def invalidate(self, prefixes: Iterable[str] = ()) -> None:
+        prefixes = list(prefixes)
+        if not prefixes:
+            # static menus survive a full reference-data flush
+            self._items = {k: v for k, v in self._items.items() if k.startswith("menu:")}
+            return
+        for k in [k for k in self._items if any(k == p or k.startswith(p + ":") for p in prefixes)]:
+            del self._items[k]
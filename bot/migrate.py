@@ -0,0 +1,105 @@
+# migrate.py
+"""
+Versioned schema migrations shared by the bot and the admin API.
+
+Migrations are plain SQL files in ``bot/migrations`` named
+``<version>_<description>.sql`` (e.g. ``0002_hot_query_indexes.sql``) and are
+applied in version order. Applied versions are recorded in
+``schema_migrations``; on an up-to-date database ``migrate`` costs a single
+SELECT. Pending files are applied together in one transaction under an
+advisory lock, so concurrent deploys never apply a file twice.
+The admin API loads this module from next to the migrations directory
+(backend/app/migrate.py), so there is one runner for both processes.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import List, Tuple
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.getenv(
+    "MIGRATIONS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations"),
+)
+LOCK_KEY = "schema_migrations"
+
+
+def discover(directory: str = MIGRATIONS_DIR) -> List[Tuple[str, str, str]]:
+    """Return (version, filename, sql) for every migration file, sorted by version."""
+    found = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".sql"):
+            continue
+        version = filename.split("_", 1)[0]
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            found.append((version, filename, f.read()))
+    return found
+
+
+def checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+async def _applied(conn: asyncpg.Connection) -> dict:
+    try:
+        rows = await conn.fetch("SELECT version, checksum FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return {}
+    return {r["version"]: r["checksum"] for r in rows}
+
+
+async def migrate(conn: asyncpg.Connection, directory: str = MIGRATIONS_DIR) -> List[str]:
+    """Apply pending migrations; returns the filenames that were applied."""
+    migrations = discover(directory)
+    applied = await _applied(conn)
+    for version, filename, sql in migrations:
+        if version in applied and applied[version] != checksum(sql):
+            log.warning("migration %s was edited after it was applied", filename)
+    if all(version in applied for version, _, _ in migrations):
+        return []
+
+    done = []
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", LOCK_KEY)
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT now()
+            )
+            """
+        )
+        # another process may have migrated while we waited for the lock
+        applied = await _applied(conn)
+        for version, filename, sql in migrations:
+            if version in applied:
+                continue
+            await conn.execute(sql)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                version,
+                filename,
+                checksum(sql),
+            )
+            done.append(filename)
+    return done
+
+
+async def _main() -> None:
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        applied = await migrate(conn)
+        print("applied: " + ", ".join(applied) if applied else "schema is up to date")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
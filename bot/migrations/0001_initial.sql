@@ -0,0 +1,200 @@
+-- Baseline schema (everything init_db used to create on every start).
+-- Written with IF NOT EXISTS so it also applies cleanly to databases that
+-- were created by the old init_db.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT UNIQUE,
+    first_name TEXT,
+    username TEXT,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS service_categories (
+    id SERIAL PRIMARY KEY,
+    name TEXT UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS services (
+    id SERIAL PRIMARY KEY,
+    category_id INTEGER REFERENCES service_categories(id) ON DELETE CASCADE,
+    title TEXT
+);
+
+ALTER TABLE services ADD COLUMN IF NOT EXISTS documents TEXT;
+
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT,
+    service_id INTEGER REFERENCES services(id) ON DELETE CASCADE,
+    order_code TEXT UNIQUE,
+    docs TEXT,
+    status TEXT DEFAULT 'new',
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_id BIGINT PRIMARY KEY,
+    post_limit INTEGER DEFAULT 5,
+    notifications_enabled BOOLEAN DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS hashtags (
+    id SERIAL PRIMARY KEY,
+    name TEXT UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id SERIAL PRIMARY KEY,
+    message_id BIGINT UNIQUE,
+    title TEXT,
+    content TEXT,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS post_hashtags (
+    post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+    hashtag_id INTEGER REFERENCES hashtags(id) ON DELETE CASCADE,
+    PRIMARY KEY (post_id, hashtag_id)
+);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    user_id BIGINT,
+    hashtag_id INTEGER REFERENCES hashtags(id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, hashtag_id)
+);
+
+CREATE TABLE IF NOT EXISTS provinces (
+    id SERIAL PRIMARY KEY,
+    name TEXT UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS cities (
+    id SERIAL PRIMARY KEY,
+    province_id INTEGER REFERENCES provinces(id) ON DELETE CASCADE,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS seed_state (
+    name TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS cafenets (
+    id SERIAL PRIMARY KEY,
+    province_id INTEGER REFERENCES provinces(id) ON DELETE CASCADE,
+    city_id INTEGER REFERENCES cities(id) ON DELETE CASCADE,
+    name TEXT,
+    address TEXT,
+    phone TEXT,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+-- lets seed_cities.py upsert Iran-Cities.csv. Databases from before the
+-- migrations may hold duplicate (province_id, name) cities: point their
+-- cafenets at the oldest copy and drop the others (deleting a city would
+-- cascade to its cafenets), otherwise the unique index can't be built.
+UPDATE cafenets c SET city_id = d.keep
+FROM (
+    SELECT id, min(id) OVER (PARTITION BY province_id, name) AS keep
+    FROM cities
+    WHERE province_id IS NOT NULL AND name IS NOT NULL
+) d
+WHERE c.city_id = d.id AND d.id <> d.keep;
+
+DELETE FROM cities c USING cities k
+WHERE c.province_id = k.province_id AND c.name = k.name AND c.id > k.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cities_province_name ON cities (province_id, name);
+
+CREATE TABLE IF NOT EXISTS tools (
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    message TEXT
+);
+
+-- admin API tables
+CREATE TABLE IF NOT EXISTS admins (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    full_name TEXT,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS tickets (
+   id SERIAL PRIMARY KEY,
+   user_id BIGINT NOT NULL,
+   subject TEXT,
+   message TEXT,
+   status TEXT DEFAULT 'open', -- open | answered | closed
+   admin_reply TEXT,
+   created_at TIMESTAMP DEFAULT now(),
+   updated_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS auto_replies (
+    id SERIAL PRIMARY KEY,
+    trigger TEXT NOT NULL,
+    reply TEXT NOT NULL,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+-- persistent broadcasts
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id SERIAL PRIMARY KEY,
+    admin_id BIGINT,
+    chat_id BIGINT,
+    message_id BIGINT,
+    text TEXT NOT NULL,
+    status TEXT DEFAULT 'running', -- running | paused | cancelled | done
+    cursor_user_id BIGINT DEFAULT 0,
+    total INTEGER DEFAULT 0,
+    sent INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    blocked INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT now(),
+    updated_at TIMESTAMP DEFAULT now(),
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    job_id INTEGER REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+    user_id BIGINT,
+    status TEXT NOT NULL, -- sent | failed | blocked
+    delivered_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (job_id, user_id)
+);
+
+-- columns added after the first release
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP DEFAULT NOW();
+
+ALTER TABLE cafenets ADD COLUMN IF NOT EXISTS location_lat DOUBLE PRECISION;
+ALTER TABLE cafenets ADD COLUMN IF NOT EXISTS location_lon DOUBLE PRECISION;
+ALTER TABLE cafenets ADD COLUMN IF NOT EXISTS owner_user_id BIGINT;
+
+-- full-text search; the translate() arguments mirror bot/text_normalize.py
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', translate(coalesce(title, ''), 'يىكةأإؤ‌۰٠۱١۲٢۳٣۴٤۵٥۶٦۷٧۸٨۹٩ًٌٍَُِّْٰـ‍‎‏', 'ییکهااو 00112233445566778899')), 'A') ||
+    setweight(to_tsvector('simple', translate(coalesce(content, ''), 'يىكةأإؤ‌۰٠۱١۲٢۳٣۴٤۵٥۶٦۷٧۸٨۹٩ًٌٍَُِّْٰـ‍‎‏', 'ییکهااو 00112233445566778899')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_posts_search ON posts USING GIN (search_vector);
+
+-- aiogram FSM storage (bot/fsm_storage_postgres.py)
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    state TEXT,
+    data JSONB,
+    updated_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (chat_id, user_id)
+);
+
+-- from backend/create_tables.sql
+CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id);
+CREATE INDEX IF NOT EXISTS idx_auto_triggers ON auto_replies(trigger);
@@ -0,0 +1,27 @@
+-- Indexes for the hot query shapes in bot.py and backend/app.
+-- Checked with explain_check.py; cities (province_id, name) is already
+-- covered by uq_cities_province_name.
+
+-- my_orders: WHERE user_id=$1 ORDER BY created_at DESC LIMIT 5
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at DESC);
+
+-- cafenets by city (ordered by name) and by province
+CREATE INDEX IF NOT EXISTS idx_cafenets_city_name ON cafenets (city_id, name);
+CREATE INDEX IF NOT EXISTS idx_cafenets_province_city ON cafenets (province_id, city_id);
+
+-- user stats (today / week / month) and the "last seen" lists
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen DESC NULLS LAST);
+
+-- subscriber fan-out: hashtag -> users (the primary key leads with user_id)
+CREATE INDEX IF NOT EXISTS idx_subscriptions_hashtag_user ON subscriptions (hashtag_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_post_hashtags_hashtag_post ON post_hashtags (hashtag_id, post_id);
+
+-- ticket lists, optionally filtered by status, newest first
+CREATE INDEX IF NOT EXISTS idx_tickets_status_created ON tickets (status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_tickets_created ON tickets (created_at DESC);
+
+-- latest posts, age-based pruning
+CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_services_category ON services (category_id);
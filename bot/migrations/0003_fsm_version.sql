@@ -0,0 +1,3 @@
+-- Version stamp for CachedPostgresStorage: bumped by every write so a
+-- process can tell whether a row changed since it cached it.
+ALTER TABLE fsm_storage ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
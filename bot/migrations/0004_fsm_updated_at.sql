@@ -0,0 +1,2 @@
+-- lets the FSM sweeper find stale conversations without a full scan
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at);
@@ -0,0 +1,15 @@
+-- updates received once and handed to worker processes (see update_queue.py)
+CREATE TABLE IF NOT EXISTS update_queue (
+    id BIGSERIAL PRIMARY KEY,
+    shard INT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_update_queue_shard ON update_queue (shard, id);
+
+-- one row per shard; a worker owns a shard while its lease is valid
+CREATE TABLE IF NOT EXISTS update_shards (
+    shard INT PRIMARY KEY,
+    owner TEXT,
+    lease_until TIMESTAMPTZ NOT NULL DEFAULT 'epoch'
+);
@@ -0,0 +1,10 @@
+-- admin API token revocation (backend/app/token_cache.py)
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    admin_id INT,
+    expires_at TIMESTAMPTZ NOT NULL,
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- tokens of this admin issued before this moment are rejected ("log out everywhere")
+ALTER TABLE admins ADD COLUMN IF NOT EXISTS tokens_valid_after TIMESTAMPTZ;
@@ -0,0 +1,26 @@
+-- Keyset pagination of the admin API lists on (created_at, id), newest first
+-- (backend/app/pagination.py). created_at must be NOT NULL for row-value
+-- comparisons to page through every row.
+
+ALTER TABLE tools ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT now();
+
+UPDATE users SET created_at = 'epoch' WHERE created_at IS NULL;
+UPDATE tickets SET created_at = 'epoch' WHERE created_at IS NULL;
+UPDATE auto_replies SET created_at = 'epoch' WHERE created_at IS NULL;
+UPDATE tools SET created_at = 'epoch' WHERE created_at IS NULL;
+
+ALTER TABLE users ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE tickets ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE auto_replies ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE tools ALTER COLUMN created_at SET NOT NULL;
+
+-- the (created_at, id) indexes also serve the created_at range scans the old ones did
+CREATE INDEX IF NOT EXISTS idx_users_created_id ON users (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_tickets_created_id ON tickets (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_tickets_status_created_id ON tickets (status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_auto_replies_created_id ON auto_replies (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_tools_created_id ON tools (created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_users_created_at;
+DROP INDEX IF EXISTS idx_tickets_created;
+DROP INDEX IF EXISTS idx_tickets_status_created;
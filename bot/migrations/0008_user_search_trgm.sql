@@ -0,0 +1,16 @@
+-- one indexed user search for the bot and the admin API (search_users() in 0011)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- same folding as text_normalize.normalize (Arabic/Persian variants, digits, ZWNJ, case)
+CREATE OR REPLACE FUNCTION normalize_search(t TEXT) RETURNS TEXT
+LANGUAGE SQL IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(translate(coalesce(t, ''), 'يىكةأإؤ‌۰٠۱١۲٢۳٣۴٤۵٥۶٦۷٧۸٨۹٩ًٌٍَُِّْٰـ‍‎‏', 'ییکهااو 00112233445566778899'))
+$$;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_text TEXT
+    GENERATED ALWAYS AS (normalize_search(first_name) || ' ' || normalize_search(username)) STORED;
+
+-- substring / similarity matches on name and username
+CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users USING GIN (search_text gin_trgm_ops);
+-- @username fast path
+CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (lower(username));
@@ -0,0 +1,7 @@
+-- shard worker membership (see update_queue.py): every ShardWorker renews its
+-- row each lease cycle, so a worker that holds no shard yet still counts
+-- towards everyone's share
+CREATE TABLE IF NOT EXISTS update_workers (
+    owner TEXT PRIMARY KEY,
+    seen_until TIMESTAMPTZ NOT NULL
+);
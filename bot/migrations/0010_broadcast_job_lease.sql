@@ -0,0 +1,5 @@
+-- a running broadcast job is sent by exactly one process: the one holding
+-- its lease (broadcast.py BroadcastJobs); resume_pending only picks up jobs
+-- whose lease expired
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS owner TEXT;
+ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS lease_until TIMESTAMPTZ NOT NULL DEFAULT 'epoch';
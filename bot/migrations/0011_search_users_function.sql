@@ -0,0 +1,73 @@
+-- The one user search of the bot and the admin API: both call
+-- SELECT * FROM search_users($1, $2), so lookup order and ranking live here only.
+--
+-- Tries, in order:
+--   * an all-digit term (Persian/Arabic digits too) as an exact user_id;
+--   * @name as an exact, case-insensitive username;
+--   * a ranked fuzzy match on users.search_text (migration 0008): substring
+--     matches first, then by trigram word similarity, both served by the
+--     pg_trgm GIN index. LIKE '%ab%' has no full trigram, so terms shorter
+--     than three characters only use the word-similarity operator.
+-- max_rows defaults to 20 and is capped at 50.
+CREATE OR REPLACE FUNCTION search_users(term TEXT, max_rows INT DEFAULT 20)
+RETURNS TABLE (
+    user_id BIGINT,
+    first_name TEXT,
+    username TEXT,
+    is_blocked BOOLEAN,
+    last_seen TIMESTAMP,
+    created_at TIMESTAMP
+)
+LANGUAGE plpgsql STABLE AS $$
+#variable_conflict use_column
+DECLARE
+    t TEXT := btrim(coalesce(term, ''));
+    needle TEXT;
+    pattern TEXT;
+BEGIN
+    max_rows := least(greatest(coalesce(max_rows, 20), 1), 50);
+    IF t = '' THEN
+        RETURN;
+    END IF;
+
+    needle := normalize_search(t);
+    IF needle ~ '^[0-9]{1,18}$' THEN
+        RETURN QUERY
+            SELECT u.user_id, u.first_name, u.username, u.is_blocked, u.last_seen, u.created_at
+            FROM users u WHERE u.user_id = needle::BIGINT;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+    END IF;
+
+    IF left(t, 1) = '@' THEN
+        t := substr(t, 2);
+        RETURN QUERY
+            SELECT u.user_id, u.first_name, u.username, u.is_blocked, u.last_seen, u.created_at
+            FROM users u WHERE lower(u.username) = lower(t) LIMIT 1;
+        IF FOUND OR t = '' THEN
+            RETURN;
+        END IF;
+        needle := normalize_search(t);
+    END IF;
+
+    IF char_length(t) < 3 THEN
+        RETURN QUERY
+            SELECT u.user_id, u.first_name, u.username, u.is_blocked, u.last_seen, u.created_at
+            FROM users u
+            WHERE needle <% u.search_text
+            ORDER BY word_similarity(needle, u.search_text) DESC, u.user_id
+            LIMIT max_rows;
+    ELSE
+        pattern := '%' || replace(replace(replace(needle, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+        RETURN QUERY
+            SELECT u.user_id, u.first_name, u.username, u.is_blocked, u.last_seen, u.created_at
+            FROM users u
+            WHERE u.search_text LIKE pattern OR needle <% u.search_text
+            ORDER BY u.search_text LIKE pattern DESC,
+                     word_similarity(needle, u.search_text) DESC,
+                     u.user_id
+            LIMIT max_rows;
+    END IF;
+END
+$$;
@@ -0,0 +1,5 @@
+-- Date-range exports of orders (backend/app/routers/export.py):
+-- WHERE created_at >= $1 AND created_at < $2 [AND status = $3] ORDER BY id.
+-- idx_orders_user_created only serves lookups by user.
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at);
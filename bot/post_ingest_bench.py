@@ -0,0 +1,86 @@
+# post_ingest_bench.py
+"""
+Micro-benchmark for channel-post ingestion: the old per-hashtag loop
+(1 + 2N round trips) against ``bot.store_channel_post`` (one CTE statement).
+
+    DATABASE_URL=postgresql://localhost/cafenet_check python post_ingest_bench.py --posts 500 --tags 15
+
+Runs against a database with the migrations applied, inside one
+transaction that is rolled back, so nothing is left behind. Each path gets
+its own hashtag names, so both pay for inserting new tags at first and hit
+existing ones later on.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import asyncpg
+
+# bot.py builds its Bot at import time; the benchmark never talks to Telegram
+os.environ.setdefault("BOT_TOKEN", "1:BENCH")
+
+from bot import store_channel_post  # noqa: E402
+from migrate import migrate  # noqa: E402
+
+
+async def store_channel_post_loop(conn, message_id, title, content, tags):
+    """The ingestion path before store_channel_post, kept here for comparison."""
+    post_row = await conn.fetchrow("""
+        INSERT INTO posts (message_id, title, content, created_at)
+        VALUES ($1, $2, $3, NOW())
+        ON CONFLICT (message_id) DO UPDATE
+          SET title=EXCLUDED.title, content=EXCLUDED.content
+        RETURNING id
+    """, message_id, title, content)
+    post_id = post_row["id"]
+    for tag in tags:
+        hashtag_row = await conn.fetchrow(
+            "INSERT INTO hashtags (name) VALUES ($1) ON CONFLICT (name) DO UPDATE SET name=EXCLUDED.name RETURNING id",
+            tag
+        )
+        await conn.execute(
+            "INSERT INTO post_hashtags (post_id, hashtag_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+            post_id, hashtag_row["id"]
+        )
+    return post_id
+
+
+async def run(conn, store, first_id, args, prefix):
+    started = time.perf_counter()
+    for i in range(args.posts):
+        tags = [f"{prefix}{(i * args.tags + j) % args.vocabulary}" for j in range(args.tags)]
+        content = "bench post\n" + " ".join("#" + t for t in tags)
+        await store(conn, first_id - i, "bench post", content, tags)
+    return time.perf_counter() - started
+
+
+async def main(args):
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    try:
+        await migrate(conn)
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            loop = await run(conn, store_channel_post_loop, -10_000_000, args, "benchloop")
+            cte = await run(conn, store_channel_post, -20_000_000, args, "benchcte")
+        finally:
+            await tr.rollback()
+    finally:
+        await conn.close()
+
+    for name, seconds, trips in (
+        ("loop", loop, 1 + 2 * args.tags),
+        ("cte", cte, 1),
+    ):
+        print(f"{name:5} {args.posts} posts x {args.tags} tags: {seconds:.2f}s = "
+              f"{seconds / args.posts * 1000:.2f} ms/post ({trips} round trip(s) per post)")
+    print(f"speed-up: {loop / cte:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=15, help="hashtags per post")
+    parser.add_argument("--vocabulary", type=int, default=200, help="distinct hashtags per path")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+# ref_cache.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+class RefCache:
+    """
+    In-process read-through cache for small, rarely-changing reference data
+    (provinces, cities, service categories, tools ...).
+
+    Keys are strings such as ``"provinces"`` or ``"cities:12"``.
+    ``invalidate("cities")`` drops ``"cities"`` and every ``"cities:*"`` key.
+    Entries also expire after ``ttl`` seconds as a safety net for writes made
+    outside this process (e.g. the admin API).
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: Dict[str, Tuple[float, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._generation = 0
+        self._listeners: List[Callable[[List[str]], None]] = []
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        # one loader per key at a time; concurrent callers wait for its result
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            generation = self._generation
+            value = await loader()
+            if isinstance(value, list):
+                value = tuple(value)
+            # an invalidate() that ran during the load makes this value stale
+            if generation == self._generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+            return value
+
+    def _matches(self, key: str, prefixes) -> bool:
+        return any(key == p or key.startswith(p + ":") for p in prefixes)
+
+    def invalidate(self, *prefixes: str) -> None:
+        """Drop cached entries; with no arguments the whole cache is cleared."""
+        self._generation += 1
+        if prefixes:
+            dropped = [k for k in self._data if self._matches(k, prefixes)]
+        else:
+            dropped = list(self._data)
+        for k in dropped:
+            self._data.pop(k, None)
+        for listener in self._listeners:
+            listener(list(prefixes))
+
+    def on_invalidate(self, listener: Callable[[List[str]], None]) -> None:
+        """Register ``listener(prefixes)``, called on every invalidation ([] = all)."""
+        self._listeners.append(listener)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": len(self._data),
+        }
@@ -0,0 +1,165 @@
+# routing.py
+import inspect
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+ANY_STATE = "*"
+
+
+def _resolve_states(state) -> frozenset:
+    """Same rules as aiogram's ``state=`` argument (None = only outside any FSM state)."""
+    if not isinstance(state, (list, set, tuple, frozenset)):
+        state = [state]
+    states = set()
+    for item in state:
+        if isinstance(item, State):
+            states.add(item.state)
+        elif inspect.isclass(item) and issubclass(item, StatesGroup):
+            states.update(item.all_states_names)
+        else:
+            states.add(item)
+    return frozenset(states)
+
+
+class Route:
+    __slots__ = ("handler", "states", "params")
+
+    def __init__(self, handler: Callable, states: frozenset):
+        self.handler = handler
+        self.states = states
+        spec = inspect.getfullargspec(handler)
+        # keyword arguments the handler accepts from aiogram's data (e.g. ``state``)
+        self.params = None if spec.varkw else set(spec.args[1:] + spec.kwonlyargs)
+
+    def accepts(self, raw_state: Optional[str]) -> bool:
+        return ANY_STATE in self.states or raw_state in self.states
+
+    async def __call__(self, obj, data: Dict[str, Any]):
+        if self.params is not None:
+            data = {k: v for k, v in data.items() if k in self.params}
+        return await self.handler(obj, **data)
+
+
+class _Node:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.routes: List[Route] = []
+
+
+def _add(routes: List[Route], route: Route, key: str) -> None:
+    for other in routes:
+        if other.states & route.states or ANY_STATE in other.states | route.states:
+            raise ValueError(
+                f"{key!r} is already routed to {other.handler.__name__} "
+                f"(while registering {route.handler.__name__})"
+            )
+    routes.append(route)
+
+
+class Router:
+    """
+    Dispatch index for reply-keyboard texts and callback_data.
+
+    Instead of one lambda filter per handler, evaluated in order until one
+    matches, every static route lives in a dict (exact message text, exact
+    callback_data) or a character trie (callback_data prefixes, longest
+    prefix wins). ``setup`` registers a single message handler and a single
+    callback handler that look the update up and call the routed handler;
+    updates without a route fall through to the Dispatcher's other handlers
+    (FSM states, conversations, channel posts ...).
+
+    Like aiogram, routes only match outside FSM states unless ``state=`` is
+    given. Registering the same text/data/prefix twice for overlapping
+    states raises ``ValueError``, so duplicate handlers can't shadow each
+    other silently.
+    """
+
+    def __init__(self):
+        self.dp: Optional[Dispatcher] = None
+        self._texts: Dict[str, List[Route]] = {}
+        self._data: Dict[str, List[Route]] = {}
+        self._prefixes = _Node()
+
+    def text(self, *texts: str, state=None):
+        """Decorator: route messages whose text equals one of ``texts``."""
+        def decorator(handler):
+            route = Route(handler, _resolve_states(state))
+            for text in texts:
+                _add(self._texts.setdefault(text, []), route, text)
+            return handler
+        return decorator
+
+    def callback(self, *data: str, prefix: str = None, state=None):
+        """Decorator: route callback queries by exact ``data`` and/or a ``prefix``."""
+        def decorator(handler):
+            route = Route(handler, _resolve_states(state))
+            for value in data:
+                _add(self._data.setdefault(value, []), route, value)
+            if prefix is not None:
+                node = self._prefixes
+                for ch in prefix:
+                    node = node.children.setdefault(ch, _Node())
+                _add(node.routes, route, prefix + "*")
+            return handler
+        return decorator
+
+    def action(self, *actions, state=None):
+        """Decorator: route callback queries encoded by the given ``CallbackAction``s."""
+        def decorator(handler):
+            for action in actions:
+                self.callback(prefix=action.prefix, state=state)(handler)
+            return handler
+        return decorator
+
+    def _callback_candidates(self, data: str) -> List[List[Route]]:
+        found = []
+        exact = self._data.get(data)
+        if exact:
+            found.append(exact)
+        node = self._prefixes
+        path = []
+        for ch in data:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.routes:
+                path.append(node.routes)
+        found.extend(reversed(path))  # longest prefix first
+        return found
+
+    async def _pick(self, candidates: List[List[Route]], chat_id, user_id):
+        raw_state = await self.dp.storage.get_state(chat=chat_id, user=user_id)
+        for routes in candidates:
+            for route in routes:
+                if route.accepts(raw_state):
+                    return {"route": route}
+        return False
+
+    async def match_message(self, message: types.Message):
+        routes = self._texts.get(message.text)
+        if not routes:
+            return False
+        return await self._pick([routes], message.chat.id, message.from_user.id)
+
+    async def match_callback(self, call: types.CallbackQuery):
+        if not call.data:
+            return False
+        candidates = self._callback_candidates(call.data)
+        if not candidates:
+            return False
+        chat_id = call.message.chat.id if call.message else None
+        return await self._pick(candidates, chat_id, call.from_user.id)
+
+    @staticmethod
+    async def _dispatch(obj, route: Route, **data):
+        return await route(obj, data)
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Register the index; call before any other handler is registered."""
+        self.dp = dp
+        dp.register_message_handler(self._dispatch, self.match_message, state=ANY_STATE)
+        dp.register_callback_query_handler(self._dispatch, self.match_callback, state=ANY_STATE)
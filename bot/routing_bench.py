@@ -0,0 +1,161 @@
+# routing_bench.py
+"""
+Dispatch cost of the routing index against one filter per handler.
+
+    python routing_bench.py --iterations 2000
+
+Both dispatchers are built from the routes bot.py registers on its
+``Router`` (same texts, callback data, prefixes and states), with no-op
+handlers, so only the lookup is measured:
+
+* linear: one aiogram handler per route with a lambda filter, evaluated in
+  registration order until one matches (how bot.py dispatched before);
+* router: ``routing.Router``, one dict / trie lookup.
+
+Reported per case: microseconds per update through
+``Dispatcher.process_update`` and how many filters ran.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+# bot.py builds its Bot at import time; the benchmark never talks to Telegram
+os.environ.setdefault("BOT_TOKEN", "1:BENCH")
+
+import bot as app  # noqa: E402
+from routing import ANY_STATE, Router  # noqa: E402
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def wrap(self, check):
+        def counted(obj):
+            self.calls += 1
+            return check(obj)
+        return counted
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+def _prefix_routes(node, prefix=""):
+    for route in node.routes:
+        yield prefix, route
+    for ch, child in node.children.items():
+        yield from _prefix_routes(child, prefix + ch)
+
+
+def _state(route):
+    return ANY_STATE if ANY_STATE in route.states else list(route.states)
+
+
+def linear_dispatcher(bot: Bot, source: Router, counter: Counter) -> Dispatcher:
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    for text, routes in source._texts.items():
+        for route in routes:
+            dp.register_message_handler(noop, counter.wrap(lambda m, t=text: m.text == t), state=_state(route))
+    for data, routes in source._data.items():
+        for route in routes:
+            dp.register_callback_query_handler(noop, counter.wrap(lambda c, d=data: c.data == d),
+                                               state=_state(route))
+    # longest prefix first, as the trie resolves them
+    for prefix, route in sorted(_prefix_routes(source._prefixes), key=lambda p: -len(p[0])):
+        dp.register_callback_query_handler(noop, counter.wrap(lambda c, p=prefix: c.data.startswith(p)),
+                                           state=_state(route))
+    dp.register_message_handler(noop, state=ANY_STATE)  # fallback, like the FSM/conversation handlers
+    return dp
+
+
+def routed_dispatcher(bot: Bot, source: Router, counter: Counter) -> Dispatcher:
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    router = Router()
+    for text, routes in source._texts.items():
+        for route in routes:
+            router.text(text, state=_state(route))(noop)
+    for data, routes in source._data.items():
+        for route in routes:
+            router.callback(data, state=_state(route))(noop)
+    for prefix, route in _prefix_routes(source._prefixes):
+        router.callback(prefix=prefix, state=_state(route))(noop)
+    match_message, match_callback = router.match_message, router.match_callback
+
+    async def counted_message(message):
+        counter.calls += 1
+        return await match_message(message)
+
+    async def counted_callback(call):
+        counter.calls += 1
+        return await match_callback(call)
+
+    router.match_message, router.match_callback = counted_message, counted_callback
+    router.setup(dp)
+    dp.register_message_handler(noop, state=ANY_STATE)
+    return dp
+
+
+def message_update(text: str) -> types.Update:
+    user = {"id": 42, "is_bot": False, "first_name": "bench"}
+    return types.Update(update_id=1, message={
+        "message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "from": user, "text": text,
+    })
+
+
+def callback_update(data: str) -> types.Update:
+    user = {"id": 42, "is_bot": False, "first_name": "bench"}
+    message = {"message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "from": user, "text": "x"}
+    return types.Update(update_id=1, callback_query={
+        "id": "1", "from": user, "chat_instance": "1", "message": message, "data": data,
+    })
+
+
+async def measure(dp: Dispatcher, counter: Counter, update: types.Update, iterations: int):
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    counter.calls = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await dp.process_update(update)
+    return (time.perf_counter() - started) / iterations * 1e6, counter.calls / iterations
+
+
+def cases(source: Router):
+    texts = [t for t, routes in source._texts.items() if any(None in r.states for r in routes)]
+    prefixes = [p for p, r in _prefix_routes(source._prefixes) if None in r.states]
+    data = [d for d, routes in source._data.items() if any(None in r.states for r in routes)]
+    picked = []
+    if texts:
+        picked += [("text", texts[0], message_update(texts[0])), ("text", texts[-1], message_update(texts[-1]))]
+    if data:
+        picked.append(("cb", data[-1], callback_update(data[-1])))
+    if prefixes:
+        picked.append(("cb", prefixes[-1] + "7", callback_update(prefixes[-1] + "7")))
+    picked.append(("text", "unmatched", message_update("no such button")))
+    return picked
+
+
+async def main(args):
+    bot = Bot("1:BENCH")
+    linear_counter, routed_counter = Counter(), Counter()
+    linear = linear_dispatcher(bot, app.router, linear_counter)
+    routed = routed_dispatcher(bot, app.router, routed_counter)
+    print(f"{len(app.router._texts)} texts, {len(app.router._data)} callback data, "
+          f"{sum(1 for _ in _prefix_routes(app.router._prefixes))} prefixes; {args.iterations} iterations")
+    for kind, label, update in cases(app.router):
+        lin_us, lin_filters = await measure(linear, linear_counter, update, args.iterations)
+        rt_us, rt_filters = await measure(routed, routed_counter, update, args.iterations)
+        print(f"{kind:4} {label[:24]:24} linear {lin_us:7.0f} us ({lin_filters:.0f} filters)  "
+              f"router {rt_us:5.0f} us ({rt_filters:.0f} lookup)")
+    await (await bot.get_session()).close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
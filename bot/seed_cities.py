@@ -0,0 +1,105 @@
+# seed_cities.py
+"""
+Idempotent bulk loader for Iran-Cities.csv -> provinces / cities.
+
+Runs on every bot start (and as ``python seed_cities.py [--force]``); it is a
+no-op unless the normalized CSV content differs from the last seeded hash.
+"""
+import asyncio
+import csv
+import hashlib
+import os
+import sys
+from typing import List, Tuple
+
+import asyncpg
+
+from text_normalize import normalize_spelling
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Iran-Cities.csv")
+SEED_NAME = "iran_cities"
+
+
+def load_rows(path: str = DEFAULT_CSV) -> List[Tuple[str, str]]:
+    """Read (province, city) pairs, normalized and de-duplicated, in file order."""
+    seen = set()
+    rows = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for record in csv.DictReader(f):
+            province = normalize_spelling(record.get("state", ""))
+            city = normalize_spelling(record.get("city", ""))
+            if not province or not city or (province, city) in seen:
+                continue
+            seen.add((province, city))
+            rows.append((province, city))
+    return rows
+
+
+def content_hash(rows: List[Tuple[str, str]]) -> str:
+    h = hashlib.sha256()
+    for province, city in rows:
+        h.update(f"{province}\t{city}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+async def seed_cities(pool: asyncpg.pool.Pool, path: str = DEFAULT_CSV, force: bool = False) -> int:
+    """
+    Upsert provinces and cities from ``path`` in a single statement.
+    Returns the number of newly inserted cities (0 when skipped).
+    """
+    rows = load_rows(path)
+    digest = content_hash(rows)
+    provinces = [r[0] for r in rows]
+    cities = [r[1] for r in rows]
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # serialize concurrent boots; released at commit
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", SEED_NAME)
+            if not force:
+                current = await conn.fetchval(
+                    "SELECT content_hash FROM seed_state WHERE name=$1", SEED_NAME
+                )
+                if current == digest:
+                    return 0
+
+            result = await conn.execute(
+                """
+                WITH src AS (
+                    SELECT * FROM unnest($1::text[], $2::text[]) AS s(province, city)
+                ), p AS (
+                    INSERT INTO provinces (name)
+                    SELECT DISTINCT province FROM src ORDER BY 1
+                    ON CONFLICT (name) DO UPDATE SET name=EXCLUDED.name
+                    RETURNING id, name
+                )
+                INSERT INTO cities (province_id, name)
+                SELECT p.id, src.city FROM src JOIN p ON p.name = src.province
+                ON CONFLICT (province_id, name) DO NOTHING
+                """,
+                provinces,
+                cities,
+            )
+            await conn.execute(
+                """
+                INSERT INTO seed_state (name, content_hash, applied_at)
+                VALUES ($1, $2, NOW())
+                ON CONFLICT (name) DO UPDATE SET content_hash=$2, applied_at=NOW()
+                """,
+                SEED_NAME,
+                digest,
+            )
+    return int(result.split()[-1])
+
+
+async def _main(argv: List[str]) -> None:
+    pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"), min_size=1, max_size=1)
+    try:
+        inserted = await seed_cities(pool, force="--force" in argv)
+        print(f"seeded {inserted} cities")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,70 @@
+# text_normalize.py
+import re
+from typing import List
+
+# Arabic code points that Persian keyboards/sources mix in, mapped to the
+# Persian form. ZWNJ becomes a space so "می‌شود" and "می شود" match.
+CHAR_MAP = {
+    "ي": "ی",  # ي -> ی
+    "ى": "ی",  # ى -> ی
+    "ك": "ک",  # ك -> ک
+    "ة": "ه",  # ة -> ه
+    "أ": "ا",  # أ -> ا
+    "إ": "ا",  # إ -> ا
+    "ؤ": "و",  # ؤ -> و
+    "\u200c": " ",  # ZWNJ
+}
+# Persian and Arabic-Indic digits -> ASCII
+for _i in range(10):
+    CHAR_MAP[chr(0x06F0 + _i)] = str(_i)
+    CHAR_MAP[chr(0x0660 + _i)] = str(_i)
+
+# Diacritics (harakat, superscript alef), tatweel and bidi/joiner marks.
+DELETE_CHARS = "".join(chr(c) for c in range(0x064B, 0x0653)) + "\u0670\u0640\u200d\u200e\u200f"
+
+_TABLE = str.maketrans({**CHAR_MAP, **{c: None for c in DELETE_CHARS}})
+_SPACES = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+
+# Arguments for SQL translate(): characters in SQL_TRANSLATE_FROM past the
+# length of SQL_TRANSLATE_TO are deleted, which mirrors DELETE_CHARS.
+SQL_TRANSLATE_FROM = "".join(CHAR_MAP) + DELETE_CHARS
+SQL_TRANSLATE_TO = "".join(CHAR_MAP.values())
+
+
+def normalize(text: str) -> str:
+    """Fold Arabic/Persian variants, digits and ZWNJ; lowercase; squeeze spaces."""
+    if not text:
+        return ""
+    return _SPACES.sub(" ", text.translate(_TABLE)).strip().lower()
+
+
+_LETTERS = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک"})
+
+
+def normalize_spelling(text: str) -> str:
+    """
+    Lighter folding for names that are displayed (provinces, cities):
+    only Arabic ي/ى/ك become Persian ی/ک and spaces are squeezed; ZWNJ and
+    case are kept.
+    """
+    if not text:
+        return ""
+    return _SPACES.sub(" ", text.translate(_LETTERS)).strip()
+
+
+def sql_normalize(expr: str) -> str:
+    """SQL expression applying the same character folding as ``normalize``."""
+    return f"translate({expr}, '{SQL_TRANSLATE_FROM}', '{SQL_TRANSLATE_TO}')"
+
+
+def tokens(text: str) -> List[str]:
+    return _WORD.findall(normalize(text))
+
+
+def prefix_tsquery(text: str) -> str:
+    """
+    Build a ``to_tsquery('simple', ...)`` string where every word of the
+    normalized query must match as a prefix. Returns "" for no usable words.
+    """
+    return " & ".join(f"{t}:*" for t in tokens(text))
@@ -0,0 +1,320 @@
+# update_queue.py
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+import asyncpg
+from aiogram import Bot, Dispatcher, types
+
+from webhook import shard_key
+
+log = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "update_queue"
+
+
+class PostgresUpdateQueue:
+    """
+    Durable hand-off of raw updates from the receiving process (polling or
+    webhook) to ``ShardWorker`` processes.
+
+    Each update is stored with ``shard = shard_key(update) % shards``, i.e.
+    by user id, so all of a user's updates land in the same shard and are
+    consumed in insertion order by whichever worker owns that shard.
+    Every process must use the same number of shards.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, shards: int = 32):
+        self.pool = pool
+        self.shards = shards
+
+    def shard_of(self, key: int) -> int:
+        return key % self.shards
+
+    async def ensure_shards(self) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO update_shards (shard)
+                SELECT generate_series(0, $1 - 1)
+                ON CONFLICT DO NOTHING
+                """,
+                self.shards,
+            )
+
+    async def put(self, updates: Iterable[Dict[str, Any]]) -> int:
+        """Enqueue raw updates (in order) and wake the workers of their shards."""
+        shards, payloads = [], []
+        for update in updates:
+            shards.append(self.shard_of(shard_key(update)))
+            payloads.append(json.dumps(update))
+        if not payloads:
+            return 0
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO update_queue (shard, payload)
+                    SELECT v.shard, v.payload::jsonb
+                    FROM unnest($1::int[], $2::text[]) WITH ORDINALITY AS v(shard, payload, n)
+                    ORDER BY v.n
+                    """,
+                    shards,
+                    payloads,
+                )
+                await conn.execute(
+                    "SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, ",".join(map(str, sorted(set(shards))))
+                )
+        return len(payloads)
+
+    async def submit(self, update: Dict[str, Any]) -> bool:
+        """``UpdateWorkerPool.submit`` counterpart, so the webhook can enqueue directly."""
+        await self.put([update])
+        return True
+
+
+async def poll_into(bot: Bot, queue: PostgresUpdateQueue, timeout: int = 20, limit: int = 100) -> None:
+    """
+    Long-poll getUpdates and enqueue every batch. The offset only moves past
+    a batch after it was committed, so a restart never loses updates.
+    """
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, limit=limit, timeout=timeout)
+        except Exception:
+            log.exception("getUpdates failed")
+            await asyncio.sleep(5)
+            continue
+        if updates:
+            await queue.put(u.to_python() for u in updates)
+            offset = updates[-1].update_id + 1
+
+
+class ShardWorker:
+    """
+    Consumes ``update_queue`` for the shards this process holds a lease on.
+
+    Leases live in ``update_shards`` and are taken with
+    ``FOR UPDATE SKIP LOCKED``, so concurrent workers never block on or
+    double-claim a shard. Every lease cycle each worker renews its row in
+    ``update_workers`` and aims for an even share
+    (``ceil(shards / live workers)``): it takes expired leases up to that
+    share, renews the ones it holds and gives back the extras when a new
+    worker joins. A crashed worker's shards are picked up once its leases
+    expire.
+
+    One task per owned shard processes its updates strictly in order, so
+    each user is handled by exactly one process, one update at a time, while
+    shards run in parallel. Rows are deleted after they were handled
+    (at-least-once: a crash can replay the last batch of a shard).
+
+    ``on_acquire(shards)`` is called before a newly leased shard is
+    consumed; use it to drop per-process cached state of those users.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        queue: PostgresUpdateQueue,
+        lease_seconds: float = 30,
+        batch_size: int = 100,
+        on_acquire: Optional[Callable[[Set[int]], None]] = None,
+        owner: Optional[str] = None,
+    ):
+        self.dp = dp
+        self.queue = queue
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.on_acquire = on_acquire
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.processed = 0
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stops: Dict[int, asyncio.Event] = {}
+        self._wake: Dict[int, asyncio.Event] = {}
+        self._listener: Optional[asyncpg.Connection] = None
+
+    @property
+    def pool(self) -> asyncpg.pool.Pool:
+        return self.queue.pool
+
+    # ----- leases -----
+    async def _claim(self) -> Set[int]:
+        """Renew our membership and leases and top up to our share; returns the shards we now own."""
+        lease = self.lease_seconds
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # every live worker counts, including ones that hold no shard yet
+                await conn.execute(
+                    """
+                    INSERT INTO update_workers (owner, seen_until)
+                    VALUES ($1, NOW() + make_interval(secs => $2))
+                    ON CONFLICT (owner) DO UPDATE SET seen_until = EXCLUDED.seen_until
+                    """,
+                    self.owner,
+                    lease,
+                )
+                await conn.execute("DELETE FROM update_workers WHERE seen_until <= NOW()")
+                workers = await conn.fetchval("SELECT COUNT(*) FROM update_workers")
+                share = math.ceil(self.queue.shards / max(workers, 1))
+                held = await conn.fetch(
+                    """
+                    UPDATE update_shards SET lease_until = NOW() + make_interval(secs => $2)
+                    WHERE owner = $1 AND lease_until > NOW()
+                    RETURNING shard
+                    """,
+                    self.owner,
+                    lease,
+                )
+                taken = []
+                if len(held) < share:
+                    taken = await conn.fetch(
+                        """
+                        UPDATE update_shards s
+                        SET owner = $1, lease_until = NOW() + make_interval(secs => $2)
+                        FROM (
+                            SELECT shard FROM update_shards
+                            WHERE lease_until <= NOW()
+                            ORDER BY shard
+                            LIMIT $3
+                            FOR UPDATE SKIP LOCKED
+                        ) free
+                        WHERE s.shard = free.shard
+                        RETURNING s.shard
+                        """,
+                        self.owner,
+                        lease,
+                        share - len(held),
+                    )
+        owned = {r["shard"] for r in held} | {r["shard"] for r in taken}
+        # hand back extras (highest first) so a new worker can take them; a
+        # shard that is being consumed is released by its task once the
+        # update in flight is done, so the next owner can't overtake it
+        for shard in sorted(owned, reverse=True)[: max(0, len(owned) - share)]:
+            owned.discard(shard)
+            if shard not in self._tasks:
+                await self._release(shard)
+        return owned
+
+    async def _release(self, shard: int) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE update_shards SET owner = NULL, lease_until = 'epoch' WHERE shard = $1 AND owner = $2",
+                shard,
+                self.owner,
+            )
+
+    # ----- consuming -----
+    async def _process(self, update: Dict[str, Any]) -> None:
+        try:
+            await self.dp.process_update(types.Update(**update))
+        except Exception:
+            log.exception("failed to process update %s", update.get("update_id"))
+        self.processed += 1
+
+    async def _consume(self, shard: int, stop: asyncio.Event) -> None:
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        wake = self._wake.setdefault(shard, asyncio.Event())
+        while not stop.is_set():
+            wake.clear()
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT id, payload FROM update_queue WHERE shard = $1 ORDER BY id LIMIT $2",
+                    shard,
+                    self.batch_size,
+                )
+            if not rows:
+                # idle until put() notifies this shard (or we are stopped)
+                await self._wait(wake, stop)
+                continue
+            done = []
+            try:
+                for row in rows:
+                    if stop.is_set():
+                        break
+                    await self._process(json.loads(row["payload"]))
+                    done.append(row["id"])
+            finally:
+                if done:
+                    async with self.pool.acquire() as conn:
+                        await conn.execute("DELETE FROM update_queue WHERE id = ANY($1::bigint[])", done)
+        await self._release(shard)
+
+    @staticmethod
+    async def _wait(wake: asyncio.Event, stop: asyncio.Event) -> None:
+        waiters = [asyncio.ensure_future(wake.wait()), asyncio.ensure_future(stop.wait())]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _listen(self) -> None:
+        """(Re)open the LISTEN connection; wakes every shard, since notifications may have been missed."""
+        if self._listener is not None and not self._listener.is_closed():
+            return
+        if self._listener is not None:
+            await self.pool.release(self._listener)
+        # a pooled connection kept for LISTEN: inserts wake the shard at once
+        self._listener = await self.pool.acquire()
+        await self._listener.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        for event in self._wake.values():
+            event.set()
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        for shard in payload.split(","):
+            event = self._wake.get(int(shard))
+            if event is not None:
+                event.set()
+
+    async def _rebalance(self) -> None:
+        owned = await self._claim()
+        for shard in set(self._tasks) - owned:
+            self._stops[shard].set()
+        acquired = owned - set(self._tasks)
+        if acquired and self.on_acquire is not None:
+            self.on_acquire(acquired)
+        for shard in acquired:
+            stop = asyncio.Event()
+            self._stops[shard] = stop
+            task = asyncio.create_task(self._consume(shard, stop))
+            self._tasks[shard] = task
+            task.add_done_callback(lambda _t, s=shard: self._forget(s))
+        if acquired:
+            log.info("%s: consuming shards %s", self.owner, sorted(self._tasks))
+
+    def _forget(self, shard: int) -> None:
+        self._tasks.pop(shard, None)
+        self._stops.pop(shard, None)
+
+    async def run(self) -> None:
+        """Claim shards and consume them until cancelled."""
+        await self.queue.ensure_shards()
+        try:
+            while True:
+                try:
+                    await self._listen()
+                    await self._rebalance()
+                except Exception:
+                    log.exception("shard rebalance failed")
+                await asyncio.sleep(self.lease_seconds / 3)
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        for stop in self._stops.values():
+            stop.set()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        # leave at once so the remaining workers take over our share
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM update_workers WHERE owner = $1", self.owner)
+        if self._listener is not None:
+            await self._listener.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+            await self.pool.release(self._listener)
+            self._listener = None
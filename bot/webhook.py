@@ -0,0 +1,165 @@
+# webhook.py
+import asyncio
+import hmac
+import inspect
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# update fields whose ``from`` identifies the user the update belongs to
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+_CHAT_FIELDS = ("channel_post", "edited_channel_post")
+
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """
+    User id an update belongs to (chat id for channel posts, update_id as a
+    last resort). Updates with the same key are processed in order.
+    """
+    for field in _USER_FIELDS:
+        obj = update.get(field)
+        if obj and obj.get("from"):
+            return obj["from"]["id"]
+    for field in _CHAT_FIELDS:
+        obj = update.get(field)
+        if obj and obj.get("chat"):
+            return obj["chat"]["id"]
+    return update.get("update_id", 0)
+
+
+class UpdateWorkerPool:
+    """
+    Bounded pool of ``workers`` tasks feeding raw updates to ``dp``.
+
+    Each worker owns a queue and updates are routed to ``shard_key % workers``,
+    so one user's updates run one after another (FSM steps can't race) while
+    different users run concurrently. Queues are bounded: ``submit`` returns
+    False instead of buffering without limit, and the webhook turns that into
+    a non-2xx answer so Telegram re-delivers the update later.
+    """
+
+    def __init__(self, dp: Dispatcher, workers: int = 16, queue_size: int = 1000):
+        self.dp = dp
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        per_worker = max(1, self.queue_size // self.workers)
+        self._queues = [asyncio.Queue(per_worker) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(q)) for q in self._queues]
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        queue = self._queues[shard_key(update) % self.workers]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        # aiogram reads the current Bot/Dispatcher from context variables
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.process_update(types.Update(**update))
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                log.exception("failed to process update %s", update.get("update_id"))
+            finally:
+                queue.task_done()
+
+    async def close(self, timeout: Optional[float] = 30) -> None:
+        """Finish the queued updates (up to ``timeout`` seconds), then stop the workers."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning("webhook shutdown: %d queued updates dropped", self.pending())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def make_app(pool, path: str, secret: Optional[str] = None) -> web.Application:
+    """
+    aiohttp app with a single ``POST path`` endpoint. The update is queued and
+    Telegram gets its 200 right away; handlers run in ``pool`` (an
+    ``UpdateWorkerPool``, or anything with a sync/async ``submit(update)``,
+    e.g. ``update_queue.PostgresUpdateQueue``).
+    """
+
+    async def receive(request: web.Request) -> web.Response:
+        if secret is not None:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token, secret):
+                return web.Response(status=403)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        accepted = pool.submit(update)
+        if inspect.isawaitable(accepted):
+            accepted = await accepted
+        if not accepted:
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    app["update_pool"] = pool
+    return app
+
+
+def run_webhook(dp: Dispatcher, *, url: str, path: str, secret: Optional[str] = None,
+                host: str = "0.0.0.0", port: int = 8080, workers: int = 16,
+                queue_size: int = 1000, sink=None, on_startup=None, on_shutdown=None) -> None:
+    """
+    Serve updates via webhook: register ``url`` with Telegram (pending updates
+    are kept, so nothing is lost across restarts), run the hooks and block
+    until the process is stopped. Updates are handled in-process unless a
+    ``sink`` (e.g. ``PostgresUpdateQueue``) is given.
+    """
+    pool = UpdateWorkerPool(dp, workers=workers, queue_size=queue_size) if sink is None else None
+    app = make_app(sink or pool, path, secret)
+
+    async def startup(app):
+        if on_startup is not None:
+            await on_startup(dp)
+        if pool is not None:
+            pool.start()
+        await dp.bot.set_webhook(url, secret_token=secret, drop_pending_updates=False)
+        log.info("webhook set to %s", url)
+
+    async def shutdown(app):
+        # the webhook stays registered: Telegram keeps queuing updates while we restart
+        if pool is not None:
+            await pool.close()
+        if on_shutdown is not None:
+            await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=host, port=port)
@@ -0,0 +1,119 @@
+# webhook_loadtest.py
+"""
+Load test for the webhook endpoint: POST synthetic updates and report
+updates/second.
+
+    python webhook_loadtest.py --updates 20000 --concurrency 200 --handler-ms 5
+    python webhook_loadtest.py --url http://127.0.0.1:8080/webhook --secret S
+
+Without ``--url`` an in-process server is started (``webhook.make_app`` with a
+stub handler that sleeps ``--handler-ms``), so both the ack rate and the
+processing rate of the worker pool are measured. With ``--url`` only the ack
+rate is measured; point it at a staging bot, not production.
+"""
+import argparse
+import asyncio
+import socket
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiohttp import web
+
+from webhook import SECRET_HEADER, UpdateWorkerPool, make_app
+
+
+def synthetic_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "load"},
+            "text": "loadtest",
+        },
+    }
+
+
+async def post_updates(url, total, concurrency, users, secret=None):
+    """POST ``total`` updates with ``concurrency`` in flight; returns (seconds, status counts)."""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses = {}
+    counter = iter(range(total))
+
+    async def client(session):
+        for i in counter:
+            async with session.post(url, json=synthetic_update(i + 1, 1000 + i % users),
+                                    headers=headers) as resp:
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        return time.perf_counter() - started, statuses
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def local(args):
+    bot = Bot("1:LOADTEST")
+    dp = Dispatcher(bot, storage=MemoryStorage())
+
+    @dp.message_handler()
+    async def handler(message: types.Message):
+        await asyncio.sleep(args.handler_ms / 1000)
+
+    pool = UpdateWorkerPool(dp, workers=args.workers, queue_size=args.queue_size)
+    pool.start()
+    runner = web.AppRunner(make_app(pool, "/webhook", args.secret))
+    await runner.setup()
+    port = _free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    started = time.perf_counter()
+    acked, statuses = await post_updates(
+        f"http://127.0.0.1:{port}/webhook", args.updates, args.concurrency, args.users, args.secret
+    )
+    await pool.close(timeout=None)
+    processed = time.perf_counter() - started
+    await runner.cleanup()
+    await (await bot.get_session()).close()
+
+    report(acked, statuses)
+    print(f"processed: {pool.processed} updates in {processed:.2f}s "
+          f"= {pool.processed / processed:.0f} updates/s "
+          f"({args.workers} workers, {args.handler_ms} ms/handler)")
+
+
+def report(seconds, statuses):
+    ok = statuses.get(200, 0)
+    print(f"acked:     {ok} updates in {seconds:.2f}s = {ok / seconds:.0f} updates/s  statuses={statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="webhook URL of a running bot (default: in-process server)")
+    parser.add_argument("--secret", help="value for the secret-token header")
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=1000, help="distinct synthetic user ids")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=100000)
+    parser.add_argument("--handler-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.url:
+        report(*asyncio.run(post_updates(args.url, args.updates, args.concurrency, args.users, args.secret)))
+    else:
+        asyncio.run(local(args))
+
+
+if __name__ == "__main__":
+    main()